@@ -1,9 +1,32 @@
 # anomaly_detection.py
 import pandas as pd
 import sqlite3
-from db_config import get_db_connection
+import sys
+from db_config import get_db_connection, bump_data_version
+from spike_rollups import clear_rollups, update_rollups
+from spike_partitions import insert_spikes, drop_partitions
+import parquet_store
+import series_store
+from instrumentation import instrument, add_rows
 import numpy as np
 
+# Columns written to the monthly price_spikes partitions (see spike_partitions.py)
+SPIKE_COLUMNS = ["commodity", "market", "state", "date", "old_price", "new_price", "spike_percent", "alert_level",
+                 "z_score"]
+
+# Detection methods: "percent" stores every day-over-day change (alert level from fixed
+# 10/20% thresholds); "zscore" stores only changes that are unusual for their own series.
+METHODS = ("percent", "zscore")
+
+# pipeline_meta key of the highest commodity_prices id a completed run has read
+WATERMARK_KEY = "spike_state:last_id"
+
+# Rolling statistics of each series' daily log returns (EWMA mean and variance)
+EWMA_ALPHA = 0.05     # weight of the newest return (~14-day half-life)
+WARMUP = 20           # returns seen before a series is scored
+Z_THRESHOLD = 3.5     # |z| at or above this is a spike in "zscore" mode
+Z_CLIP = 5.0          # returns are clipped to this many std devs before updating the statistics
+
 # Helper: classify spike severity
 
 def classify_spike(spike_percent):
@@ -15,74 +38,345 @@ def classify_spike(spike_percent):
         return "Low"
 
 
-# Spike detection function (chunked for large data)
+def classify_spikes(spike_percent):
+    """Vectorized classify_spike for an array of spike percentages."""
+    spike_percent = np.asarray(spike_percent, dtype=float)
+    return np.select([spike_percent >= 20, spike_percent >= 10], ["High", "Medium"], default="Low")
+
+
+def classify_z_scores(z_score):
+    """Alert level from a z-score: large rises are High/Medium, everything else Low."""
+    z_score = np.asarray(z_score, dtype=float)
+    return np.select([z_score >= 2 * Z_THRESHOLD, z_score >= 1.5 * Z_THRESHOLD], ["High", "Medium"], default="Low")
+
 
-def detect_spikes(chunk_size=500000):
-    conn = get_db_connection()
-    total_rows = pd.read_sql_query("SELECT COUNT(*) as cnt FROM commodity_prices", conn)['cnt'][0]
-    print(f"🔹 Starting spike detection in chunks... Total rows: {total_rows}")
+# Keyset-ordered streaming of price series
 
-    offset = 0
-    spikes_list = []
+def ensure_spike_state_table(conn):
+    """Create the per-series high-water mark table used by incremental runs."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spike_state (
+            commodity TEXT NOT NULL,
+            market TEXT NOT NULL,
+            last_date TEXT,
+            last_price REAL,
+            last_id INTEGER,
+            ewma_mean REAL,
+            ewma_var REAL,
+            n_obs INTEGER,
+            PRIMARY KEY (commodity, market)
+        )
+    """)
+    conn.commit()
 
-    while offset < total_rows:
-        query = f"""
-        SELECT * FROM commodity_prices
-        LIMIT {chunk_size} OFFSET {offset}
-        """
-        chunk = pd.read_sql_query(query, conn)
 
+def read_watermark(conn):
+    """Highest commodity_prices id covered by the last completed detection run."""
+    row = conn.execute("SELECT value FROM pipeline_meta WHERE key = ?", (WATERMARK_KEY,)).fetchone()
+    if row:
+        # Above the highest price id, the mark belongs to a dropped table (db_reset.py)
+        # and the reloaded rows reuse its ids: they are all unprocessed
+        if row[0] > conn.execute("SELECT COALESCE(MAX(id), 0) FROM commodity_prices").fetchone()[0]:
+            _set_watermark(conn, 0, replace=True)
+            return 0
+        return row[0]
+    # Databases from before the watermark was recorded: their runs completed, so the
+    # highest stored mark is the watermark. Record it before any chunk moves the marks.
+    watermark = conn.execute("SELECT COALESCE(MAX(last_id), 0) FROM spike_state").fetchone()[0]
+    _set_watermark(conn, watermark)
+    return watermark
+
+
+def _set_watermark(conn, value, replace=False):
+    conn.execute(f"""
+        INSERT INTO pipeline_meta (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = {"excluded.value" if replace else "MAX(value, excluded.value)"}
+    """, (WATERMARK_KEY, value))
+    conn.commit()
+
+
+def iter_price_partitions(conn, chunk_size=500000, upper=None):
+    """Stream unprocessed commodity_prices rows ordered by (commodity, market, date).
+
+    Only rows inserted after the last completed run's watermark (up to upper) and
+    dated after their series' last processed date are read. Chunks are committed
+    in series order, not id order, so an interrupted run leaves the watermark
+    alone and the per-series last_date skips what it already stored. Each row carries the series'
+    last processed price as seed_price, so the first new row still gets its
+    day-over-day change, and the series' rolling statistics as seed_mean,
+    seed_var and seed_n, so it is scored without rereading history.
+
+    Each chunk is prefixed with the last row of the previous chunk, so the
+    day-over-day change of a series cut by the chunk boundary is still computed.
+    """
+    watermark = read_watermark(conn)
+    if upper is None:
+        upper = conn.execute("SELECT COALESCE(MAX(id), 0) FROM commodity_prices").fetchone()[0]
+    query = """
+        SELECT p.id, p.commodity, p.market, p.state, p.date, p.price,
+               s.last_price AS seed_price,
+               s.ewma_mean AS seed_mean, s.ewma_var AS seed_var, s.n_obs AS seed_n
+        FROM commodity_prices p
+        LEFT JOIN spike_state s ON s.commodity = p.commodity AND s.market = p.market
+        WHERE p.id > ? AND p.id <= ? AND (s.last_date IS NULL OR p.date > s.last_date)
+        ORDER BY p.commodity, p.market, p.date
+    """
+    carry = None
+    for chunk in pd.read_sql_query(query, conn, params=(watermark, upper), chunksize=chunk_size):
         if chunk.empty:
             break
+        rows = len(chunk)
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        # The carried row was already paired in its own chunk
+        carry = chunk.iloc[[-1]].assign(seed_price=np.nan, seed_mean=np.nan, seed_var=np.nan, seed_n=np.nan)
+        yield chunk, rows
+
+
+def _series_breaks(partition):
+    """Boolean mask marking rows that start a new (commodity, market) series."""
+    commodity = partition["commodity"].to_numpy()
+    market = partition["market"].to_numpy()
+    starts = np.ones(len(partition), dtype=bool)
+    starts[1:] = (commodity[1:] != commodity[:-1]) | (market[1:] != market[:-1])
+    return starts
+
+
+def _previous_prices(partition, starts):
+    """Price each row is compared with: the previous row in its series, or seed_price for a series' first row."""
+    prices = partition["price"].to_numpy(dtype=float)
+    previous = np.empty_like(prices)
+    previous[1:] = prices[:-1]
+    seeds = partition["seed_price"].to_numpy(dtype=float)
+    previous[starts] = seeds[starts]
+    return prices, previous
+
+
+def _seed_column(partition, column, starts, default):
+    if column not in partition:
+        return np.full(int(starts.sum()), default, dtype=float)
+    values = partition[column].to_numpy(dtype=float)[starts]
+    return np.where(np.isnan(values), default, values)
+
+
+def score_partition(partition, carry=None):
+    """Z-score every row's log return against its series' EWMA mean and variance.
+
+    The recurrence is sequential within a series, so rows are processed by their
+    position in the series, each step vectorized across all series. Statistics
+    start from the seed_* columns (spike_state), or from carry, the final
+    statistics of the previous chunk's last series, when that series continues here.
+
+    Returns (z_scores per row, (mean, var, n) final statistics per series).
+    """
+    starts = _series_breaks(partition)
+    prices, previous = _previous_prices(partition, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.where((prices > 0) & (previous > 0), np.log(prices / previous), np.nan)
+
+    series_id = np.cumsum(starts) - 1
+    first_row = np.flatnonzero(starts)
+    position = np.arange(len(partition)) - first_row[series_id]
+
+    mean = _seed_column(partition, "seed_mean", starts, 0.0)
+    var = _seed_column(partition, "seed_var", starts, 0.0)
+    count = _seed_column(partition, "seed_n", starts, 0.0)
+    if carry is not None and len(partition) and carry[0] == (partition["commodity"].iat[0], partition["market"].iat[0]):
+        mean[0], var[0], count[0] = carry[1]
+
+    z_scores = np.full(len(partition), np.nan)
+    order = np.argsort(position, kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(position))))
+    for step in range(len(bounds) - 1):
+        rows = order[bounds[step]:bounds[step + 1]]
+        rows = rows[~np.isnan(returns[rows])]
+        if not len(rows):
+            continue
+        sid = series_id[rows]
+        value = returns[rows]
+        m, v, n = mean[sid], var[sid], count[sid]
+        std = np.sqrt(v)
+
+        scored = (n >= WARMUP) & (std > 0)
+        z_scores[rows[scored]] = (value[scored] - m[scored]) / std[scored]
+
+        # Clipped update keeps one extreme jump from inflating the variance
+        deviation = np.where(std > 0, np.clip(value - m, -Z_CLIP * std, Z_CLIP * std), value - m)
+        deviation = np.where(n == 0, 0.0, deviation)
+        mean[sid] = np.where(n == 0, value, m + EWMA_ALPHA * deviation)
+        var[sid] = (1 - EWMA_ALPHA) * (v + EWMA_ALPHA * deviation ** 2)
+        count[sid] = n + 1
+
+    return z_scores, (mean, var, count)
+
+
+def compute_spikes(partition, z_scores=None, method="percent"):
+    """Compute day-over-day spikes for a partition ordered by series key.
+
+    Works on whole columns at once: a row is paired with the previous row
+    whenever both belong to the same (commodity, market) series, and the
+    first row of a series is paired with its seed_price when one is known.
+
+    method="percent" keeps every pair and classifies it by percent change;
+    method="zscore" keeps only pairs with |z| >= Z_THRESHOLD and classifies by z.
+    """
+    starts = _series_breaks(partition)
+    prices, previous = _previous_prices(partition, starts)
+    if z_scores is None:
+        z_scores = np.full(len(partition), np.nan)
+
+    if method == "zscore":
+        new_idx = np.flatnonzero(np.abs(np.nan_to_num(z_scores)) >= Z_THRESHOLD)
+    else:
+        new_idx = np.flatnonzero(~np.isnan(previous))
+    old_prices = previous[new_idx]
+    new_prices = prices[new_idx]
+    z_values = z_scores[new_idx]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spike_percent = ((new_prices - old_prices) / old_prices) * 100
+
+    return pd.DataFrame({
+        "commodity": partition["commodity"].to_numpy()[new_idx],
+        "market": partition["market"].to_numpy()[new_idx],
+        "state": partition["state"].to_numpy()[new_idx],
+        "date": partition["date"].to_numpy()[new_idx],
+        "old_price": old_prices,
+        "new_price": new_prices,
+        "spike_percent": spike_percent,
+        "alert_level": classify_z_scores(z_values) if method == "zscore" else classify_spikes(spike_percent),
+        "z_score": z_values,
+    }, columns=SPIKE_COLUMNS)
+
+
+def update_spike_state(conn, partition, statistics=None):
+    """Advance the high-water mark and rolling statistics of every series seen in the partition.
+
+    Does not commit: the marks must land in the same transaction as the spikes
+    they account for, or a crash in between would re-detect (and duplicate) them.
+    """
+    starts = np.flatnonzero(_series_breaks(partition))
+    ends = np.append(starts[1:], len(partition)) - 1
+    last_ids = np.maximum.reduceat(partition["id"].to_numpy(), starts)
+    if statistics is None:
+        statistics = (np.full(len(starts), np.nan),) * 2 + (np.zeros(len(starts)),)
+    mean, var, count = statistics
+
+    state_rows = zip(
+        partition["commodity"].to_numpy()[ends],
+        partition["market"].to_numpy()[ends],
+        partition["date"].to_numpy()[ends],
+        partition["price"].to_numpy(dtype=float)[ends].tolist(),
+        last_ids.tolist(),
+        mean.tolist(),
+        var.tolist(),
+        count.astype(np.int64).tolist(),
+    )
+    conn.executemany("""
+        INSERT INTO spike_state (commodity, market, last_date, last_price, last_id, ewma_mean, ewma_var, n_obs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (commodity, market) DO UPDATE SET
+            last_date = excluded.last_date,
+            last_price = excluded.last_price,
+            last_id = MAX(last_id, excluded.last_id),
+            ewma_mean = excluded.ewma_mean,
+            ewma_var = excluded.ewma_var,
+            n_obs = excluded.n_obs
+    """, state_rows)
+
+
+# Spike detection function (streamed in key order)
+
+@instrument()
+def detect_spikes(chunk_size=500000, full_rebuild=False, method="percent"):
+    """Detect spikes for price rows added since the last run.
+
+    method is "percent" (every day-over-day change, fixed thresholds) or "zscore"
+    (only changes unusual for their series; see score_partition). Rolling
+    statistics are kept in spike_state in both modes. Switching methods only
+    affects new rows; use full_rebuild to rescore the history.
+
+    With full_rebuild=True the stored spikes and high-water marks are cleared
+    and the whole history is processed again.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown detection method {method!r}; expected one of {METHODS}")
+    conn = get_db_connection(bulk=True)
+    ensure_spike_state_table(conn)
+
+    if full_rebuild:
+        drop_partitions(conn)
+        conn.execute("DELETE FROM spike_state")
+        conn.commit()
+        _set_watermark(conn, 0, replace=True)
+        clear_rollups(conn)
+        # Readers holding spike rows must reload rather than append (see visualization.get_spikes)
+        bump_data_version(conn, "price_spikes:rebuild")
+        print("🔹 Full rebuild: cleared price_spikes, spike state and rollups")
+
+    mode = "full" if full_rebuild else "incremental"
+    print(f"🔹 Starting {mode} {method} spike detection in chunks...")
+
+    processed = 0
+    total_spikes = 0
+    # Rows inserted while this run is going are left for the next one
+    upper = conn.execute("SELECT COALESCE(MAX(id), 0) FROM commodity_prices").fetchone()[0]
+
+    if full_rebuild and series_store.is_current(conn):
+        # Whole-history scan straight from the memory-mapped series arrays
+        print("🔹 Reading price history from the series store")
+        partitions = series_store.iter_partitions(series_store.open_store(), chunk_size)
+    elif full_rebuild and parquet_store.is_current(conn):
+        # Whole-history scan: read the columnar store one commodity at a time
+        print("🔹 Reading price history from the Parquet store")
+        partitions = ((series.assign(seed_price=np.nan), len(series)) for series in parquet_store.iter_commodity_series())
+    else:
+        partitions = iter_price_partitions(conn, chunk_size, upper)
+
+    carry = None
+    for partition, rows in partitions:
+        z_scores, statistics = score_partition(partition, carry)
+        spikes_df = compute_spikes(partition, z_scores, method)
+
+        # Save to database as we go, so memory stays bounded by one chunk. Spikes, rollups
+        # and high-water marks of a chunk are committed together: all of them or none.
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN")
+        try:
+            stored = insert_spikes(conn, spikes_df)
+            update_rollups(conn, spikes_df)
+            update_spike_state(conn, partition, statistics)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        total_spikes += stored
+        # The last series may continue in the next chunk (see iter_price_partitions)
+        carry = ((partition["commodity"].iat[-1], partition["market"].iat[-1]),
+                 tuple(values[-1] for values in statistics))
+
+        processed += rows
+        add_rows(rows)
+        print(f"Processed {processed} new rows")
+
+    # Only a completed run moves the watermark
+    _set_watermark(conn, upper)
 
-        # Convert date to datetime
-        chunk['date'] = pd.to_datetime(chunk['date'])
-
-        # Group by commodity + market
-        grouped = chunk.groupby(['commodity', 'market'])
-
-        for (commodity, market), group in grouped:
-            group = group.sort_values('date')
-            prices = group['price'].values
-
-            if len(prices) < 2:
-                continue  # Need at least 2 days to detect spike
-
-            # Compute percentage change
-            old_prices = prices[:-1]
-            new_prices = prices[1:]
-            spike_percent = ((new_prices - old_prices) / old_prices) * 100
-
-            for i, pct in enumerate(spike_percent):
-                spikes_list.append({
-                    "commodity": commodity,
-                    "market": market,
-                    "state": group['state'].values[i+1] if 'state' in group.columns else None,
-                    "date": group['date'].values[i+1],
-                    "old_price": old_prices[i],
-                    "new_price": new_prices[i],
-                    "spike_percent": pct,
-                    "alert_level": classify_spike(pct)
-                })
-
-        offset += chunk_size
-        print(f"Processed {offset}/{total_rows} rows")
-
-    # Convert to DataFrame
-    spikes_df = pd.DataFrame(spikes_list)
-
-    # Save to database
-    if not spikes_df.empty:
-        spikes_df.to_sql("price_spikes", conn, if_exists="append", index=False)
-        print(f"✅ Detected and stored {len(spikes_df)} spikes!")
+    if total_spikes:
+        print(f"✅ Detected and stored {total_spikes} spikes!")
     else:
         print("✅ No spikes detected in this run.")
 
+    if total_spikes or full_rebuild:
+        bump_data_version(conn, "price_spikes")
     conn.close()
+    return total_spikes
 
 
 
 # Run as script
 
 if __name__ == "__main__":
-    detect_spikes()
+    detect_spikes(full_rebuild="--full-rebuild" in sys.argv,
+                  method="zscore" if "--zscore" in sys.argv else "percent")
@@ -0,0 +1,546 @@
+# benchmarks.py
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import sys
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import db_config
+from fetch_prices import load_csv, load_csv_typed, iter_historical_files, DATE_FORMAT
+
+
+def measure(func, *args, **kwargs):
+    """Run func twice: once for wall time, once under tracemalloc for peak memory (MB)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args, **kwargs)
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, seconds, peak_mb
+
+
+def compare_csv_readers(file_path):
+    """Compare load_csv with the typed reader (C and pyarrow engines) on one CSV."""
+    readers = {
+        "load_csv": lambda: load_csv(file_path),
+        "typed (c)": lambda: load_csv_typed(file_path),
+    }
+    try:
+        import pyarrow  # noqa: F401
+        readers["typed (pyarrow)"] = lambda: load_csv_typed(file_path, engine="pyarrow")
+    except ImportError:
+        pass
+
+    results = {}
+    for name, reader in readers.items():
+        df, seconds, peak_mb = measure(reader)
+        frame_mb = df.memory_usage(deep=True).sum() / 1e6
+        results[name] = {"rows": len(df), "seconds": seconds, "peak_mb": peak_mb, "frame_mb": frame_mb}
+
+    baseline = results["load_csv"]
+    print(f"📊 Reader comparison for {file_path}")
+    for name, r in results.items():
+        print(f"   {name:16s} {r['rows']:>9} rows  {r['seconds']:7.2f}s  "
+              f"peak {r['peak_mb']:8.1f} MB  frame {r['frame_mb']:8.1f} MB  "
+              f"speedup x{baseline['seconds'] / r['seconds']:.1f}  "
+              f"memory x{baseline['peak_mb'] / r['peak_mb']:.1f}")
+    return results
+
+
+def compare_sql_writers(df):
+    """Compare DataFrame.to_sql with db_config.bulk_insert, each into a fresh database."""
+    def to_sql(conn):
+        df.to_sql("commodity_prices", conn, if_exists="append", index=False)
+
+    def bulk(conn):
+        db_config.apply_pragmas(conn)
+        db_config.bulk_insert(conn, "commodity_prices", df)
+
+    results = {}
+    db_path = db_config.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, writer in {"to_sql": to_sql, "bulk_insert": bulk}.items():
+            db_config.DB_PATH = os.path.join(tmp, f"{name}.db")
+            db_config.initialize_database()
+            conn = sqlite3.connect(db_config.DB_PATH)
+            start = time.perf_counter()
+            writer(conn)
+            seconds = time.perf_counter() - start
+            conn.close()
+            results[name] = {"rows": len(df), "seconds": seconds, "rows_per_sec": len(df) / seconds}
+    db_config.DB_PATH = db_path
+
+    print(f"📊 Writer comparison for {len(df)} rows")
+    for name, r in results.items():
+        print(f"   {name:12s} {r['seconds']:7.2f}s  {r['rows_per_sec']:>10.0f} rows/s  "
+              f"speedup x{results['to_sql']['seconds'] / r['seconds']:.1f}")
+    return results
+
+
+# -----------------------------
+# Synthetic Agmarknet data
+# -----------------------------
+SCALES = {"100k": 100_000, "1m": 1_000_000, "4m": 4_000_000, "20m": 20_000_000}
+BENCH_DIR = os.path.join(os.path.dirname(__file__), "..", "benchmark_data")
+GENERATOR_VERSION = 1      # bump when the generated data changes, so cached CSVs are regenerated
+
+# Roughly the cardinalities of the Agmarknet daily price export
+N_STATES = 30
+N_DISTRICTS = 550
+N_MARKETS = 3000
+N_COMMODITIES = 350
+MAX_VARIETIES = 6
+COMMODITY_SKEW = 0.8       # Zipf exponent: a few staples (onion, potato, ...) trade in most markets
+
+SERIES_DAYS = 250          # mean reported days per (market, commodity, variety) series
+REPORT_PROBABILITY = 0.8   # markets do not report every day; gaps are geometric
+HISTORY_START = "2012-01-01"
+HISTORY_DAYS = 12 * 365
+DAILY_VOLATILITY = 0.02    # std of the daily log-price change
+SPIKE_RATE = 0.01          # share of days with a one-day price spike
+ROWS_PER_FILE = 500_000
+
+
+def _series_keys(rng, n_series):
+    """Distinct (market, commodity, variety) codes, commodities drawn with Zipf weights."""
+    weights = 1.0 / np.arange(1, N_COMMODITIES + 1) ** COMMODITY_SKEW
+    weights /= weights.sum()
+    varieties = rng.integers(1, MAX_VARIETIES + 1, N_COMMODITIES)
+    keys = np.empty(0, dtype=np.int64)
+    while len(keys) < n_series:
+        need = 2 * (n_series - len(keys))
+        commodity = rng.choice(N_COMMODITIES, need, p=weights)
+        variety = (rng.random(need) * varieties[commodity]).astype(np.int64)
+        market = rng.integers(0, N_MARKETS, need)
+        drawn = (market * N_COMMODITIES + commodity) * MAX_VARIETIES + variety
+        keys = np.unique(np.concatenate((keys, drawn)))
+    keys = rng.permutation(keys)[:n_series]
+    return keys // (N_COMMODITIES * MAX_VARIETIES), keys // MAX_VARIETIES % N_COMMODITIES, keys % MAX_VARIETIES
+
+
+def _cumsum_by_series(values, lengths):
+    """Running sum of values restarting at the first row of every series."""
+    total = np.cumsum(values)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return total - np.repeat(total[starts] - values[starts], lengths)
+
+
+def _names(prefix, count):
+    return np.array([f"{prefix} {i}" for i in range(count)], dtype=object)
+
+
+def _write_file(path, seed, index, series):
+    """Generate and write one CSV holding whole series, rows ordered by arrival date like the export."""
+    rng = np.random.default_rng([seed, index])
+    lengths = series["length"]
+    rows = int(lengths.sum())
+
+    gaps = rng.geometric(REPORT_PROBABILITY, rows)
+    gaps[np.concatenate(([0], np.cumsum(lengths)[:-1]))] = 0
+    days = np.minimum(np.repeat(series["start"], lengths) + _cumsum_by_series(gaps, lengths), HISTORY_DAYS - 1)
+
+    walk = _cumsum_by_series(rng.normal(0.0, DAILY_VOLATILITY, rows), lengths)
+    spikes = np.where(rng.random(rows) < SPIKE_RATE, np.log(rng.uniform(1.3, 2.2, rows)), 0.0)
+    modal = np.round(np.repeat(series["base"], lengths) * np.exp(walk + spikes))
+    spread = rng.uniform(0.0, 0.12, (2, rows))
+
+    market, commodity = np.repeat(series["market"], lengths), np.repeat(series["commodity"], lengths)
+    district = market % N_DISTRICTS
+    order = np.argsort(days, kind="stable")
+    dates = pd.date_range(HISTORY_START, periods=HISTORY_DAYS).strftime(DATE_FORMAT).to_numpy()
+    pd.DataFrame({
+        "State": _names("State", N_STATES)[district % N_STATES][order],
+        "District": _names("District", N_DISTRICTS)[district][order],
+        "Market": _names("Market", N_MARKETS)[market][order],
+        "Commodity": _names("Commodity", N_COMMODITIES)[commodity][order],
+        "Variety": _names("Variety", MAX_VARIETIES)[np.repeat(series["variety"], lengths)][order],
+        "Arrival_Date": dates[days[order]],
+        "Min_x0020_Price": np.round(modal * (1 - spread[0])).astype(np.int64)[order],
+        "Max_x0020_Price": np.round(modal * (1 + spread[1])).astype(np.int64)[order],
+        "Modal_x0020_Price": modal.astype(np.int64)[order],
+    }).to_csv(path, index=False)
+    return rows
+
+
+def generate_dataset(rows, out_dir, seed=0, rows_per_file=ROWS_PER_FILE):
+    """Write rows of Agmarknet-shaped price CSVs into out_dir; returns the file paths.
+
+    The output depends only on (rows, seed, GENERATOR_VERSION), so a matching
+    dataset from an earlier run is reused instead of regenerated.
+    """
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    manifest = {"rows": rows, "seed": seed, "generator_version": GENERATOR_VERSION}
+    try:
+        with open(manifest_path) as f:
+            existing = json.load(f)
+        if {key: existing.get(key) for key in manifest} == manifest:
+            return [os.path.join(out_dir, name) for name in existing["files"]]
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(SERIES_DAYS // 5, 2 * SERIES_DAYS - SERIES_DAYS // 5 + 1, rows // (SERIES_DAYS // 5) + 1)
+    n_series = int(np.searchsorted(np.cumsum(lengths), rows)) + 1
+    lengths = lengths[:n_series]
+    lengths[-1] -= int(lengths.sum()) - rows
+
+    market, commodity, variety = _series_keys(rng, n_series)
+    commodity_base = rng.lognormal(np.log(2500), 0.7, N_COMMODITIES)
+    series = {
+        "market": market, "commodity": commodity, "variety": variety, "length": lengths,
+        # Leave room for the longest series (with gaps) before the end of the history
+        "start": rng.integers(0, HISTORY_DAYS - 4 * SERIES_DAYS, n_series),
+        "base": commodity_base[commodity] * rng.lognormal(0.0, 0.15, n_series),
+    }
+
+    # Files hold whole series, about rows_per_file rows each
+    bounds = np.searchsorted(np.cumsum(lengths), np.arange(rows_per_file, rows, rows_per_file), side="right")
+    files = []
+    for index, (first, last) in enumerate(zip(np.concatenate(([0], bounds)), np.append(bounds, n_series))):
+        if first == last:
+            continue
+        name = f"agmarknet_{index:04d}.csv"
+        _write_file(os.path.join(out_dir, name), seed, index,
+                    {key: values[first:last] for key, values in series.items()})
+        files.append(name)
+
+    with open(manifest_path, "w") as f:
+        json.dump({**manifest, "series": n_series, "files": files}, f)
+    print(f"✅ Generated {rows} rows ({n_series} series) in {len(files)} files under {out_dir}")
+    return [os.path.join(out_dir, name) for name in files]
+
+
+# -----------------------------
+# Stage benchmarks
+# -----------------------------
+FORECAST_SAMPLE = 10       # series forecast one at a time with forecast_prices (ARIMA)
+API_REQUESTS = 20          # warm /api/options requests after the first (cold) one
+REGRESSION_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05  # ignore slowdowns smaller than this (timer noise on tiny stages)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if the platform does not report it."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1e6
+    except (ImportError, AttributeError):
+        return None
+
+
+def _configure(work_dir):
+    """Point the database, the derived stores and the metrics log at the benchmark's work directory."""
+    import instrumentation
+    import parquet_store
+    import series_store
+    db_config.DB_PATH = os.path.join(work_dir, "spikealert.db")
+    parquet_store.STORE_DIR = os.path.join(work_dir, "prices_parquet")
+    series_store.STORE_DIR = os.path.join(work_dir, "series_store")
+    instrumentation.configure(metrics_log=os.path.join(work_dir, "pipeline_metrics.jsonl"))
+
+
+def _price_rows():
+    conn = db_config.get_db_connection()
+    rows = conn.execute("SELECT COUNT(*) FROM commodity_prices").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def bench_load_csv(files):
+    return {"rows": sum(len(load_csv(path)) for path in files)}
+
+
+def bench_load_csv_typed(files):
+    return {"rows": sum(len(load_csv_typed(path)) for path in files)}
+
+
+def bench_store_in_database(files):
+    """Load every file into a fresh database; seconds counts store_in_database only, not CSV parsing."""
+    from fetch_prices import store_in_database
+    db_config.initialize_database()
+    rows, seconds = 0, 0.0
+    for path in files:
+        df = load_csv_typed(path)
+        start = time.perf_counter()
+        store_in_database(df)
+        seconds += time.perf_counter() - start
+        rows += len(df)
+    return {"rows": rows, "seconds": seconds}
+
+
+def bench_series_store(files):
+    import series_store
+    return {"rows": series_store.build()}
+
+
+def bench_detect_spikes(files):
+    from anomaly_detection import detect_spikes
+    spikes = detect_spikes(full_rebuild=True)
+    return {"rows": _price_rows(), "spikes": spikes}
+
+
+def bench_forecast_prices(files):
+    """ARIMA forecasts for the FORECAST_SAMPLE longest series, one call each."""
+    from forecast import forecast_prices
+    conn = db_config.get_db_connection()
+    pairs = conn.execute("""
+        SELECT commodity, market FROM commodity_prices GROUP BY commodity, market
+        ORDER BY COUNT(*) DESC, commodity, market LIMIT ?
+    """, (FORECAST_SAMPLE,)).fetchall()
+    conn.close()
+    forecast = sum(forecast_prices(commodity, market) is not None for commodity, market in pairs)
+    return {"rows": len(pairs), "forecast": forecast}
+
+
+def bench_forecast_all(files):
+    from forecast import forecast_all
+    forecast, failures = forecast_all(model="ses")
+    return {"rows": forecast, "failed": len(failures)}
+
+
+def bench_spike_propagation(files):
+    """Lagged cross-correlation of every market pair per commodity (rows = price rows)."""
+    from spike_propagation import compute_propagation
+    edges = compute_propagation()
+    return {"rows": _price_rows(), "edges": edges}
+
+
+def bench_visualization(files):
+    """Build every dashboard figure from the rollups and the spike rows (rows = spike rows)."""
+    import visualization as vis
+    from spike_rollups import load_rollups
+    conn = db_config.get_db_connection()
+    rollups = load_rollups(conn)
+    spikes_df = vis._read_spikes(conn, 0)
+    conn.close()
+    if rollups["commodity"].empty:
+        raise RuntimeError("no spikes to chart")
+
+    top_commodity = rollups["commodity"].set_index("commodity")["spike_percent"].idxmax()
+    figures = {
+        "commodity_spike_bar": (rollups["commodity"],),
+        "market_spike_pie": (rollups["market"],),
+        "top_markets_for_top_commodity": (rollups["market_commodity"], top_commodity),
+        "top10_commodities_spikes": (rollups["commodity"],),
+        "state_wise_spike_map": (rollups["state"],),
+        "market_commodity_heatmap": (rollups["market_commodity"],),
+        "spike_severity_pie": (rollups["commodity_alert"],),
+        "spike_trend_over_time": (rollups["monthly"],),
+        "commodity_severity_heatmap": (rollups["commodity_alert"],),
+        "top_states_by_spike": (rollups["state"],),
+        "spike_count_per_market": (rollups["market"],),
+        "monthly_spike_heatmap": (rollups["monthly"],),
+        "commodity_box_plot": (spikes_df,),
+        "market_spike_scatter": (spikes_df,),
+        "cumulative_spikes_timeline": (spikes_df,),
+    }
+    seconds = {}
+    for name, args in figures.items():
+        start = time.perf_counter()
+        getattr(vis, name)(*args).to_json()
+        seconds[name] = round(time.perf_counter() - start, 4)
+    return {"rows": len(spikes_df), "seconds": sum(seconds.values()), "figures": seconds}
+
+
+def bench_api_options(files):
+    """One cold and API_REQUESTS warm /api/options requests through the Flask test client."""
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        "frontend_app", os.path.join(os.path.dirname(__file__), "..", "frontend", "app.py"))
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
+    app_module.DB_PATH = db_config.DB_PATH
+    client = app_module.app.test_client()
+
+    timings = []
+    for _ in range(API_REQUESTS + 1):
+        start = time.perf_counter()
+        response = client.get("/api/options")
+        timings.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/options returned {response.status_code}")
+    return {"rows": len(timings), "seconds": sum(timings),
+            "cold_ms": round(timings[0] * 1000, 2), "warm_ms": round(float(np.median(timings[1:])) * 1000, 2)}
+
+# Run in this order: later stages read what store_in_database / detect_spikes wrote
+BENCH_STAGES = {
+    "load_csv": bench_load_csv,
+    "load_csv_typed": bench_load_csv_typed,
+    "store_in_database": bench_store_in_database,
+    "series_store": bench_series_store,
+    "detect_spikes": bench_detect_spikes,
+    "forecast_prices": bench_forecast_prices,
+    "forecast_all": bench_forecast_all,
+    "spike_propagation": bench_spike_propagation,
+    "visualization": bench_visualization,
+    "api_options": bench_api_options,
+}
+
+
+def _stage_process(name, files, work_dir, results):
+    _configure(work_dir)
+    start = time.perf_counter()
+    try:
+        result = BENCH_STAGES[name](files)
+    except Exception as e:
+        result = {"rows": 0, "error": str(e)}
+    wall = time.perf_counter() - start
+    result.setdefault("seconds", wall)
+    result["wall_seconds"] = wall
+    result["rows_per_sec"] = result["rows"] / result["seconds"] if result["seconds"] > 0 else None
+    result["peak_rss_mb"] = peak_rss_mb()
+    results.put(result)
+
+
+def run_stage(name, files, work_dir):
+    """Run one stage in a fresh process, so its peak RSS is its own and not an earlier stage's."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_stage_process, args=(name, files, work_dir, results))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            # Killed (e.g. out of memory) before it could report
+            if not process.is_alive():
+                return {"rows": 0, "seconds": 0.0, "rows_per_sec": None, "peak_rss_mb": None,
+                        "error": f"stage process exited with code {process.exitcode}"}
+    process.join()
+    return result
+
+
+def run_suite(scales=("100k",), seed=0, stages=None, data_dir=BENCH_DIR, keep_work=False):
+    """Generate (or reuse) each scale's dataset and benchmark every stage on it.
+
+    Returns a JSON-serializable dict: environment details plus, per scale, one
+    record per stage with rows, seconds, rows_per_sec, wall_seconds and peak_rss_mb.
+    """
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "seed": seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+        "scales": {},
+    }
+    for scale in scales:
+        rows = SCALES[scale]
+        start = time.perf_counter()
+        files = generate_dataset(rows, os.path.join(data_dir, f"{scale}-seed{seed}"), seed)
+        scale_results = {"rows": rows, "files": len(files), "generate_seconds": time.perf_counter() - start,
+                         "stages": {}}
+
+        work_dir = os.path.join(data_dir, f"{scale}-seed{seed}-work")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        for name in stages or BENCH_STAGES:
+            print(f"🔹 [{scale}] {name}")
+            result = run_stage(name, files, work_dir)
+            scale_results["stages"][name] = result
+            if "error" in result:
+                print(f"❌ [{scale}] {name} failed: {result['error']}")
+        if not keep_work:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        results["scales"][scale] = scale_results
+        print_results(scale, scale_results)
+    return results
+
+
+def print_results(scale, scale_results):
+    print(f"📊 Benchmark {scale} ({scale_results['rows']} rows, {scale_results['files']} files)")
+    for name, r in scale_results["stages"].items():
+        rate = f"{r['rows_per_sec']:>12.0f} rows/s" if r.get("rows_per_sec") else " " * 19
+        rss = f"{r['peak_rss_mb']:8.0f} MB" if r.get("peak_rss_mb") is not None else ""
+        print(f"   {name:18s} {r['seconds']:8.2f}s {rate}  peak {rss}" + (" ❌" if "error" in r else ""))
+
+
+# -----------------------------
+# Results and regressions
+# -----------------------------
+def save_results(results, path=None):
+    path = path or os.path.join(BENCH_DIR, f"results-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Saved benchmark results to {path}")
+    return path
+
+
+def compare_results(current, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Stages slower (seconds) or bigger (peak RSS) than the baseline by more than tolerance.
+
+    Only scales and stages present in both runs are compared. Returns a list of
+    (scale, stage, metric, baseline value, current value).
+    """
+    regressions = []
+    for scale, scale_results in current["scales"].items():
+        base_stages = baseline.get("scales", {}).get(scale, {}).get("stages", {})
+        for name, r in scale_results["stages"].items():
+            base = base_stages.get(name)
+            if not base or "error" in base:
+                continue
+            if "error" in r:
+                regressions.append((scale, name, "error", None, r["error"]))
+                continue
+            if (r["seconds"] > base["seconds"] * (1 + tolerance)
+                    and r["seconds"] - base["seconds"] > MIN_REGRESSION_SECONDS):
+                regressions.append((scale, name, "seconds", base["seconds"], r["seconds"]))
+            if base.get("peak_rss_mb") and r.get("peak_rss_mb") and r["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+                regressions.append((scale, name, "peak_rss_mb", base["peak_rss_mb"], r["peak_rss_mb"]))
+
+    if regressions:
+        print(f"❌ {len(regressions)} regressions against the baseline (tolerance {tolerance:.0%}):")
+        for scale, name, metric, before, after in regressions:
+            change = f"{before:.2f} → {after:.2f}" if metric != "error" else str(after)
+            print(f"   [{scale}] {name} {metric}: {change}")
+    else:
+        print(f"✅ No regressions against the baseline (tolerance {tolerance:.0%})")
+    return regressions
+
+
+def _arg(flag, default=None):
+    """Value following flag on the command line, e.g. --baseline results.json."""
+    if flag in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(flag) + 1]
+    return default
+
+
+if __name__ == "__main__":
+    if "--suite" in sys.argv:
+        # python benchmarks.py --suite [100k 1m 4m 20m] [--seed N] [--output f.json] [--baseline f.json]
+        results = run_suite([arg for arg in sys.argv if arg in SCALES] or ["100k"], seed=int(_arg("--seed", 0)),
+                            keep_work="--keep" in sys.argv)
+        save_results(results, _arg("--output"))
+        if _arg("--baseline"):
+            with open(_arg("--baseline")) as f:
+                sys.exit(1 if compare_results(results, json.load(f)) else 0)
+    elif len(sys.argv) > 1:
+        compare_csv_readers(sys.argv[1])
+    else:
+        # Full historical set
+        frames = [load_csv_typed(path) for path in iter_historical_files()]
+        compare_sql_writers(pd.concat(frames, ignore_index=True))
@@ -1,9 +1,14 @@
 import pandas as pd
 from db_config import get_db_connection
+import parquet_store
 
 conn = get_db_connection()
-query = "SELECT commodity, market, COUNT(*) as cnt FROM commodity_prices GROUP BY commodity, market"
-df = pd.read_sql_query(query, conn)
+if parquet_store.is_current(conn):
+    prices = parquet_store.read_prices(["commodity", "market"])
+    df = prices.groupby(["commodity", "market"], observed=True).size().reset_index(name="cnt")
+else:
+    query = "SELECT commodity, market, COUNT(*) as cnt FROM commodity_prices GROUP BY commodity, market"
+    df = pd.read_sql_query(query, conn)
 conn.close()
 
 # Show pairs with at least 5 entries
@@ -1,15 +1,29 @@
-from fetch_prices import fetch_and_combine_data, store_in_database
+from fetch_prices import fetch_and_combine_data, store_in_database, ingest_parallel
 from anomaly_detection import detect_spikes
+from db_config import get_db_connection
+import series_store
 
-def run_pipeline():
-    # Fetch + combine historical + real-time data
-    df = fetch_and_combine_data()
+def run_pipeline(full_rebuild=False, parallel=True, workers=None, method="percent"):
+    if parallel:
+        # Normalize CSVs in a process pool, storing each file as it finishes
+        ingest_parallel(workers=workers)
+    else:
+        # Fetch + combine historical + real-time data
+        df = fetch_and_combine_data()
 
-    # Store into database
-    store_in_database(df)
+        # Store into database, rebuilding indexes once after the full load
+        store_in_database(df, rebuild_indexes=True)
 
-    # Run anomaly detection
-    detect_spikes()
+    # A full rebuild scans every series, so refresh the memory-mapped store first;
+    # incremental detection reads only the new rows from SQL and skips it
+    if full_rebuild:
+        conn = get_db_connection()
+        if not series_store.is_current(conn):
+            series_store.build(conn)
+        conn.close()
+
+    # Run anomaly detection (incremental unless a full rebuild is requested; method "percent" or "zscore")
+    detect_spikes(full_rebuild=full_rebuild, method=method)
 
 if __name__ == "__main__":
     run_pipeline()
@@ -1,19 +1,157 @@
 import sqlite3
 import os
+import datetime
+import numpy as np
+import pandas as pd
+from instrumentation import connection_factory
 
 # Define path to your database file
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "database", "spikealert.db")
 
-def get_db_connection():
-    """Return a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+# Pragmas applied to connections used for large writes
+BULK_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -262144,     # negative = KiB, i.e. 256 MB
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,    # 256 MB
+}
+
+# Rows per executemany call
+BATCH_SIZE = 50000
+
+# Seconds a connection waits for another writer (pipeline stages can run concurrently)
+BUSY_TIMEOUT = 60
+
+def get_db_connection(bulk=False):
+    """Return a connection to the SQLite database.
+
+    bulk=True applies BULK_PRAGMAS, for connections that write many rows.
+    Queries are timed per stage (see instrumentation.py).
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, factory=connection_factory())
+    if bulk:
+        apply_pragmas(conn)
     return conn
 
-def initialize_database():
-    """Create tables if they don't exist."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def apply_pragmas(conn, pragmas=None):
+    """Apply tuned pragmas (BULK_PRAGMAS by default) to a connection."""
+    for name, value in (pragmas or BULK_PRAGMAS).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+def _table_indexes(conn, table):
+    """Return (name, sql) of the explicitly created, non-unique indexes on a table.
+
+    Unique indexes enforce constraints (and back upserts), so they are never dropped.
+    """
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+        "AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'",
+        (table,),
+    ).fetchall()
+
+def _sql_column(values):
+    """Convert one column to a list of values sqlite3 can bind (NaN -> NULL, dates -> ISO text)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Convert the categories once, then index them with the codes (-1 picks the trailing None)
+        categories = _sql_column(pd.Series(values.cat.categories))
+        lookup = np.array(categories + [None], dtype=object)
+        return lookup[values.cat.codes.to_numpy()].tolist()
+    if pd.api.types.is_float_dtype(values):
+        # SQLite stores bound NaN as NULL
+        return values.to_numpy(dtype="float64").tolist()
+    if pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return values.to_numpy().tolist()
+    if pd.api.types.is_datetime64_any_dtype(values):
+        valid = values.dropna()
+        fmt = "%Y-%m-%d" if (valid.dt.normalize() == valid).all() else "%Y-%m-%d %H:%M:%S"
+        values = values.dt.strftime(fmt)
+
+    values = values.astype(object)
+    first = values.first_valid_index()
+    if first is not None and isinstance(values[first], datetime.date):
+        values = values.map(lambda v: v.isoformat() if isinstance(v, datetime.date) else v)
+    return values.where(values.notna(), None).tolist()
+
+def _sql_rows(df):
+    """Yield DataFrame rows as tuples of values sqlite3 can bind."""
+    return zip(*(_sql_column(df[col]) for col in df.columns))
+
+def _execute_batches(conn, table, sql, df, batch_size, rebuild_indexes):
+    """Run sql over the DataFrame rows in executemany batches inside one explicit transaction."""
+    indexes = _table_indexes(conn, table) if rebuild_indexes else []
 
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN")
+    try:
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+        for start in range(0, len(df), batch_size):
+            conn.executemany(sql, _sql_rows(df.iloc[start:start + batch_size]))
+        for _, index_sql in indexes:
+            conn.execute(index_sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def bulk_insert(conn, table, df, batch_size=BATCH_SIZE, rebuild_indexes=False):
+    """Insert a DataFrame with executemany batches inside one explicit transaction.
+
+    rebuild_indexes=True drops the table's indexes before the load and
+    recreates them afterwards, which is faster for very large loads.
+    Returns the number of rows inserted.
+    """
+    if df.empty:
+        return 0
+
+    column_list = ", ".join(f'"{c}"' for c in df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
+    _execute_batches(conn, table, sql, df, batch_size, rebuild_indexes)
+    return len(df)
+
+def bulk_upsert(conn, table, df, keys, batch_size=BATCH_SIZE, rebuild_indexes=False):
+    """Merge a DataFrame into a table with INSERT ... ON CONFLICT on a unique key.
+
+    Rows with a new key are inserted, rows whose non-key values changed are
+    updated in place, and identical rows are left alone. Returns a dict with
+    the inserted, updated and skipped counts.
+    """
+    if df.empty:
+        return {"inserted": 0, "updated": 0, "skipped": 0}
+
+    columns = list(df.columns)
+    values = [c for c in columns if c not in keys]
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    placeholders = ", ".join("?" * len(columns))
+    key_list = ", ".join(f'"{c}"' for c in keys)
+    if values:
+        assignments = ", ".join(f'"{c}" = excluded."{c}"' for c in values)
+        changed = " OR ".join(f'"{c}" IS NOT excluded."{c}"' for c in values)
+        conflict = f"DO UPDATE SET {assignments} WHERE {changed}"
+    else:
+        conflict = "DO NOTHING"
+    sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}) ON CONFLICT ({key_list}) {conflict}"
+
+    max_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+    changes_before = conn.total_changes
+    _execute_batches(conn, table, sql, df, batch_size, rebuild_indexes)
+
+    changed_rows = conn.total_changes - changes_before
+    inserted = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid > ?", (max_rowid,)).fetchone()[0]
+    return {"inserted": inserted, "updated": changed_rows - inserted, "skipped": len(df) - changed_rows}
+
+# -----------------------------
+# Schema and migrations
+# -----------------------------
+# The schema version is kept in PRAGMA user_version. Each migration moves a
+# database from version N-1 to N; existing databases are brought up to date
+# by initialize_database.
+
+def _migrate_v1(cursor):
+    """Base tables."""
     # Table for storing commodity prices
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS commodity_prices (
@@ -36,6 +174,7 @@ def initialize_database():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             commodity TEXT,
             market TEXT,
+            state TEXT,
             date TEXT,
             old_price REAL,
             new_price REAL,
@@ -44,7 +183,288 @@ def initialize_database():
         )
     """)
 
+    # Table for storing forecasts (also created by db_forecast_setup.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS commodity_forecasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            commodity TEXT,
+            market TEXT,
+            date TEXT,
+            predicted_price REAL
+        )
+    """)
+
+def _migrate_v2(cursor):
+    """ISO dates, composite indexes and dimension tables."""
+    # Older initialize_database created price_spikes without the state column
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(price_spikes)")]
+    if "state" not in columns:
+        cursor.execute("ALTER TABLE price_spikes ADD COLUMN state TEXT")
+
+    # Normalize stored dates ('2019-01-01 00:00:00' -> '2019-01-01'); unparseable values are left as-is
+    for table in ["commodity_prices", "price_spikes", "commodity_forecasts"]:
+        cursor.execute(f"""
+            UPDATE {table} SET date = date(date)
+            WHERE date(date) IS NOT NULL AND date <> date(date)
+        """)
+
+    # Dimension tables: one row per distinct state, commodity and market
+    cursor.execute("CREATE TABLE IF NOT EXISTS states (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS commodities (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS markets (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT '',
+            UNIQUE (name, state)
+        )
+    """)
+    create_indexes(cursor, ["idx_prices_series", "idx_prices_state_date", "idx_spikes_series",
+                            "idx_spikes_date", "idx_forecasts_series"])
+    cursor.execute("INSERT OR IGNORE INTO states (name) SELECT DISTINCT state FROM commodity_prices WHERE state IS NOT NULL")
+    cursor.execute("INSERT OR IGNORE INTO commodities (name) SELECT DISTINCT commodity FROM commodity_prices WHERE commodity IS NOT NULL")
+    cursor.execute("""
+        INSERT OR IGNORE INTO markets (name, state)
+        SELECT DISTINCT market, COALESCE(state, '') FROM commodity_prices WHERE market IS NOT NULL
+    """)
+
+# Natural key of a price observation; NULL text parts are stored as '' so they compare equal
+PRICE_KEY_COLUMNS = ["state", "market", "commodity", "variety", "date"]
+
+def _migrate_v3(cursor):
+    """Unique natural key on commodity_prices, removing existing duplicates."""
+    for col in ["state", "market", "commodity", "variety"]:
+        cursor.execute(f"UPDATE commodity_prices SET {col} = '' WHERE {col} IS NULL")
+
+    # Keep the most recently loaded copy of each observation
+    cursor.execute("""
+        DELETE FROM commodity_prices
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM commodity_prices
+            GROUP BY state, market, commodity, variety, date
+        )
+    """)
+    create_indexes(cursor, ["idx_prices_natural_key"])
+
+def _migrate_v4(cursor):
+    """Model tag on forecasts; rows written before this are ARIMA forecasts."""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(commodity_forecasts)")]
+    if "model" not in columns:
+        cursor.execute("ALTER TABLE commodity_forecasts ADD COLUMN model TEXT")
+    cursor.execute("UPDATE commodity_forecasts SET model = 'arima' WHERE model IS NULL")
+
+def _migrate_v5(cursor):
+    """Cache of fitted forecast model parameters (see model_cache.py)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS forecast_model_cache (
+            commodity TEXT NOT NULL,
+            market TEXT NOT NULL,
+            model_order TEXT NOT NULL,
+            last_date TEXT,
+            n_obs INTEGER,
+            params TEXT,
+            fitted_at TEXT,
+            last_used TEXT,
+            PRIMARY KEY (commodity, market, model_order)
+        )
+    """)
+
+def _migrate_v6(cursor):
+    """Spike rollup tables backing the dashboard, filled from the existing spikes."""
+    from spike_rollups import create_rollup_tables, rebuild_rollups
+    create_rollup_tables(cursor)
+    rebuild_rollups(cursor.connection)
+
+def _migrate_v7(cursor):
+    """Market and state indexes on price_spikes for the dashboard filter API."""
+    create_indexes(cursor, ["idx_spikes_market_date", "idx_spikes_state_date"])
+
+def _migrate_v8(cursor):
+    """Pipeline metadata: the data version counters readers use to invalidate caches."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO pipeline_meta (key, value) VALUES (?, 0)", (DATA_VERSION_KEY,))
+
+def _migrate_v9(cursor):
+    """z_score on price_spikes; rolling statistics on spike_state (created lazily by anomaly_detection)."""
+    spike_columns = {row[1] for row in cursor.execute("PRAGMA table_info(price_spikes)")}
+    if "z_score" not in spike_columns:
+        cursor.execute("ALTER TABLE price_spikes ADD COLUMN z_score REAL")
+
+    state_columns = {row[1] for row in cursor.execute("PRAGMA table_info(spike_state)")}
+    if state_columns:
+        for column, sql_type in (("ewma_mean", "REAL"), ("ewma_var", "REAL"), ("n_obs", "INTEGER")):
+            if column not in state_columns:
+                cursor.execute(f"ALTER TABLE spike_state ADD COLUMN {column} {sql_type}")
+
+def _migrate_v10(cursor):
+    """Bookkeeping for pipeline_dag.py: stage fingerprints, ingested files and a run log."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_stages (
+            stage TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            seconds REAL,
+            rows INTEGER,
+            finished_at TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            sha1 TEXT,
+            ingested_at TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT,
+            stage TEXT,
+            status TEXT,
+            seconds REAL,
+            rows INTEGER,
+            started_at TEXT
+        )
+    """)
+
+def _migrate_v11(cursor):
+    """Monthly price_spikes partitions behind a price_spikes view (see spike_partitions.py)."""
+    from spike_partitions import partition_existing_table
+    partition_existing_table(cursor.connection)
+
+def _migrate_v12(cursor):
+    """Leader -> follower market edges computed by spike_propagation.py."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS spike_propagation (
+            commodity TEXT NOT NULL,
+            leader TEXT NOT NULL,
+            follower TEXT NOT NULL,
+            lag_days INTEGER NOT NULL,
+            strength REAL NOT NULL,
+            reverse_strength REAL,
+            overlap INTEGER,
+            computed_at TEXT,
+            PRIMARY KEY (commodity, leader, follower)
+        )
+    """)
+    create_indexes(cursor, SCHEMA_INDEXES["spike_propagation"])
+
+# Key of a stored forecast: rerunning a model for a series replaces its predictions
+FORECAST_KEY_COLUMNS = ["commodity", "market", "date", "model"]
+
+def _migrate_v13(cursor):
+    """Unique (commodity, market, date, model) key on commodity_forecasts, removing repeated runs."""
+    # Keep the most recent forecast of each date
+    cursor.execute("""
+        DELETE FROM commodity_forecasts
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM commodity_forecasts
+            GROUP BY commodity, market, date, model
+        )
+    """)
+    # The unique key also serves the (commodity, market, date) lookups
+    cursor.execute("DROP INDEX IF EXISTS idx_forecasts_series")
+    create_indexes(cursor, SCHEMA_INDEXES["commodity_forecasts"])
+
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6, _migrate_v7,
+              _migrate_v8, _migrate_v9, _migrate_v10, _migrate_v11, _migrate_v12, _migrate_v13]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Secondary indexes by name; migrations create them, ensure_indexes recreates them after a table is dropped.
+# The idx_spikes_* ones belong to the pre-partitioning price_spikes table (spike partitions carry their own).
+INDEX_SQL = {
+    "idx_prices_series": "CREATE INDEX IF NOT EXISTS idx_prices_series ON commodity_prices (commodity, market, date)",
+    "idx_prices_state_date": "CREATE INDEX IF NOT EXISTS idx_prices_state_date ON commodity_prices (state, date)",
+    "idx_prices_natural_key": "CREATE UNIQUE INDEX IF NOT EXISTS idx_prices_natural_key "
+                              "ON commodity_prices (state, market, commodity, variety, date)",
+    "idx_spikes_series": "CREATE INDEX IF NOT EXISTS idx_spikes_series ON price_spikes (commodity, market, date)",
+    "idx_spikes_date": "CREATE INDEX IF NOT EXISTS idx_spikes_date ON price_spikes (date)",
+    "idx_spikes_market_date": "CREATE INDEX IF NOT EXISTS idx_spikes_market_date ON price_spikes (market, date)",
+    "idx_spikes_state_date": "CREATE INDEX IF NOT EXISTS idx_spikes_state_date ON price_spikes (state, date)",
+    "idx_forecasts_series": "CREATE INDEX IF NOT EXISTS idx_forecasts_series ON commodity_forecasts (commodity, market, date)",
+    "idx_forecasts_key": "CREATE UNIQUE INDEX IF NOT EXISTS idx_forecasts_key "
+                         "ON commodity_forecasts (commodity, market, date, model)",
+    "idx_propagation_follower": "CREATE INDEX IF NOT EXISTS idx_propagation_follower "
+                                "ON spike_propagation (commodity, follower)",
+}
+
+SCHEMA_INDEXES = {
+    "commodity_prices": ["idx_prices_series", "idx_prices_state_date", "idx_prices_natural_key"],
+    "commodity_forecasts": ["idx_forecasts_key"],
+    "spike_propagation": ["idx_propagation_follower"],
+}
+
+def create_indexes(cursor, names):
+    """Create the named indexes from INDEX_SQL."""
+    for name in names:
+        cursor.execute(INDEX_SQL[name])
+
+def ensure_indexes(cursor):
+    """Create any missing secondary indexes on the tables that exist."""
+    tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, names in SCHEMA_INDEXES.items():
+        if table in tables:
+            create_indexes(cursor, names)
+
+def migrate_database(conn):
+    """Apply pending migrations; returns the resulting schema version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor = conn.cursor()
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+        print(f"🔹 Migrated database schema to version {number}")
+    return max(version, SCHEMA_VERSION)
+
+def update_dimensions(conn, df):
+    """Add the states, commodities and markets of a newly loaded frame to the dimension tables."""
+    if "state" in df.columns:
+        conn.executemany("INSERT OR IGNORE INTO states (name) VALUES (?)",
+                         [(v,) for v in df["state"].dropna().unique()])
+    if "commodity" in df.columns:
+        conn.executemany("INSERT OR IGNORE INTO commodities (name) VALUES (?)",
+                         [(v,) for v in df["commodity"].dropna().unique()])
+    if "market" in df.columns:
+        states = df["state"] if "state" in df.columns else pd.Series("", index=df.index)
+        pairs = pd.DataFrame({"name": df["market"].astype(object), "state": states.astype(object).fillna("")})
+        conn.executemany("INSERT OR IGNORE INTO markets (name, state) VALUES (?, ?)",
+                         pairs.dropna(subset=["name"]).drop_duplicates().itertuples(index=False, name=None))
     conn.commit()
+
+# -----------------------------
+# Data version
+# -----------------------------
+DATA_VERSION_KEY = "data_version"
+
+def bump_data_version(conn, table=None):
+    """Increment the global data version (and the table's own version, if given) after a load.
+
+    The frontend caches responses per data version, so every committed load must bump it.
+    """
+    keys = [DATA_VERSION_KEY] + ([f"{DATA_VERSION_KEY}:{table}"] if table else [])
+    conn.executemany("""
+        INSERT INTO pipeline_meta (key, value) VALUES (?, 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """, [(key,) for key in keys])
+    conn.commit()
+
+def get_data_version(conn, table=None):
+    """Current global data version, or the table's version if given (0 if never bumped)."""
+    key = f"{DATA_VERSION_KEY}:{table}" if table else DATA_VERSION_KEY
+    row = conn.execute("SELECT value FROM pipeline_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else 0
+
+def initialize_database():
+    """Create tables if they don't exist and migrate older databases to the current schema."""
+    conn = get_db_connection()
+    migrate_database(conn)
     conn.close()
     print("✅ Database initialized successfully!")
 
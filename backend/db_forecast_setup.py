@@ -14,7 +14,8 @@ def create_forecast_table():
             commodity TEXT,
             market TEXT,
             date TEXT,
-            predicted_price REAL
+            predicted_price REAL,
+            model TEXT
         )
     """)
 
@@ -1,15 +1,48 @@
 # db_reset.py
 import sqlite3
 import os
+from db_config import DATA_VERSION_KEY
+from anomaly_detection import WATERMARK_KEY
+from spike_rollups import ROLLUPS
+from spike_partitions import drop_spike_store
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "database", "spikealert.db")
 
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
+def reset_database(conn):
+    """Drop the data, derived tables and pipeline bookkeeping; initialize_database recreates them."""
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS commodity_prices")
+    cursor.execute("DROP TABLE IF EXISTS spike_state")
+    cursor.execute("DROP TABLE IF EXISTS spike_propagation")
+    cursor.execute("DROP TABLE IF EXISTS states")
+    cursor.execute("DROP TABLE IF EXISTS commodities")
+    cursor.execute("DROP TABLE IF EXISTS markets")
+    cursor.execute("DROP TABLE IF EXISTS commodity_forecasts")
+    cursor.execute("DROP TABLE IF EXISTS forecast_model_cache")
+    # Ingested files and stage fingerprints: the next pipeline_dag run must reload everything
+    cursor.execute("DROP TABLE IF EXISTS pipeline_files")
+    cursor.execute("DROP TABLE IF EXISTS pipeline_stages")
+    drop_spike_store(conn)
+    for table in ROLLUPS:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
 
-cursor.execute("DROP TABLE IF EXISTS commodity_prices")
-cursor.execute("DROP TABLE IF EXISTS price_spikes")
-conn.commit()
-conn.close()
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pipeline_meta'").fetchone():
+        # The detection watermark is an id of the dropped commodity_prices table
+        cursor.execute("DELETE FROM pipeline_meta WHERE key = ?", (WATERMARK_KEY,))
+        # Bump (never restart) every data version, so caches, the series and Parquet
+        # stores and the alert stream all see the reset, including price_spikes:rebuild
+        # (dashboards holding spike rows must reload them, see visualization.get_spikes)
+        cursor.execute("UPDATE pipeline_meta SET value = value + 1 WHERE key = ? OR key GLOB ?",
+                       (DATA_VERSION_KEY, f"{DATA_VERSION_KEY}:*"))
+        for table in ("commodity_prices", "price_spikes:rebuild"):
+            cursor.execute("INSERT OR IGNORE INTO pipeline_meta (key, value) VALUES (?, 1)", (f"{DATA_VERSION_KEY}:{table}",))
 
-print("✅ Database reset successfully. Now run run_pipeline.py again.")
+    # Let initialize_database rebuild the schema from scratch
+    cursor.execute("PRAGMA user_version = 0")
+    conn.commit()
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB_PATH)
+    reset_database(conn)
+    conn.close()
+    print("✅ Database reset successfully. Now run run_pipeline.py again.")
@@ -1,28 +1,26 @@
 # db_spikes_setup.py
 import sqlite3
-from db_config import DB_PATH  # make sure you have DB_PATH in db_config.py
+from db_config import DB_PATH, bump_data_version  # make sure you have DB_PATH in db_config.py
+from spike_rollups import ROLLUPS, create_rollup_tables
+from spike_partitions import create_spike_store, drop_spike_store
 
 conn = sqlite3.connect(DB_PATH)
 cursor = conn.cursor()
 
-# Drop old table if exists
-cursor.execute("DROP TABLE IF EXISTS price_spikes")
+# Drop old table (or monthly partitions) if exists
+drop_spike_store(conn)
+cursor.execute("DROP TABLE IF EXISTS spike_state")
+for table in ROLLUPS:
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
 
-# Create new table with all required columns
-cursor.execute("""
-CREATE TABLE price_spikes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    commodity TEXT NOT NULL,
-    market TEXT NOT NULL,
-    state TEXT,
-    date TEXT NOT NULL,
-    old_price REAL,
-    new_price REAL,
-    spike_percent REAL,
-    alert_level TEXT
-)
-""")
+# Partitions with all required columns are created per month on insert
+create_spike_store(conn)
+create_rollup_tables(cursor)
 
 conn.commit()
+
+# Dashboards holding cached spike rows must reload them (see visualization.get_spikes)
+if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pipeline_meta'").fetchone():
+    bump_data_version(conn, "price_spikes:rebuild")
 conn.close()
-print("✅ price_spikes table created successfully with all columns!")
+print("✅ price_spikes store created successfully with all columns!")
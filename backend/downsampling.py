@@ -0,0 +1,120 @@
+# downsampling.py
+"""Reduce row-level spike data to a point budget before it is sent to Plotly.
+
+- lttb: Largest-Triangle-Three-Buckets for line charts (keeps the visual shape)
+- stratified_sample: per-stratum sampling for scatter charts (rare alert levels stay visible)
+- box_stats: precomputed quartiles and whiskers so box plots need no raw points
+"""
+import numpy as np
+import pandas as pd
+
+POINT_BUDGET = 5000   # default max markers per chart
+MIN_STRATUM = 200     # points kept per stratum (if it has them) before proportional allocation
+WHISKER = 1.5         # Tukey whisker length in IQRs
+SEED = 42
+
+def reduction_report(chart, before, after):
+    """Print and return how much a chart's data was reduced."""
+    percent = 100.0 * after / before if before else 100.0
+    print(f"🔹 {chart}: {before} → {after} points ({percent:.1f}% of original)")
+    return {"chart": chart, "before": int(before), "after": int(after), "percent": round(percent, 2)}
+
+# -----------------------------
+# Time series
+# -----------------------------
+def lttb(x, y, n_out):
+    """Indices of the n_out points chosen by Largest-Triangle-Three-Buckets.
+
+    x must be sorted ascending. The first and last points are always kept; each
+    bucket in between keeps the point forming the largest triangle with the
+    previously kept point and the average of the next bucket.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+def downsample_series(df, x, y, budget=POINT_BUDGET):
+    """Rows of df (sorted by x) reduced to at most budget points with LTTB."""
+    x_values = df[x].to_numpy()
+    if np.issubdtype(x_values.dtype, np.datetime64):
+        x_values = x_values.astype("datetime64[ns]").astype(np.int64)
+    return df.iloc[lttb(x_values, df[y].to_numpy(), budget)]
+
+# -----------------------------
+# Scatter
+# -----------------------------
+def _allocate(counts, budget, floor=MIN_STRATUM):
+    """Points per stratum: a floor for every stratum, the rest proportional to size."""
+    counts = np.asarray(counts, dtype=np.int64)
+    floor = min(floor, budget // max(len(counts), 1))
+    base = np.minimum(counts, floor)
+    remaining = max(budget - int(base.sum()), 0)
+    spare = counts - base
+    if spare.sum() == 0 or remaining == 0:
+        return base
+    return base + np.minimum(spare, np.floor(spare * remaining / spare.sum()).astype(np.int64))
+
+def stratified_sample(df, column, budget=POINT_BUDGET, seed=SEED):
+    """Sample at most budget rows, allocated across the values of column.
+
+    Small strata (e.g. the few High alerts) keep up to MIN_STRATUM points instead of
+    vanishing under proportional sampling; original row order is preserved.
+    """
+    if len(df) <= budget:
+        return df
+    codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+    counts = np.bincount(codes, minlength=len(uniques))
+    quotas = _allocate(counts, budget)
+
+    # Random rank within each stratum; keep the rows ranked below their stratum's quota
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(df)), codes))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[order] = np.arange(len(df)) - np.repeat(starts, counts)
+    return df[rank < quotas[codes]]
+
+# -----------------------------
+# Box plots
+# -----------------------------
+def box_stats(df, group, value):
+    """Quartiles, Tukey whiskers and row count per group, for go.Box(q1=..., median=...)."""
+    grouped = df.groupby(group, observed=True, sort=True)[value]
+    stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    stats.columns = ["q1", "median", "q3"]
+    iqr = stats["q3"] - stats["q1"]
+    low = (stats["q1"] - WHISKER * iqr).rename("low")
+    high = (stats["q3"] + WHISKER * iqr).rename("high")
+
+    # Whiskers end at the most extreme values inside the fences
+    bounds = df[[group, value]].join(low, on=group).join(high, on=group)
+    inside = bounds[(bounds[value] >= bounds["low"]) & (bounds[value] <= bounds["high"])]
+    whiskers = inside.groupby(group, observed=True)[value].agg(["min", "max"])
+    stats["lowerfence"] = whiskers["min"]
+    stats["upperfence"] = whiskers["max"]
+    stats["count"] = grouped.size()
+    return stats.reset_index()
+
+def box_outliers(df, group, value, stats, budget=POINT_BUDGET):
+    """Points outside the whiskers, stratified by group and capped at budget."""
+    bounds = df[[group, value]].join(stats.set_index(group)[["lowerfence", "upperfence"]], on=group)
+    outside = (bounds[value] < bounds["lowerfence"]) | (bounds[value] > bounds["upperfence"])
+    return stratified_sample(df[outside.to_numpy()], group, budget)
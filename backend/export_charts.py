@@ -0,0 +1,158 @@
+# export_charts.py
+"""Write the chart artifacts served by the Flask app and frontend/dashboard.py.
+
+Each figure is written as compact Plotly JSON plus an HTML page that loads one
+shared plotly.js file. File names carry a hash of their content, so they can be
+cached forever; manifest.json maps chart names to the current files and records
+the data versions they were built from.
+"""
+import hashlib
+import json
+import os
+import sys
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+from db_config import get_db_connection, get_data_version
+from spike_rollups import load_rollups
+
+VIS_DIR = os.path.join(os.path.dirname(__file__), "visualizations")
+MANIFEST = "manifest.json"
+HASH_LENGTH = 12
+
+# Data versions the charts are built from; unchanged versions mean nothing to export
+SOURCE_TABLES = ("commodity_prices", "price_spikes", "price_spikes:rebuild")
+
+def top_commodity_price_line(conn, top_commodity):
+    """Daily average modal price of the commodity with the highest average spike."""
+    df = pd.read_sql_query("""
+        SELECT date, AVG(price) AS price FROM commodity_prices
+        WHERE commodity = ? GROUP BY date ORDER BY date
+    """, conn, params=(top_commodity,))
+    return px.line(df, x="date", y="price", title=f"📈 Price Over Time: {top_commodity}")
+
+def build_charts(conn):
+    """Figures keyed by chart name, built from the spike rollup tables."""
+    # Imported here so the pipeline does not need streamlit unless charts are exported
+    from visualization import (commodity_spike_bar, market_spike_pie, top10_commodities_spikes,
+                               state_wise_spike_map, market_commodity_heatmap)
+
+    rollups = load_rollups(conn)
+    commodity_rollup = rollups["commodity"]
+    if commodity_rollup.empty:
+        return {}
+    top_commodity = commodity_rollup.set_index("commodity")["spike_percent"].idxmax()
+    return {
+        "commodity_bar": commodity_spike_bar(commodity_rollup),
+        "market_pie": market_spike_pie(rollups["market"]),
+        "top_commodity_line": top_commodity_price_line(conn, top_commodity),
+        "top10_commodities": top10_commodities_spikes(commodity_rollup),
+        "state_map": state_wise_spike_map(rollups["state"]),
+        "market_commodity_heatmap": market_commodity_heatmap(rollups["market_commodity"]),
+    }
+
+# -----------------------------
+# Artifacts
+# -----------------------------
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()[:HASH_LENGTH]
+
+def load_manifest(out_dir=VIS_DIR):
+    """The manifest of the last export, or None if charts were never exported."""
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def resolve(name, manifest, kind="html"):
+    """Hashed file name of a chart ("commodity_bar" or "commodity_bar.html"), or None."""
+    if manifest is None:
+        return None
+    chart = manifest["charts"].get(os.path.splitext(name)[0])
+    return chart[kind] if chart else None
+
+def _write(out_dir, file_name, render):
+    """Write render() under file_name unless it already exists; returns True if written."""
+    path = os.path.join(out_dir, file_name)
+    if os.path.exists(path):
+        return False
+    # Write-then-rename, so readers never see a partial artifact
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+    return True
+
+def _write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _write_plotlyjs(out_dir):
+    """The shared plotly.js bundle, named by its content hash."""
+    data = get_plotlyjs().encode("utf-8")
+    file_name = f"plotly-{content_hash(data)}.min.js"
+    _write(out_dir, file_name, lambda: data)
+    return file_name
+
+def _chart_html(fig, name, plotlyjs):
+    # A fixed div id keeps the page bytes (and so its hash) stable across exports
+    return pio.to_html(fig, include_plotlyjs=plotlyjs, full_html=True, div_id=name,
+                       config={"responsive": True}).encode("utf-8")
+
+def _prune(out_dir, manifest):
+    """Remove hashed artifacts the manifest no longer references."""
+    keep = {MANIFEST, manifest["plotlyjs"]}
+    for chart in manifest["charts"].values():
+        keep.update((chart["json"], chart["html"]))
+    prefixes = tuple(f"{name}." for name in manifest["charts"]) + ("plotly-",)
+    for file_name in os.listdir(out_dir):
+        # Only files named <chart>.<hash>.<ext>; hand-made files in the folder stay
+        if file_name not in keep and file_name.startswith(prefixes) and file_name.count(".") >= 2:
+            os.remove(os.path.join(out_dir, file_name))
+
+def export_charts(out_dir=VIS_DIR, force=False):
+    """Export every chart as JSON and HTML artifacts; returns the number of charts that changed.
+
+    Nothing is rebuilt when the data versions match the last export (unless
+    force), and charts whose content hash is unchanged are not rewritten.
+    """
+    conn = get_db_connection()
+    versions = {table: get_data_version(conn, table) for table in SOURCE_TABLES}
+    previous = load_manifest(out_dir)
+    if not force and previous and previous.get("versions") == versions and all(
+            os.path.exists(os.path.join(out_dir, resolve(name, previous, kind)))
+            for name in previous["charts"] for kind in ("json", "html")):
+        conn.close()
+        print("🔹 Charts are up to date")
+        return 0
+    charts = build_charts(conn)
+    conn.close()
+    if not charts:
+        print("❌ No spike data to export. Please run anomaly detection first.")
+        return 0
+
+    os.makedirs(out_dir, exist_ok=True)
+    plotlyjs = _write_plotlyjs(out_dir)
+    manifest = {"versions": versions, "plotlyjs": plotlyjs, "charts": {}}
+    changed = 0
+    for name, fig in charts.items():
+        figure_json = pio.to_json(fig, pretty=False, remove_uids=True).encode("utf-8")
+        digest = content_hash(figure_json + plotlyjs.encode())
+        entry = {"hash": digest, "json": f"{name}.{digest}.json", "html": f"{name}.{digest}.html"}
+        written = _write(out_dir, entry["json"], lambda: figure_json)
+        written |= _write(out_dir, entry["html"], lambda: _chart_html(fig, name, plotlyjs))
+        changed += written
+        manifest["charts"][name] = entry
+
+    _write_manifest(out_dir, manifest)
+    _prune(out_dir, manifest)
+    print(f"✅ Exported {len(charts)} charts to {out_dir} ({changed} changed)")
+    return changed
+
+if __name__ == "__main__":
+    export_charts(force="--force" in sys.argv)
@@ -1,6 +1,12 @@
 import pandas as pd
+import numpy as np
 import os
-from db_config import get_db_connection
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from db_config import (get_db_connection, bulk_upsert, update_dimensions, bump_data_version, get_data_version,
+                       PRICE_KEY_COLUMNS)
+import parquet_store
+from instrumentation import instrument, add_rows
 
 # Paths
 HISTORICAL_CSV_FOLDER = r"C:\Users\Prath\Documents\project\SpikeAlert-Dashboard\historical_data\Agmarknet-master"
@@ -9,22 +15,34 @@ REALTIME_CSV = r"C:\Users\Prath\Downloads\9ef84268-d588-465a-a308-a864a43d0070.c
 # Columns we want (normalized)
 EXPECTED_COLUMNS = ["state", "district", "market", "commodity", "variety", "arrival_date", "min_price", "max_price", "modal_price"]
 
+# Normalized names used in the database
+COLUMN_RENAMES = {
+    "arrival_date": "date",
+    "min_price": "min",
+    "max_price": "max",
+    "modal_price": "price"
+}
+
+# Typed reader settings
+PRICE_COLUMNS = ["min_price", "max_price", "modal_price"]
+DATE_FORMAT = "%d/%m/%Y"
+CHUNK_SIZE = 250000
+
+def normalize_column_name(column):
+    """Lowercase a raw CSV header and replace spaces with underscores"""
+    return column.strip().lower().replace(" ", "_").replace("_x0020_", "_")
+
 def load_csv(file_path):
     """Load a CSV and normalize column names to lowercase with underscores"""
     df = pd.read_csv(file_path)
-    df.columns = [c.strip().lower().replace(" ", "_").replace("_x0020_", "_") for c in df.columns]
+    df.columns = [normalize_column_name(c) for c in df.columns]
 
     # Keep only columns that exist in this file
     columns_to_keep = [col for col in EXPECTED_COLUMNS if col in df.columns]
     df = df[columns_to_keep]
 
     # Rename columns for consistency
-    df.rename(columns={
-        "arrival_date": "date",
-        "min_price": "min",
-        "max_price": "max",
-        "modal_price": "price"
-    }, inplace=True)
+    df.rename(columns=COLUMN_RENAMES, inplace=True)
 
     # Drop rows without essential data
     essential_cols = [col for col in ["commodity", "price"] if col in df.columns]
@@ -45,20 +63,96 @@ def load_csv(file_path):
 
     return df
 
+def _parse_price_categories(column):
+    """Convert a categorical price column to floats, parsing each distinct value once"""
+    parsed = pd.to_numeric(pd.Series(column.cat.categories), errors="coerce").to_numpy(dtype="float64")
+    # Code -1 (missing) picks the trailing NaN
+    return np.append(parsed, np.nan)[column.cat.codes]
+
+def _parse_date_categories(column, date_format):
+    """Convert a categorical date column to categorical ISO dates, parsing each distinct value once"""
+    categories = column.cat.categories
+    parsed = pd.to_datetime(categories, format=date_format, errors="coerce")
+    retry = parsed.isna()
+    if retry.any():
+        # Fall back to inference for values that don't match the fixed format
+        parsed = parsed.where(~retry, pd.to_datetime(categories.where(retry), format="mixed", errors="coerce"))
+
+    iso = pd.Index(parsed.strftime("%Y-%m-%d"))
+    iso_categories = iso.dropna().unique()
+    mapping = np.append(iso_categories.get_indexer(iso), -1)
+    return pd.Categorical.from_codes(mapping[column.cat.codes], iso_categories)
+
+def _normalize_typed_chunk(chunk, date_format):
+    """Apply the load_csv normalization to a chunk read with categorical dtypes"""
+    chunk.columns = [normalize_column_name(c) for c in chunk.columns]
+
+    for col in PRICE_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = _parse_price_categories(chunk[col])
+    if "arrival_date" in chunk.columns:
+        chunk["arrival_date"] = _parse_date_categories(chunk["arrival_date"], date_format)
+    chunk.rename(columns=COLUMN_RENAMES, inplace=True)
+
+    # Drop rows without essential data in a single pass
+    essential_cols = [col for col in ["commodity", "price"] if col in chunk.columns]
+    if essential_cols:
+        chunk = chunk[chunk[essential_cols].notna().all(axis=1)]
+    return chunk.reset_index(drop=True)
+
+def iter_csv_typed(file_path, chunksize=CHUNK_SIZE, engine="c", date_format=DATE_FORMAT):
+    """Stream a CSV as normalized chunks with categorical text and date columns.
+
+    Only the expected columns are read. Every column is read as a category,
+    so repeated names, dates and prices are parsed once per distinct value
+    instead of once per row. engine="pyarrow" reads the file in one pass and
+    then slices it, since that engine has no chunked mode.
+    """
+    header = pd.read_csv(file_path, nrows=0).columns
+    usecols = [c for c in header if normalize_column_name(c) in EXPECTED_COLUMNS]
+    dtype = {c: "category" for c in usecols}
+
+    if engine == "pyarrow":
+        df = pd.read_csv(file_path, usecols=usecols, dtype=dtype, engine="pyarrow")
+        chunks = (df.iloc[start:start + chunksize].copy() for start in range(0, len(df), chunksize))
+    else:
+        chunks = pd.read_csv(file_path, usecols=usecols, dtype=dtype, engine=engine, chunksize=chunksize)
+
+    for chunk in chunks:
+        yield _normalize_typed_chunk(chunk, date_format)
+
+def load_csv_typed(file_path, **kwargs):
+    """Load a whole CSV through iter_csv_typed, keeping text columns categorical"""
+    chunks = list(iter_csv_typed(file_path, **kwargs))
+    if not chunks:
+        return pd.DataFrame()
+
+    df = pd.concat(chunks, ignore_index=True)
+    # pd.concat falls back to object for categories that differ between chunks
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = pd.api.types.union_categoricals([c[col] for c in chunks])
+    return df
+
+def iter_historical_files(folder=HISTORICAL_CSV_FOLDER):
+    """Yield every CSV path under the historical data folder"""
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            if file.endswith(".csv"):
+                yield os.path.join(root, file)
+
+@instrument(rows=len)
 def fetch_and_combine_data():
     """Load historical + real-time CSVs and combine into single DataFrame"""
 
     # 1️⃣ Load historical CSVs
     hist_dfs = []
-    for root, dirs, files in os.walk(HISTORICAL_CSV_FOLDER):
-        for file in files:
-            if file.endswith(".csv"):
-                file_path = os.path.join(root, file)
-                try:
-                    df = load_csv(file_path)
-                    hist_dfs.append(df)
-                except Exception as e:
-                    print(f"❌ Failed to load {file}: {e}")
+    for file_path in iter_historical_files():
+        try:
+            df = load_csv(file_path)
+            hist_dfs.append(df)
+        except Exception as e:
+            print(f"❌ Failed to load {os.path.basename(file_path)}: {e}")
 
     historical_df = pd.concat(hist_dfs, ignore_index=True) if hist_dfs else pd.DataFrame()
     print(f"✅ Loaded historical data: {len(historical_df)} rows")
@@ -76,18 +170,109 @@ def fetch_and_combine_data():
     print(f"✅ Combined data: {len(combined_df)} rows total")
     return combined_df
 
-def store_in_database(df):
-    """Insert combined data into SQLite database"""
+def _prepare_keys(df):
+    """Fill missing natural-key text with '' and split off rows that cannot be keyed (no date)"""
+    df = df.copy()
+    for col in PRICE_KEY_COLUMNS[:-1]:
+        if col not in df.columns:
+            df[col] = ""
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            if "" not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories("")
+            df[col] = df[col].fillna("")
+        else:
+            df[col] = df[col].fillna("")
+    if "date" not in df.columns:
+        return df.iloc[0:0], len(df)
+    keyed = df["date"].notna()
+    return df[keyed], int((~keyed).sum())
+
+@instrument()
+def store_in_database(df, rebuild_indexes=False):
+    """Merge combined data into SQLite database, keyed on (state, market, commodity, variety, date).
+
+    Returns the inserted / updated / skipped counts.
+    """
     if df.empty:
         print("❌ No data to store")
-        return
+        return {"inserted": 0, "updated": 0, "skipped": 0}
 
-    conn = get_db_connection()
-    df.to_sql("commodity_prices", conn, if_exists="append", index=False)
+    add_rows(len(df))
+    keyed_df, unkeyed = _prepare_keys(df)
+    conn = get_db_connection(bulk=True)
+    previous_version = get_data_version(conn, "commodity_prices")
+    counts = bulk_upsert(conn, "commodity_prices", keyed_df, PRICE_KEY_COLUMNS, rebuild_indexes=rebuild_indexes)
+    update_dimensions(conn, keyed_df)
+    if counts["inserted"] or counts["updated"]:
+        bump_data_version(conn, "commodity_prices")
+        # Keep the columnar copy in step (no-op without pyarrow)
+        parquet_store.sync_after_load(conn, keyed_df, previous_version)
     conn.close()
-    print(f"✅ Stored {len(df)} records in database")
+
+    counts["skipped"] += unkeyed
+    print(f"✅ Stored {len(df)} records in database: {counts['inserted']} inserted, "
+          f"{counts['updated']} updated, {counts['skipped']} skipped")
+    return counts
+
+def _normalize_file(file_path, typed=True):
+    """Worker task: load and normalize one CSV, timing the work"""
+    start = time.perf_counter()
+    try:
+        df = load_csv_typed(file_path) if typed else load_csv(file_path)
+        return file_path, df, time.perf_counter() - start, None
+    except Exception as e:
+        return file_path, None, time.perf_counter() - start, str(e)
+
+def ingest_parallel(files=None, workers=None, max_tasks_per_child=20, typed=True):
+    """Normalize CSVs in a process pool and stream each result into the database.
+
+    At most two files per worker are in flight, and workers are recycled
+    after max_tasks_per_child files, so memory stays bounded regardless of
+    how many files the historical tree holds. Files are read with the typed
+    reader unless typed=False. Returns one report entry per
+    file with its row count, load time and error (if any).
+    """
+    if files is None:
+        files = list(iter_historical_files()) + [REALTIME_CSV]
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 2
+
+    report = []
+    start = time.perf_counter()
+    files = iter(files)
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=max_tasks_per_child) as pool:
+        pending = set()
+        while True:
+            # Keep the pool busy without queueing the whole tree at once
+            for file_path in files:
+                pending.add(pool.submit(_normalize_file, file_path, typed))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path, df, seconds, error = future.result()
+                if error is None:
+                    counts = store_in_database(df)
+                    report.append({"file": file_path, "rows": len(df), "seconds": seconds, "error": None, **counts})
+                else:
+                    print(f"❌ Failed to load {os.path.basename(file_path)}: {error}")
+                    report.append({"file": file_path, "rows": 0, "seconds": seconds, "error": error,
+                                   "inserted": 0, "updated": 0, "skipped": 0})
+
+    failed = [r for r in report if r["error"]]
+    total_rows = sum(r["rows"] for r in report)
+    print(f"✅ Ingested {total_rows} rows from {len(report) - len(failed)} files "
+          f"({len(failed)} failed) in {time.perf_counter() - start:.1f}s using {workers} workers: "
+          f"{sum(r['inserted'] for r in report)} inserted, {sum(r['updated'] for r in report)} updated, "
+          f"{sum(r['skipped'] for r in report)} skipped")
+    for r in sorted(report, key=lambda r: r["seconds"], reverse=True)[:5]:
+        print(f"   {os.path.basename(r['file'])}: {r['rows']} rows in {r['seconds']:.2f}s")
+    return report
 
 def run_pipeline():
     df = fetch_and_combine_data()
-    store_in_database(df)
+    store_in_database(df, rebuild_indexes=True)
     print("✅ Pipeline finished!")
@@ -1,40 +1,116 @@
+import os
+import sys
+import numpy as np
 import pandas as pd
-from db_config import get_db_connection
+from concurrent.futures import ProcessPoolExecutor
+from db_config import get_db_connection, bulk_upsert, bump_data_version, FORECAST_KEY_COLUMNS
+import parquet_store
+import series_store
+from forecasters import VECTOR_FORECASTERS, forecast_batch
+from model_cache import load_cache, load_entry, save_cache, evict
+from instrumentation import instrument
 from statsmodels.tsa.arima.model import ARIMA
 import warnings
 
 warnings.filterwarnings("ignore")
 
-def forecast_prices(commodity_name, market_name, steps=7):
-    """Generate ARIMA forecast for a given commodity + market."""
-    
-    conn = get_db_connection()
-    query = f"""
-        SELECT date, price 
-        FROM commodity_prices 
-        WHERE commodity='{commodity_name}' AND market='{market_name}' 
-        ORDER BY date
+# Series shorter than this are not forecast
+MIN_POINTS = 5
+
+ARIMA_ORDER = (1, 1, 1)
+
+# Model names accepted by forecast_prices and forecast_all
+MODELS = ("arima", *VECTOR_FORECASTERS)
+
+# Cached ARIMA parameters are applied without re-estimation for up to this many new observations
+REFIT_AFTER = 7
+
+def _fit_arima(dates, prices, steps, cached=None):
+    """Fit ARIMA(1,1,1) to one series, reusing cached parameters when possible.
+
+    cached is (last_date, n_obs, params) from the model cache. Returns
+    (future_dates, predicted, params, outcome) where outcome is "hit" (same
+    data, no fit), "extended" (a few new points, cached parameters applied
+    without re-estimation), "warm" (re-estimated starting from the cached
+    parameters) or "cold" (fit from scratch).
     """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    dates = np.asarray(dates)
+    series = pd.Series(prices, index=pd.to_datetime(dates))
+    model = ARIMA(series, order=ARIMA_ORDER)
+
+    outcome = "cold"
+    if cached is not None:
+        last_date, n_obs, params = cached
+        new_points = len(series) - n_obs
+        if new_points == 0 and str(dates[-1]) == last_date:
+            outcome = "hit"
+        elif 0 < new_points <= REFIT_AFTER and str(dates[-1]) > last_date:
+            outcome = "extended"
+        else:
+            outcome = "warm"
+
+    if outcome in ("hit", "extended"):
+        model_fit = model.filter(params)
+    elif outcome == "warm":
+        model_fit = model.fit(start_params=params)
+    else:
+        model_fit = model.fit()
+
+    forecast = model_fit.forecast(steps=steps)
+    future_dates = pd.date_range(start=series.index[-1] + pd.Timedelta(days=1), periods=steps)
+    return future_dates, np.asarray(forecast), np.asarray(model_fit.params), outcome
 
-    if df.empty or len(df) < 5:
+def _report_cache(outcomes):
+    """Print how many ARIMA fits the model cache avoided."""
+    counts = {outcome: outcomes.count(outcome) for outcome in ("hit", "extended", "warm", "cold")}
+    print(f"🔹 Model cache: {counts['hit']} hits, {counts['extended']} extended, "
+          f"{counts['warm']} warm-started, {counts['cold']} cold fits "
+          f"({counts['hit'] + counts['extended']} fits avoided)")
+    return counts
+
+@instrument(rows=len)
+def forecast_prices(commodity_name, market_name, steps=7, model="arima"):
+    """Generate a forecast for a given commodity + market (ARIMA, or a model from VECTOR_FORECASTERS)."""
+    if model not in MODELS:
+        raise ValueError(f"Unknown forecast model {model!r}; expected one of {MODELS}")
+
+    conn = get_db_connection()
+    series = series_store.get_series(series_store.open_store(), commodity_name, market_name) \
+        if series_store.is_current(conn) else None
+    if series is not None:
+        # O(1) lookup in the memory-mapped series store
+        dates, prices = series
+        df = pd.DataFrame({'date': np.datetime_as_string(dates), 'price': prices})
+    else:
+        query = """
+            SELECT date, price
+            FROM commodity_prices
+            WHERE commodity = ? AND market = ?
+            ORDER BY date
+        """
+        df = pd.read_sql_query(query, conn, params=(commodity_name, market_name))
+
+    if df.empty or len(df) < MIN_POINTS:
+        conn.close()
         print(f"❌ Not enough data to forecast for {commodity_name} in {market_name}")
         return None
 
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-
     try:
-        model = ARIMA(df['price'], order=(1,1,1))
-        model_fit = model.fit()
-        forecast = model_fit.forecast(steps=steps)
+        if model in VECTOR_FORECASTERS:
+            future_dates = pd.date_range(start=pd.to_datetime(df['date'].iloc[-1]) + pd.Timedelta(days=1), periods=steps)
+            predicted = forecast_batch(model, [df['price'].to_numpy()], steps)[0]
+        else:
+            cached = load_entry(conn, ARIMA_ORDER, commodity_name, market_name)
+            future_dates, predicted, params, outcome = _fit_arima(df['date'], df['price'].to_numpy(), steps, cached)
+            save_cache(conn, ARIMA_ORDER, [(commodity_name, market_name, df['date'].iloc[-1], len(df), params,
+                                            outcome in ("warm", "cold"))])
 
         forecast_df = pd.DataFrame({
             'commodity': commodity_name,
             'market': market_name,
-            'date': pd.date_range(start=df.index[-1] + pd.Timedelta(days=1), periods=steps),
-            'predicted_price': forecast.values
+            'date': future_dates,
+            'predicted_price': predicted,
+            'model': model
         })
 
         print(f"✅ Forecast generated for {commodity_name} in {market_name}")
@@ -44,24 +120,159 @@ def forecast_prices(commodity_name, market_name, steps=7):
         print("❌ Forecasting failed:", e)
         return None
 
+    finally:
+        conn.close()
+
 def store_forecast_in_db(forecast_df):
-    """Store forecasted prices into the commodity_forecasts table."""
+    """Store forecasted prices into the commodity_forecasts table, replacing earlier runs' predictions for the same dates."""
     if forecast_df is None or forecast_df.empty:
         return
 
-    conn = get_db_connection()
-    forecast_df.to_sql("commodity_forecasts", conn, if_exists="append", index=False)
+    conn = get_db_connection(bulk=True)
+    bulk_upsert(conn, "commodity_forecasts", forecast_df, FORECAST_KEY_COLUMNS)
+    bump_data_version(conn, "commodity_forecasts")
     conn.close()
     print(f"✅ Stored {len(forecast_df)} forecasted rows into database")
 
-if __name__ == "__main__":
-    # Example: Forecast next 7 days for all available commodity + market pairs
+# -----------------------------
+# Batch forecasting
+# -----------------------------
+def load_all_series(min_points=MIN_POINTS):
+    """Load every (commodity, market) series in one ordered scan.
+
+    Returns a list of (commodity, market, dates, prices) tuples, skipping
+    series with fewer than min_points observations.
+    """
     conn = get_db_connection()
-    pairs = pd.read_sql_query("SELECT DISTINCT commodity, market FROM commodity_prices", conn)
+    if series_store.is_current(conn):
+        # Series are already contiguous in the memory-mapped store: no scan, no sort
+        conn.close()
+        return list(series_store.iter_series(series_store.open_store(), min_points))
+    if parquet_store.is_current(conn):
+        # Columnar scan of just the four columns needed
+        df = parquet_store.read_prices(["commodity", "market", "date", "price"], sort=["commodity", "market", "date"])
+    else:
+        df = pd.read_sql_query(
+            "SELECT commodity, market, date, price FROM commodity_prices ORDER BY commodity, market, date",
+            conn,
+        )
     conn.close()
+    if df.empty:
+        return []
+
+    commodity = df['commodity'].to_numpy()
+    market = df['market'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, (commodity[1:] != commodity[:-1]) | (market[1:] != market[:-1])])
+    ends = np.r_[starts[1:], len(df)]
+
+    dates = df['date'].to_numpy()
+    prices = df['price'].to_numpy(dtype=float)
+    return [
+        (commodity[start], market[start], dates[start:end], prices[start:end])
+        for start, end in zip(starts, ends)
+        if end - start >= min_points
+    ]
+
+def _forecast_series(task):
+    """Worker task: forecast one series, returning an error message instead of raising."""
+    commodity, market, dates, prices, steps, cached = task
+    try:
+        future_dates, predicted, params, outcome = _fit_arima(dates, prices, steps, cached)
+        return commodity, market, future_dates, predicted, (dates[-1], len(prices), params, outcome), None
+    except Exception as e:
+        return commodity, market, None, None, None, str(e)
+
+def _forecast_vectorized(model, series, steps):
+    """Forecast all series at once with a vectorized model; returns one DataFrame."""
+    predicted = forecast_batch(model, [prices for _, _, _, prices in series], steps)
+    last_dates = pd.to_datetime([dates[-1] for _, _, dates, _ in series]).to_numpy(dtype="datetime64[D]")
+    future_dates = last_dates[:, None] + np.arange(1, steps + 1)
+
+    return pd.DataFrame({
+        'commodity': np.repeat([commodity for commodity, _, _, _ in series], steps),
+        'market': np.repeat([market for _, market, _, _ in series], steps),
+        'date': pd.to_datetime(future_dates.ravel()),
+        'predicted_price': predicted.ravel(),
+        'model': model
+    })
+
+def _forecast_arima_pool(series, steps, workers, chunksize):
+    """Fit ARIMA to each series in a process pool, warm-started from the model cache.
+
+    Returns (frames, failures); the cache is updated and evicted afterwards.
+    """
+    if chunksize is None:
+        # A few chunks per worker balances load without per-task IPC overhead
+        chunksize = max(1, len(series) // (workers * 4))
 
-    for _, row in pairs.iterrows():
-        commodity = row['commodity']
-        market = row['market']
-        forecast_df = forecast_prices(commodity, market, steps=7)
-        store_forecast_in_db(forecast_df)
+    conn = get_db_connection()
+    cache = load_cache(conn, ARIMA_ORDER)
+    tasks = ((commodity, market, dates, prices, steps, cache.get((commodity, market)))
+             for commodity, market, dates, prices in series)
+    frames = []
+    failures = []
+    cache_entries = []
+    outcomes = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for commodity, market, future_dates, predicted, fitted, error in pool.map(_forecast_series, tasks, chunksize=chunksize):
+            if error is not None:
+                failures.append((commodity, market, error))
+                continue
+            last_date, n_obs, params, outcome = fitted
+            outcomes.append(outcome)
+            cache_entries.append((commodity, market, last_date, n_obs, params, outcome in ("warm", "cold")))
+            frames.append(pd.DataFrame({
+                'commodity': commodity,
+                'market': market,
+                'date': future_dates,
+                'predicted_price': predicted,
+                'model': 'arima'
+            }))
+
+    _report_cache(outcomes)
+    save_cache(conn, ARIMA_ORDER, cache_entries)
+    evicted = evict(conn)
+    if evicted:
+        print(f"🔹 Evicted {evicted} stale model cache entries")
+    conn.close()
+    return frames, failures
+
+@instrument(rows=lambda result: result[0])
+def forecast_all(steps=7, model="ses", arima_pairs=(), workers=None, chunksize=None):
+    """Forecast every series with enough data and store the results in one transaction.
+
+    Series are forecast together with the vectorized model (see forecasters.py);
+    the (commodity, market) pairs in arima_pairs are fit with ARIMA in a process
+    pool instead. model="arima" fits every series with ARIMA.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown forecast model {model!r}; expected one of {MODELS}")
+    series = load_all_series()
+    arima_pairs = set(arima_pairs)
+    if model == "arima":
+        arima_series, fast_series = series, []
+    else:
+        arima_series = [s for s in series if (s[0], s[1]) in arima_pairs]
+        fast_series = [s for s in series if (s[0], s[1]) not in arima_pairs]
+
+    frames = []
+    failures = []
+    if fast_series:
+        frames.append(_forecast_vectorized(model, fast_series, steps))
+        print(f"✅ Forecast {len(fast_series)} series with {model}")
+    if arima_series:
+        workers = workers or os.cpu_count() or 1
+        print(f"🔹 Fitting ARIMA for {len(arima_series)} series with {workers} workers")
+        arima_frames, failures = _forecast_arima_pool(arima_series, steps, workers, chunksize)
+        frames.extend(arima_frames)
+        for commodity, market, error in failures[:10]:
+            print(f"❌ Forecasting failed for {commodity} in {market}: {error}")
+        print(f"✅ Forecast {len(arima_frames)} series with ARIMA ({len(failures)} failed)")
+
+    if frames:
+        store_forecast_in_db(pd.concat(frames, ignore_index=True))
+    return len(series) - len(failures), failures
+
+if __name__ == "__main__":
+    # Forecast next 7 days for all available commodity + market pairs
+    forecast_all(steps=7, model="arima" if "--arima" in sys.argv else "ses")
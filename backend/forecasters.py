@@ -0,0 +1,97 @@
+# forecasters.py
+import numpy as np
+
+# Fast forecasters that fit many series at once.
+#
+# Every forecaster takes a 2-D array of shape (n_series, n_obs) holding one
+# series per row, right-aligned and padded with NaN on the left, and returns
+# an array of shape (n_series, steps) with the predicted prices.
+
+SEASON_LENGTH = 7
+MAX_HISTORY = 365
+SES_ALPHAS = np.linspace(0.1, 0.9, 9)
+
+
+def pad_series(series_list, max_history=MAX_HISTORY):
+    """Stack 1-D price arrays into a right-aligned, NaN-padded 2-D array (last max_history points)."""
+    lengths = np.array([min(len(p), max_history) for p in series_list])
+    width = lengths.max() if len(lengths) else 0
+    values = np.concatenate([np.asarray(p, dtype=float)[len(p) - n:] for p, n in zip(series_list, lengths)]) \
+        if len(lengths) else np.empty(0)
+
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(len(values)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    padded = np.full((len(lengths), width), np.nan)
+    padded[rows, width - np.repeat(lengths, lengths) + offsets] = values
+    return padded
+
+
+def _last_valid(padded):
+    """Last observation of every row."""
+    return padded[:, -1]
+
+
+def _first_valid(padded):
+    """First observation of every row, and the number of observations."""
+    valid = ~np.isnan(padded)
+    counts = valid.sum(axis=1)
+    first_idx = padded.shape[1] - counts
+    return padded[np.arange(len(padded)), np.minimum(first_idx, padded.shape[1] - 1)], counts
+
+
+def seasonal_naive(padded, steps, season=SEASON_LENGTH):
+    """Repeat the last full season; rows shorter than a season repeat their last value."""
+    _, counts = _first_valid(padded)
+    season = min(season, padded.shape[1])
+    horizon = np.arange(steps) % season
+    forecast = padded[:, padded.shape[1] - season + horizon]
+    return np.where((counts < season)[:, None], _last_valid(padded)[:, None], forecast)
+
+
+def drift(padded, steps):
+    """Extend the straight line between the first and last observation of the padded window.
+
+    pad_series keeps only the last MAX_HISTORY points, so the slope is the drift
+    over (at most) the last year, not over the whole history.
+    """
+    first, counts = _first_valid(padded)
+    last = _last_valid(padded)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(counts > 1, (last - first) / (counts - 1), 0.0)
+    return last[:, None] + slope[:, None] * np.arange(1, steps + 1)
+
+
+def exponential_smoothing(padded, steps, alphas=SES_ALPHAS):
+    """Simple exponential smoothing, choosing per series the alpha with the lowest one-step error."""
+    n_series = len(padded)
+    level = np.full((len(alphas), n_series), np.nan)
+    sse = np.zeros((len(alphas), n_series))
+    alpha = np.asarray(alphas)[:, None]
+
+    # One pass over time, vectorized across every series and every alpha
+    for y in padded.T:
+        observed = ~np.isnan(y)
+        started = observed & ~np.isnan(level)
+        error = np.where(started, y - level, 0.0)
+        sse += error ** 2
+        level = np.where(started, level + alpha * error, level)
+        level = np.where(observed & np.isnan(level), y, level)
+
+    best = sse.argmin(axis=0)
+    final_level = level[best, np.arange(n_series)]
+    return np.repeat(final_level[:, None], steps, axis=1)
+
+
+# Registry of vectorized forecasters by model tag
+VECTOR_FORECASTERS = {
+    "seasonal_naive": seasonal_naive,
+    "ses": exponential_smoothing,
+    "drift": drift,
+}
+
+
+def forecast_batch(model, series_list, steps):
+    """Forecast a list of 1-D price arrays with a vectorized model; returns (n_series, steps)."""
+    if not series_list:
+        return np.empty((0, steps))
+    return VECTOR_FORECASTERS[model](pad_series(series_list), steps)
@@ -0,0 +1,402 @@
+# instrumentation.py
+"""Stage timings, memory, SQLite query times and optional profiles for the pipeline.
+
+    with stage("detect_spikes"):       # or @instrument("detect_spikes")
+        ...
+        add_rows(len(partition))       # rows processed, for rows/sec
+
+Every finished stage appends one JSON line to METRICS_LOG (rotated to
+METRICS_LOG + ".1" once it reaches METRICS_LOG_MAX_BYTES) and prints a one-line
+summary. Set PROMETHEUS_FILE to also keep a Prometheus text-format file (e.g. for
+node_exporter's textfile collector), and PROFILE_DIR to dump a cProfile (or
+pyinstrument) profile per stage. Connections from db_config.get_db_connection()
+time their queries and charge them to the innermost running stage of their thread.
+"""
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_DATABASE_DIR = os.path.join(os.path.dirname(__file__), "..", "database")
+
+METRICS_LOG = os.path.join(_DATABASE_DIR, "pipeline_metrics.jsonl")  # None disables the structured log
+METRICS_LOG_MAX_BYTES = 10 * 1024 * 1024  # rotate the log at this size; None never rotates
+PROMETHEUS_FILE = None     # path of a Prometheus text-format file, rewritten after each stage
+PROFILE_DIR = None         # directory for per-stage profiles; None disables profiling
+PROFILER = "cprofile"      # or "pyinstrument" (HTML output, if installed)
+TIME_QUERIES = True        # time SQLite statements on db_config connections
+PRINT_SUMMARY = True
+MEMORY_INTERVAL = 0.05     # seconds between RSS samples while a stage runs
+TOP_QUERIES = 5            # slowest statements kept per stage record
+
+DEFAULT_PROMETHEUS_FILE = os.path.join(_DATABASE_DIR, "pipeline_metrics.prom")
+DEFAULT_PROFILE_DIR = os.path.join(_DATABASE_DIR, "profiles")
+
+RUN_ID = uuid.uuid4().hex[:12]   # ties together the records of one process
+
+_active = contextvars.ContextVar("instrumentation_stages", default=())
+_lock = threading.Lock()
+_totals = {}     # stage -> cumulative figures for the Prometheus file
+_profiling = threading.Lock()   # held while a profile runs; one at a time per process
+
+def configure(metrics_log=..., prometheus_file=..., profile_dir=..., profiler=..., time_queries=...):
+    """Change the settings above; arguments left out keep their current value."""
+    global METRICS_LOG, PROMETHEUS_FILE, PROFILE_DIR, PROFILER, TIME_QUERIES
+    if metrics_log is not ...:
+        METRICS_LOG = metrics_log
+    if prometheus_file is not ...:
+        PROMETHEUS_FILE = prometheus_file
+    if profile_dir is not ...:
+        PROFILE_DIR = profile_dir
+    if profiler is not ...:
+        PROFILER = profiler
+    if time_queries is not ...:
+        TIME_QUERIES = time_queries
+
+# -----------------------------
+# Memory
+# -----------------------------
+def current_rss_mb():
+    """Resident set size of this process in MB, or None if it cannot be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1e6
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class _MemorySampler(threading.Thread):
+    """Samples RSS in the background; peak is the highest value seen while it ran."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_mb = current_rss_mb()
+        self.peak = self.start_mb
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(MEMORY_INTERVAL):
+            rss = current_rss_mb()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def finish(self):
+        self._done.set()
+        rss = current_rss_mb()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+        return self.start_mb, self.peak
+
+# -----------------------------
+# SQLite query timing
+# -----------------------------
+def _statement_key(sql):
+    return " ".join(str(sql).split())[:120]
+
+def _record_query(key, seconds):
+    stages = _active.get()
+    if not stages:
+        return
+    queries = stages[-1]["queries"]
+    calls, total = queries.get(key, (0, 0.0))
+    queries[key] = (calls + 1, total + seconds)
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time to the running stage."""
+
+    _key = None
+
+    def execute(self, sql, parameters=()):
+        self._key = _statement_key(sql)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(self._key, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._key = _statement_key(sql)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(self._key, time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        self._key = _statement_key(sql_script)
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_query(self._key, time.perf_counter() - start)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            # Fetch time is added to the statement's time but not counted as another call
+            stages = _active.get()
+            if stages and self._key in stages[-1]["queries"]:
+                calls, total = stages[-1]["queries"][self._key]
+                stages[-1]["queries"][self._key] = (calls, total + time.perf_counter() - start)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (including conn.execute shortcuts) are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+def connection_factory():
+    """sqlite3.connect(factory=...) for db_config connections."""
+    return TimedConnection if TIME_QUERIES else sqlite3.Connection
+
+# -----------------------------
+# Profiling
+# -----------------------------
+def _start_profile():
+    """Start a profiler unless one is already running (profilers neither nest nor run in two threads at once)."""
+    if PROFILE_DIR is None or not _profiling.acquire(blocking=False):
+        return None
+    if PROFILER == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+            profiler = Profiler()
+        except ImportError:
+            print("❌ pyinstrument is not installed; using cProfile")
+            profiler = cProfile.Profile()
+    else:
+        profiler = cProfile.Profile()
+    if isinstance(profiler, cProfile.Profile):
+        profiler.enable()
+    else:
+        profiler.start()
+    return profiler
+
+def _stop_profile(profiler, name):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+    else:
+        profiler.stop()
+    _profiling.release()
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    base = os.path.join(PROFILE_DIR, f"{safe_name}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+    if isinstance(profiler, cProfile.Profile):
+        path = base + ".prof"   # python -m pstats, snakeviz
+        profiler.dump_stats(path)
+    else:
+        path = base + ".html"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+    return path
+
+# -----------------------------
+# Stages
+# -----------------------------
+@contextmanager
+def stage(name):
+    """Measure the enclosed block as one stage; yields its record (set record["rows"] or use add_rows)."""
+    parent = _active.get()
+    record = {"stage": name, "parent": parent[-1]["stage"] if parent else None, "rows": 0, "queries": {}}
+    token = _active.set(parent + (record,))
+    sampler = _MemorySampler()
+    sampler.start()
+    profiler = _start_profile()
+    started = datetime.now()
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        yield record
+    except BaseException as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        start_mb, peak_mb = sampler.finish()
+        profile_path = _stop_profile(profiler, name) if profiler is not None else None
+        _active.reset(token)
+        _finish(record, started, seconds, status, error, start_mb, peak_mb, profile_path)
+
+def add_rows(count):
+    """Add to the row count of the innermost running stage (no-op outside a stage)."""
+    stages = _active.get()
+    if stages:
+        stages[-1]["rows"] += int(count)
+
+def instrument(name=None, rows=None):
+    """Decorator form of stage(); rows(result) may give the row count from the return value."""
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if rows is not None and result is not None:
+                    record["rows"] += int(rows(result))
+                return result
+        return wrapper
+    return decorate
+
+def _finish(record, started, seconds, status, error, start_mb, peak_mb, profile_path):
+    queries = sorted(record.pop("queries").items(), key=lambda item: item[1][1], reverse=True)
+    record.update({
+        "event": "stage",
+        "run_id": RUN_ID,
+        "pid": os.getpid(),
+        "started_at": started.isoformat(timespec="milliseconds"),
+        "seconds": round(seconds, 6),
+        "rows_per_sec": round(record["rows"] / seconds, 1) if seconds > 0 and record["rows"] else None,
+        "rss_start_mb": round(start_mb, 1) if start_mb is not None else None,
+        "peak_rss_mb": round(peak_mb, 1) if peak_mb is not None else None,
+        "sql_queries": sum(calls for calls, _ in dict(queries).values()),
+        "sql_seconds": round(sum(total for _, total in dict(queries).values()), 6),
+        "top_queries": [{"sql": sql, "calls": calls, "seconds": round(total, 6)}
+                        for sql, (calls, total) in queries[:TOP_QUERIES]],
+        "status": status,
+    })
+    if error:
+        record["error"] = error
+    if profile_path:
+        record["profile"] = profile_path
+
+    with _lock:
+        totals = _totals.setdefault(record["stage"], {"runs": 0, "errors": 0, "seconds": 0.0, "rows": 0,
+                                                       "sql_seconds": 0.0, "sql_queries": 0})
+        totals["runs"] += 1
+        totals["errors"] += status == "error"
+        for key in ("seconds", "rows", "sql_seconds", "sql_queries"):
+            totals[key] += record[key]
+        totals["last"] = record
+        if METRICS_LOG:
+            _append_log(record)
+        if PROMETHEUS_FILE:
+            write_prometheus(PROMETHEUS_FILE)
+
+    if PRINT_SUMMARY:
+        print(format_summary(record))
+
+def format_summary(record):
+    parts = [f"{record['seconds']:.2f}s"]
+    if record["rows_per_sec"]:
+        parts.append(f"{record['rows']:,} rows, {record['rows_per_sec']:,.0f} rows/s")
+    if record["peak_rss_mb"] is not None:
+        parts.append(f"peak {record['peak_rss_mb']:,.0f} MB")
+    if record["sql_queries"]:
+        parts.append(f"{record['sql_queries']} queries in {record['sql_seconds']:.2f}s")
+    mark = "❌" if record["status"] == "error" else "⏱"
+    return f"{mark} {record['stage']}: " + ", ".join(parts)
+
+# -----------------------------
+# Exporters
+# -----------------------------
+def _append_log(record):
+    os.makedirs(os.path.dirname(os.path.abspath(METRICS_LOG)), exist_ok=True)
+    # Dashboard loaders log on every page view, so the file is capped: one old generation is kept
+    if METRICS_LOG_MAX_BYTES and os.path.exists(METRICS_LOG) and os.path.getsize(METRICS_LOG) >= METRICS_LOG_MAX_BYTES:
+        os.replace(METRICS_LOG, METRICS_LOG + ".1")
+    with open(METRICS_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+PROMETHEUS_METRICS = [
+    # name, type, help, value(totals)
+    ("spikealert_stage_runs_total", "counter", "Completed runs of the stage.", lambda t: t["runs"]),
+    ("spikealert_stage_errors_total", "counter", "Runs of the stage that raised.", lambda t: t["errors"]),
+    ("spikealert_stage_seconds_total", "counter", "Wall time spent in the stage.", lambda t: t["seconds"]),
+    ("spikealert_stage_rows_total", "counter", "Rows processed by the stage.", lambda t: t["rows"]),
+    ("spikealert_stage_sql_seconds_total", "counter", "SQLite execute/fetch time in the stage.",
+     lambda t: t["sql_seconds"]),
+    ("spikealert_stage_sql_queries_total", "counter", "SQLite statements run by the stage.",
+     lambda t: t["sql_queries"]),
+    ("spikealert_stage_last_seconds", "gauge", "Duration of the stage's last run.", lambda t: t["last"]["seconds"]),
+    ("spikealert_stage_last_rows_per_second", "gauge", "Throughput of the stage's last run.",
+     lambda t: t["last"]["rows_per_sec"]),
+    ("spikealert_stage_last_peak_rss_bytes", "gauge", "Peak RSS during the stage's last run.",
+     lambda t: t["last"]["peak_rss_mb"] and t["last"]["peak_rss_mb"] * 1e6),
+]
+
+def write_prometheus(path):
+    """Write this process's stage totals in Prometheus text format (atomically, for textfile collectors)."""
+    lines = []
+    for metric, kind, help_text, value in PROMETHEUS_METRICS:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, totals in sorted(_totals.items()):
+            number = value(totals)
+            if number is not None:
+                lines.append(f'{metric}{{stage="{_escape(name)}"}} {float(number):.6g}')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+def read_log(path=None, run_id=None):
+    """Stage records from the structured log, optionally for one run."""
+    records = []
+    try:
+        with open(path or METRICS_LOG, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if run_id is None or record.get("run_id") == run_id:
+                    records.append(record)
+    except OSError:
+        pass
+    return records
+
+def print_report(records):
+    """Where the time went: per-stage totals from log records, slowest first."""
+    stages = {}
+    for r in records:
+        s = stages.setdefault(r["stage"], {"runs": 0, "seconds": 0.0, "rows": 0, "sql_seconds": 0.0, "peak": 0.0})
+        s["runs"] += 1
+        s["seconds"] += r["seconds"]
+        s["rows"] += r["rows"]
+        s["sql_seconds"] += r["sql_seconds"]
+        s["peak"] = max(s["peak"], r["peak_rss_mb"] or 0.0)
+    print("📊 Stage report:")
+    for name, s in sorted(stages.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        print(f"   {name:28s} {s['runs']:>5} runs {s['seconds']:9.2f}s  sql {s['sql_seconds']:8.2f}s  "
+              f"{s['rows']:>11,} rows  peak {s['peak']:8,.0f} MB")
+    return stages
+
+if __name__ == "__main__":
+    # python instrumentation.py [run_id]   -> summary of the structured log
+    print_report(read_log(run_id=sys.argv[1] if len(sys.argv) > 1 else None))
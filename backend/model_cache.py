@@ -0,0 +1,73 @@
+# model_cache.py
+import json
+from datetime import datetime, timedelta
+
+# Cached entries not used for this long are evicted
+MAX_AGE_DAYS = 30
+# At most this many entries are kept (least recently used are evicted first)
+MAX_ENTRIES = 50000
+
+
+def order_key(order):
+    """Text form of an ARIMA order, e.g. (1, 1, 1) -> '1,1,1'."""
+    return ",".join(str(part) for part in order)
+
+
+def load_cache(conn, order):
+    """Return {(commodity, market): (last_date, n_obs, params)} for one model order."""
+    rows = conn.execute(
+        "SELECT commodity, market, last_date, n_obs, params FROM forecast_model_cache WHERE model_order = ?",
+        (order_key(order),),
+    )
+    return {(commodity, market): (last_date, n_obs, json.loads(params))
+            for commodity, market, last_date, n_obs, params in rows}
+
+
+def load_entry(conn, order, commodity, market):
+    """Return (last_date, n_obs, params) of one series for one model order, or None (primary-key lookup)."""
+    row = conn.execute("""
+        SELECT last_date, n_obs, params FROM forecast_model_cache
+        WHERE model_order = ? AND commodity = ? AND market = ?
+    """, (order_key(order), commodity, market)).fetchone()
+    if row is None:
+        return None
+    last_date, n_obs, params = row
+    return last_date, n_obs, json.loads(params)
+
+
+def save_cache(conn, order, entries):
+    """Store fitted parameters.
+
+    entries is a list of (commodity, market, last_date, n_obs, params, refitted);
+    fitted_at only moves forward for entries whose parameters were re-estimated.
+    """
+    now = datetime.now().isoformat(timespec="seconds")
+    key = order_key(order)
+    conn.executemany("""
+        INSERT INTO forecast_model_cache
+            (commodity, market, model_order, last_date, n_obs, params, fitted_at, last_used)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (commodity, market, model_order) DO UPDATE SET
+            last_date = excluded.last_date,
+            n_obs = excluded.n_obs,
+            params = excluded.params,
+            fitted_at = CASE WHEN ? THEN excluded.fitted_at ELSE fitted_at END,
+            last_used = excluded.last_used
+    """, [
+        (commodity, market, key, str(last_date), int(n_obs), json.dumps([float(p) for p in params]), now, now, refitted)
+        for commodity, market, last_date, n_obs, params, refitted in entries
+    ])
+    conn.commit()
+
+
+def evict(conn, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+    """Drop entries unused for max_age_days, then the least recently used beyond max_entries."""
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+    aged = conn.execute("DELETE FROM forecast_model_cache WHERE last_used < ?", (cutoff,)).rowcount
+    overflow = conn.execute("""
+        DELETE FROM forecast_model_cache WHERE rowid IN (
+            SELECT rowid FROM forecast_model_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )
+    """, (max_entries,)).rowcount
+    conn.commit()
+    return aged + overflow
@@ -0,0 +1,185 @@
+# parquet_store.py
+"""Optional columnar copy of commodity_prices: Parquet partitioned by commodity and year.
+
+SQLite stays the source of truth (upserts, the web frontend, incremental detection).
+After each load the touched (commodity, year) partitions are re-exported from it,
+and full-history scans (full spike rebuild, batch forecasting) read only the columns
+and partitions they need from here. Without pyarrow everything falls back to SQLite.
+"""
+import os
+import shutil
+from urllib.parse import quote
+import pandas as pd
+from db_config import get_db_connection, get_data_version
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+STORE_DIR = os.path.join(os.path.dirname(__file__), "..", "database", "prices_parquet")
+VERSION_FILE = "_data_version"   # commodity_prices data version the store was exported at
+
+PRICE_FIELDS = ["id", "state", "market", "variety", "date", "min", "max", "price"]
+
+def available():
+    return pa is not None
+
+def _schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("state", pa.dictionary(pa.int32(), pa.string())),
+        ("market", pa.dictionary(pa.int32(), pa.string())),
+        ("variety", pa.dictionary(pa.int32(), pa.string())),
+        ("date", pa.string()),  # ISO text, same as SQLite; sorts and compares correctly
+        ("min", pa.float64()),
+        ("max", pa.float64()),
+        ("price", pa.float64()),
+    ])
+
+def _partition_dir(commodity, year):
+    # Hive-style names; the dataset reader URI-decodes them back to the commodity name
+    return os.path.join(STORE_DIR, f"commodity={quote(str(commodity), safe='')}", f"year={int(year)}")
+
+# -----------------------------
+# Version tracking
+# -----------------------------
+def store_version():
+    """Data version the store was last synced at, or None if it was never built."""
+    try:
+        with open(os.path.join(STORE_DIR, VERSION_FILE)) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def _set_store_version(version):
+    os.makedirs(STORE_DIR, exist_ok=True)
+    with open(os.path.join(STORE_DIR, VERSION_FILE), "w") as f:
+        f.write(str(version))
+
+def is_current(conn):
+    """True if the store holds exactly what commodity_prices holds now."""
+    return available() and store_version() == get_data_version(conn, "commodity_prices")
+
+# -----------------------------
+# Export from SQLite
+# -----------------------------
+def touched_partitions(df):
+    """(commodity, year) pairs present in a freshly loaded frame."""
+    keys = pd.DataFrame({
+        "commodity": df["commodity"].astype(object),
+        "year": df["date"].astype(str).str[:4],
+    }).drop_duplicates()
+    keys = keys[keys["year"].str.isdigit()]
+    return set(keys.itertuples(index=False, name=None))
+
+def export_partition(conn, commodity, year):
+    """Rewrite one partition from SQLite; returns its row count."""
+    df = pd.read_sql_query(f"""
+        SELECT {", ".join(PRICE_FIELDS)} FROM commodity_prices
+        WHERE commodity = ? AND date >= ? AND date < ?
+        ORDER BY market, date
+    """, conn, params=(commodity, f"{int(year):04d}-01-01", f"{int(year) + 1:04d}-01-01"))
+
+    path = _partition_dir(commodity, year)
+    if df.empty:
+        shutil.rmtree(path, ignore_errors=True)
+        return 0
+
+    table = pa.Table.from_pandas(df, schema=_schema(), preserve_index=False)
+    os.makedirs(path, exist_ok=True)
+    # Write then rename, so a reader never sees a half-written file
+    tmp_file = os.path.join(path, "part-0.parquet.tmp")
+    pq.write_table(table, tmp_file, compression="zstd")
+    os.replace(tmp_file, os.path.join(path, "part-0.parquet"))
+    return len(df)
+
+def export_all(conn):
+    """Rebuild the whole store from commodity_prices."""
+    version = get_data_version(conn, "commodity_prices")
+    shutil.rmtree(STORE_DIR, ignore_errors=True)
+    partitions = conn.execute("""
+        SELECT DISTINCT commodity, substr(date, 1, 4) FROM commodity_prices
+        WHERE commodity IS NOT NULL AND date IS NOT NULL
+    """).fetchall()
+    rows = sum(export_partition(conn, commodity, year) for commodity, year in partitions if year.isdigit())
+    _set_store_version(version)
+    print(f"✅ Exported {rows} rows into {len(partitions)} Parquet partitions")
+    return rows
+
+def sync_after_load(conn, df, previous_version):
+    """Bring the store up to date after a load into commodity_prices.
+
+    If the store was current before the load, only the touched partitions are
+    re-exported; otherwise (first run, or a load made without pyarrow) it is rebuilt.
+    """
+    if not available():
+        return
+    if store_version() != previous_version:
+        export_all(conn)
+        return
+    partitions = touched_partitions(df)
+    rows = sum(export_partition(conn, commodity, year) for commodity, year in partitions)
+    _set_store_version(get_data_version(conn, "commodity_prices"))
+    print(f"🔹 Re-exported {len(partitions)} Parquet partitions ({rows} rows)")
+
+# -----------------------------
+# Reading
+# -----------------------------
+def _dataset():
+    partitioning = ds.partitioning(pa.schema([("commodity", pa.string()), ("year", pa.int32())]), flavor="hive")
+    return ds.dataset(STORE_DIR, format="parquet", partitioning=partitioning)
+
+def _filter(commodities=None, start=None, end=None):
+    """Partition filters (commodity, year) prune directories; date bounds are pushed into row groups."""
+    conditions = []
+    if commodities is not None:
+        conditions.append(ds.field("commodity").isin(list(commodities)))
+    if start is not None:
+        conditions.append(ds.field("year") >= int(start[:4]))
+        conditions.append(ds.field("date") >= start)
+    if end is not None:
+        conditions.append(ds.field("year") <= int(end[:4]))
+        conditions.append(ds.field("date") <= end)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def read_prices(columns, commodities=None, start=None, end=None, sort=None):
+    """Read only the given columns (partition keys included) as a DataFrame."""
+    table = _dataset().to_table(columns=list(columns), filter=_filter(commodities, start, end))
+    if sort:
+        # Arrow cannot sort dictionary columns directly; sort on decoded keys, keep the encoded columns
+        keys = pa.table({
+            column: table[column].cast(pa.string()) if pa.types.is_dictionary(table[column].type) else table[column]
+            for column in sort
+        })
+        table = table.take(pc.sort_indices(keys, sort_keys=[(column, "ascending") for column in sort]))
+    return table.to_pandas()
+
+def list_commodities():
+    """Commodities in the store, from the partition directories alone."""
+    return sorted({ds.get_partition_keys(fragment.partition_expression)["commodity"]
+                   for fragment in _dataset().get_fragments()})
+
+def iter_commodity_series(columns=("id", "market", "state", "date", "price")):
+    """Yield each commodity's rows ordered by (market, date), one commodity at a time.
+
+    Every chunk holds whole series, so no rows need to be carried between chunks.
+    """
+    for commodity in list_commodities():
+        df = read_prices(columns, commodities=[commodity], sort=["market", "date"])
+        df.insert(0, "commodity", commodity)
+        yield df
+
+if __name__ == "__main__":
+    if not available():
+        print("❌ pyarrow is not installed; the Parquet store is disabled")
+    else:
+        conn = get_db_connection()
+        export_all(conn)
+        conn.close()
@@ -0,0 +1,235 @@
+# pipeline_dag.py
+"""Stage runner for the data pipeline.
+
+Each stage declares its dependencies and a fingerprint of its inputs (CSV
+size/mtime/hash, table data versions). A stage whose fingerprint matches the
+one recorded after its last successful run is skipped, so a daily run with no
+new data only stats the CSV tree. Stages whose dependencies are done run
+concurrently in a thread pool; every run is logged to pipeline_runs.
+"""
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from db_config import get_db_connection, get_data_version, initialize_database
+import instrumentation
+
+HASH_BLOCK = 1 << 20
+
+# name -> {"deps": (...), "fingerprint": func(conn, options), "run": func(conn, options) -> rows}
+STAGES = {}
+
+def stage(name, deps=(), fingerprint=None):
+    """Register a stage function; fingerprint=None means the stage always runs."""
+    def register(run):
+        STAGES[name] = {"deps": tuple(deps), "fingerprint": fingerprint, "run": run}
+        return run
+    return register
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+# -----------------------------
+# Input fingerprints
+# -----------------------------
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+def _digest(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def _input_files(options):
+    if options.get("files") is not None:
+        return list(options["files"])
+    from fetch_prices import iter_historical_files, REALTIME_CSV
+    return list(iter_historical_files()) + [REALTIME_CSV]
+
+def changed_files(conn, files):
+    """Files whose content differs from what was last ingested.
+
+    Size and mtime are checked first; a file is only hashed when they moved, and
+    a touched-but-identical file just has its recorded mtime refreshed.
+    """
+    recorded = {row[0]: row[1:] for row in conn.execute("SELECT path, size, mtime_ns, sha1 FROM pipeline_files")}
+    changed = []
+    for path in files:
+        stat = _stat(path)
+        if stat is None:
+            print(f"❌ Input file not found: {path}")
+            continue
+        previous = recorded.get(path)
+        if previous and tuple(previous[:2]) == stat:
+            continue
+        sha1 = file_sha1(path)
+        if previous and previous[2] == sha1:
+            conn.execute("UPDATE pipeline_files SET size = ?, mtime_ns = ? WHERE path = ?", (*stat, path))
+            continue
+        changed.append((path, stat, sha1))
+    conn.commit()
+    return changed
+
+def _files_fingerprint(conn, options):
+    return _digest(sorted((path, _stat(path)) for path in _input_files(options)))
+
+def _table_fingerprint(*tables, option_keys=()):
+    def fingerprint(conn, options):
+        return _digest([get_data_version(conn, table) for table in tables],
+                       [options.get(key) for key in option_keys])
+    return fingerprint
+
+# -----------------------------
+# Stages
+# -----------------------------
+@stage("ingest", fingerprint=_files_fingerprint)
+def ingest_stage(conn, options):
+    from fetch_prices import ingest_parallel
+    changed = changed_files(conn, _input_files(options))
+    if not changed:
+        print("🔹 No new or modified CSV files")
+        return 0
+
+    report = ingest_parallel(files=[path for path, _, _ in changed], workers=options.get("workers"))
+    loaded = {r["file"] for r in report if r["error"] is None}
+    conn.executemany("""
+        INSERT INTO pipeline_files (path, size, mtime_ns, sha1, ingested_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (path) DO UPDATE SET
+            size = excluded.size, mtime_ns = excluded.mtime_ns, sha1 = excluded.sha1, ingested_at = excluded.ingested_at
+    """, [(path, *stat, sha1, _now()) for path, stat, sha1 in changed if path in loaded])
+    conn.commit()
+    if len(loaded) < len(changed):
+        raise RuntimeError(f"{len(changed) - len(loaded)} files failed to load")
+    return sum(r["inserted"] + r["updated"] for r in report)
+
+@stage("series_store", deps=["ingest"], fingerprint=_table_fingerprint("commodity_prices"))
+def series_store_stage(conn, options):
+    import series_store
+    return series_store.build(conn)
+
+# Incremental detection reads only new rows from SQL, so it does not wait for the store rebuild
+@stage("detect", deps=["ingest"], fingerprint=_table_fingerprint("commodity_prices", option_keys=["method"]))
+def detect_stage(conn, options):
+    from anomaly_detection import detect_spikes
+    return detect_spikes(full_rebuild=options.get("full_rebuild", False), method=options.get("method", "percent"))
+
+@stage("forecast", deps=["series_store"],
+       fingerprint=_table_fingerprint("commodity_prices", option_keys=["forecast_model", "steps"]))
+def forecast_stage(conn, options):
+    from forecast import forecast_all
+    forecast, _ = forecast_all(steps=options.get("steps", 7), model=options.get("forecast_model", "ses"),
+                               workers=options.get("workers"))
+    return forecast
+
+@stage("propagation", deps=["series_store"],
+       fingerprint=_table_fingerprint("commodity_prices", option_keys=["max_lag", "window_days"]))
+def propagation_stage(conn, options):
+    from spike_propagation import compute_propagation, MAX_LAG
+    return compute_propagation(max_lag=options.get("max_lag") or MAX_LAG, window_days=options.get("window_days"))
+
+@stage("retention", deps=["detect"], fingerprint=_table_fingerprint("price_spikes", option_keys=["retention_months"]))
+def retention_stage(conn, options):
+    from spike_partitions import apply_retention, RETENTION_MONTHS
+    return apply_retention(conn, options.get("retention_months") or RETENTION_MONTHS)
+
+@stage("export_charts", deps=["detect"],
+       fingerprint=_table_fingerprint("commodity_prices", "price_spikes", "price_spikes:rebuild"))
+def export_charts_stage(conn, options):
+    from export_charts import export_charts
+    return export_charts()
+
+# -----------------------------
+# Runner
+# -----------------------------
+def _record(conn, run_id, name, status, seconds, rows, started, fingerprint=None):
+    conn.execute("""
+        INSERT INTO pipeline_runs (run_id, stage, status, seconds, rows, started_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (run_id, name, status, seconds, rows, started))
+    if status == "ran":
+        conn.execute("""
+            INSERT INTO pipeline_stages (stage, fingerprint, seconds, rows, finished_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (stage) DO UPDATE SET
+                fingerprint = excluded.fingerprint, seconds = excluded.seconds,
+                rows = excluded.rows, finished_at = excluded.finished_at
+        """, (name, fingerprint, seconds, rows, _now()))
+    conn.commit()
+
+def _run_stage(run_id, name, options, force):
+    """Run one stage unless its fingerprint is unchanged; returns its result record."""
+    spec = STAGES[name]
+    started = _now()
+    start = time.perf_counter()
+    conn = get_db_connection()
+    fingerprint = None
+    try:
+        fingerprint = spec["fingerprint"](conn, options) if spec["fingerprint"] else None
+        previous = conn.execute("SELECT fingerprint FROM pipeline_stages WHERE stage = ?", (name,)).fetchone()
+        if not force and fingerprint is not None and previous and previous[0] == fingerprint:
+            result = {"stage": name, "status": "skipped", "seconds": time.perf_counter() - start, "rows": 0}
+        else:
+            print(f"🔹 Running stage {name}")
+            # The fingerprint was taken before the run: it names the inputs this result was computed from
+            with instrumentation.stage(f"dag:{name}") as record:
+                rows = spec["run"](conn, options) or 0
+                record["rows"] = int(rows)
+            result = {"stage": name, "status": "ran", "seconds": time.perf_counter() - start, "rows": int(rows)}
+    except Exception as e:
+        result = {"stage": name, "status": "failed", "seconds": time.perf_counter() - start, "rows": 0, "error": str(e)}
+        print(f"❌ Stage {name} failed: {e}")
+    _record(conn, run_id, name, result["status"], result["seconds"], result["rows"], started, fingerprint)
+    conn.close()
+    return result
+
+def run_dag(stages=None, options=None, force=(), max_workers=2):
+    """Run the given stages (default: all) in dependency order.
+
+    force is a collection of stage names to run even if unchanged (or True for all).
+    A failed stage blocks its dependents. Returns one result record per stage.
+    """
+    options = options or {}
+    selected = list(stages or STAGES)
+    run_id = uuid.uuid4().hex[:12]
+    initialize_database()
+
+    results = {}
+    pending = set(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                deps = [dep for dep in STAGES[name]["deps"] if dep in selected]
+                if any(results.get(dep, {}).get("status") in ("failed", "blocked") for dep in deps):
+                    results[name] = {"stage": name, "status": "blocked", "seconds": 0.0, "rows": 0}
+                    pending.discard(name)
+                elif all(dep in results for dep in deps):
+                    stage_forced = force is True or name in force
+                    running[pool.submit(_run_stage, run_id, name, options, stage_forced)] = name
+                    pending.discard(name)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    print_summary([results[name] for name in selected])
+    return [results[name] for name in selected]
+
+def print_summary(results):
+    total = sum(r["seconds"] for r in results)
+    print("✅ Pipeline finished:")
+    for r in results:
+        rate = f", {r['rows'] / r['seconds']:.0f} rows/s" if r["status"] == "ran" and r["seconds"] > 0 else ""
+        print(f"   {r['stage']:<14} {r['status']:<8} {r['seconds']:7.2f}s {r['rows']:>10} rows{rate}")
+    print(f"   stage time {total:.2f}s")
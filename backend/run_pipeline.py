@@ -1,7 +1,25 @@
-from db_config import initialize_database
-from combined_data_pipeline import run_pipeline
+import sys
+import instrumentation
+from pipeline_dag import run_dag
 
 if __name__ == "__main__":
-    initialize_database()
-    run_pipeline()
+    # Stages whose inputs are unchanged since their last run are skipped;
+    # --force reruns everything, --full-rebuild redoes spike detection from scratch.
+    full_rebuild = "--full-rebuild" in sys.argv
+    force = True if "--force" in sys.argv else ({"detect"} if full_rebuild else ())
+    options = {
+        "full_rebuild": full_rebuild,
+        "method": "zscore" if "--zscore" in sys.argv else "percent",
+    }
+    # --profile dumps a cProfile per stage, --prometheus keeps a metrics file for node_exporter
+    instrumentation.configure(
+        profile_dir=instrumentation.DEFAULT_PROFILE_DIR if "--profile" in sys.argv else None,
+        prometheus_file=instrumentation.DEFAULT_PROMETHEUS_FILE if "--prometheus" in sys.argv else None,
+    )
+    # Only one profiler can run at a time, so profiled runs execute stages one by one
+    results = run_dag(options=options, force=force, max_workers=1 if "--profile" in sys.argv else 2)
+    instrumentation.print_report(instrumentation.read_log(run_id=instrumentation.RUN_ID))
+    if any(r["status"] in ("failed", "blocked") for r in results):
+        print("❌ Some pipeline stages did not complete")
+        sys.exit(1)
     print("✅ All steps completed successfully!")
@@ -0,0 +1,193 @@
+# series_store.py
+"""Compact memory-mapped store of every (commodity, market) price series.
+
+Layout under database/series_store/ (rows ordered by commodity, market, date):
+    prices.f64   float64 price per row (exact, so spikes read from here match SQL)
+    days.i32     int32 days since 1970-01-01 per row
+    ids.i64      commodity_prices id per row (spike detection high-water marks)
+    states.i16   int16 code into index.npz["state_names"] per row
+    index.npz    commodity / market / offset / length per series, plus state_names
+    meta.json    row count, store format and the commodity_prices data version it was built at
+
+Series are contiguous, so reading one is two array slices of a numpy.memmap:
+no query, no sort, and only the touched pages become resident.
+"""
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from db_config import get_db_connection, get_data_version
+
+STORE_DIR = os.path.join(os.path.dirname(__file__), "..", "database", "series_store")
+BUILD_CHUNK = 500000
+FORMAT = 2  # bumped when the file layout changes; older stores are rebuilt
+
+ROW_FILES = {
+    "prices": ("prices.f64", np.float64),
+    "days": ("days.i32", np.int32),
+    "ids": ("ids.i64", np.int64),
+    "states": ("states.i16", np.int16),
+}
+
+def days_to_dates(days):
+    """int32 day offsets to datetime64[D]; str() of each gives the ISO date."""
+    return np.asarray(days, dtype=np.int64).astype("datetime64[D]")
+
+# -----------------------------
+# Build
+# -----------------------------
+def build(conn=None):
+    """Rebuild the store from commodity_prices in one streamed, key-ordered scan."""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    version = get_data_version(conn, "commodity_prices")
+    tmp_dir = STORE_DIR + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    outputs = {name: open(os.path.join(tmp_dir, file_name), "wb") for name, (file_name, _) in ROW_FILES.items()}
+    commodities, markets, lengths = [], [], []
+    state_codes = {}
+    rows = 0
+    try:
+        query = """
+            SELECT id, commodity, market, state, date, price FROM commodity_prices
+            WHERE commodity IS NOT NULL AND market IS NOT NULL AND date IS NOT NULL
+            ORDER BY commodity, market, date
+        """
+        for chunk in pd.read_sql_query(query, conn, chunksize=BUILD_CHUNK):
+            if chunk.empty:
+                break
+            commodity = chunk["commodity"].to_numpy()
+            market = chunk["market"].to_numpy()
+            starts = np.ones(len(chunk), dtype=bool)
+            starts[1:] = (commodity[1:] != commodity[:-1]) | (market[1:] != market[:-1])
+            # A series cut by the chunk boundary continues the previous chunk's last series
+            if lengths and (commodity[0], market[0]) == (commodities[-1], markets[-1]):
+                starts[0] = False
+
+            start_idx = np.flatnonzero(starts)
+            first = start_idx[0] if len(start_idx) else len(chunk)
+            if first and lengths:
+                lengths[-1] += int(first)
+            commodities.extend(commodity[start_idx].tolist())
+            markets.extend(market[start_idx].tolist())
+            lengths.extend(np.diff(np.append(start_idx, len(chunk))).tolist())
+
+            states = chunk["state"].fillna("")
+            for name in states.unique():
+                state_codes.setdefault(name, len(state_codes))
+            days = (pd.to_datetime(chunk["date"]).to_numpy().astype("datetime64[D]")
+                    - np.datetime64("1970-01-01", "D")).astype(np.int32)
+
+            chunk["price"].to_numpy(dtype=np.float64).tofile(outputs["prices"])
+            days.tofile(outputs["days"])
+            chunk["id"].to_numpy(dtype=np.int64).tofile(outputs["ids"])
+            states.map(state_codes).to_numpy(dtype=np.int16).tofile(outputs["states"])
+            rows += len(chunk)
+    finally:
+        for output in outputs.values():
+            output.close()
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    np.savez(
+        os.path.join(tmp_dir, "index.npz"),
+        commodity=np.asarray(commodities, dtype=str),
+        market=np.asarray(markets, dtype=str),
+        offset=np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64),
+        length=lengths,
+        state_names=np.asarray(list(state_codes), dtype=str),
+    )
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"rows": rows, "series": len(lengths), "format": FORMAT, "data_version": version}, f)
+
+    shutil.rmtree(STORE_DIR, ignore_errors=True)
+    os.rename(tmp_dir, STORE_DIR)
+    if own_conn:
+        conn.close()
+    print(f"✅ Built series store: {len(lengths)} series, {rows} points")
+    return rows
+
+# -----------------------------
+# Open / read
+# -----------------------------
+_opened = {}  # data version -> open store, so a process maps the files once
+
+def _meta():
+    try:
+        with open(os.path.join(STORE_DIR, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("format") == FORMAT else None
+
+def is_current(conn):
+    """True if the store was built from the current commodity_prices data."""
+    meta = _meta()
+    return meta is not None and meta["data_version"] == get_data_version(conn, "commodity_prices")
+
+def open_store():
+    """Memory-map the store (read-only); returns a dict of arrays plus a key -> series lookup."""
+    meta = _meta()
+    if meta is None:
+        return None
+    if meta["data_version"] in _opened:
+        return _opened[meta["data_version"]]
+
+    store = {"rows": meta["rows"]}
+    for name, (file_name, dtype) in ROW_FILES.items():
+        # np.memmap cannot map an empty file
+        store[name] = (np.memmap(os.path.join(STORE_DIR, file_name), dtype=dtype, mode="r")
+                       if meta["rows"] else np.empty(0, dtype=dtype))
+    with np.load(os.path.join(STORE_DIR, "index.npz")) as index:
+        for name in ("commodity", "market", "offset", "length", "state_names"):
+            store[name] = index[name]
+    store["keys"] = list(zip(store["commodity"].tolist(), store["market"].tolist()))
+    store["lookup"] = {key: i for i, key in enumerate(store["keys"])}
+
+    _opened.clear()
+    _opened[meta["data_version"]] = store
+    return store
+
+def get_series(store, commodity, market):
+    """(dates, prices) of one series in O(1), or None; prices is a zero-copy memmap slice."""
+    i = store["lookup"].get((commodity, market))
+    if i is None:
+        return None
+    start, end = store["offset"][i], store["offset"][i] + store["length"][i]
+    return days_to_dates(store["days"][start:end]), store["prices"][start:end]
+
+def iter_series(store, min_points=1):
+    """Yield (commodity, market, dates, prices) for every series with at least min_points points."""
+    for i in np.flatnonzero(store["length"] >= min_points):
+        start, end = store["offset"][i], store["offset"][i] + store["length"][i]
+        commodity, market = store["keys"][i]
+        yield commodity, market, days_to_dates(store["days"][start:end]), store["prices"][start:end]
+
+def iter_partitions(store, chunk_size=500000):
+    """Yield (partition, rows) frames shaped like anomaly_detection.iter_price_partitions.
+
+    Chunks end on series boundaries, so no row has to be carried into the next one.
+    """
+    ends = store["offset"] + store["length"]
+    first = 0
+    while first < len(ends):
+        # Last series that still ends within chunk_size rows of this chunk's start
+        last = max(first, int(np.searchsorted(ends, store["offset"][first] + chunk_size, side="right")) - 1)
+        start, end = store["offset"][first], ends[last]
+        lengths = store["length"][first:last + 1]
+        partition = pd.DataFrame({
+            "id": np.asarray(store["ids"][start:end]),
+            "commodity": np.repeat(store["commodity"][first:last + 1].astype(object), lengths),
+            "market": np.repeat(store["market"][first:last + 1].astype(object), lengths),
+            "state": store["state_names"].astype(object)[store["states"][start:end]],
+            "date": np.datetime_as_string(days_to_dates(store["days"][start:end])).astype(object),
+            "price": np.array(store["prices"][start:end]),
+            "seed_price": np.nan,
+        })
+        yield partition, len(partition)
+        first = last + 1
+
+if __name__ == "__main__":
+    build()
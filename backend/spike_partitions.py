@@ -0,0 +1,350 @@
+# spike_partitions.py
+"""Monthly partitions of the spike store.
+
+Spikes live in one table per month (price_spikes_2024_01, ...). The catalog table
+spike_partitions lists them with their row counts and id/date bounds, and
+price_spikes is a UNION ALL view over the live ones, so existing readers keep
+working. Readers that know their date range (or id high-water mark) ask the
+catalog for the partitions they need and query only those.
+
+Ids come from one counter in pipeline_meta and only ever grow, across
+partitions, full rebuilds and retention, so "id > high-water mark" readers
+(alerts_stream.py, visualization.get_spikes, /api/filter paging) stay correct.
+
+Retention drops the row-level detail of months older than RETENTION_MONTHS.
+The rollup tables (spike_rollups.py) are cumulative and are never decremented,
+so a dropped month stays in every dashboard aggregate; the catalog keeps its row
+count as compacted_rows.
+"""
+import re
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from db_config import bump_data_version, _sql_rows
+
+VIEW = "price_spikes"
+CATALOG = "spike_partitions"
+NEXT_ID_KEY = "price_spikes:next_id"
+UNDATED = "0000-00"        # partition for rows without a usable date
+RETENTION_MONTHS = 24      # months of row-level spikes kept, counted back from the newest month
+
+COLUMNS = {
+    "id": "INTEGER PRIMARY KEY",
+    "commodity": "TEXT",
+    "market": "TEXT",
+    "state": "TEXT",
+    "date": "TEXT",
+    "old_price": "REAL",
+    "new_price": "REAL",
+    "spike_percent": "REAL",
+    "alert_level": "TEXT",
+    "z_score": "REAL",
+}
+
+# Same indexes the single price_spikes table had, per partition
+PARTITION_INDEXES = {
+    "series": "commodity, market, date",
+    "date": "date",
+    "market_date": "market, date",
+    "state_date": "state, date",
+}
+
+_MONTH = re.compile(r"^\d{4}-\d{2}")
+
+def table_name(month):
+    return f"{VIEW}_{month.replace('-', '_')}"
+
+def month_of(dates):
+    """'YYYY-MM' of each ISO date (UNDATED where there is none)."""
+    dates = pd.Series(dates, copy=False).astype(object)
+    text = dates.where(dates.notna(), "").astype(str)
+    return text.str[:7].where(text.str.match(_MONTH), UNDATED)
+
+def _shift_month(month, months):
+    year, number = int(month[:4]), int(month[5:7])
+    index = year * 12 + number - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+# -----------------------------
+# Schema
+# -----------------------------
+def create_catalog(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CATALOG} (
+            month TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            live INTEGER NOT NULL DEFAULT 1,
+            rows INTEGER NOT NULL DEFAULT 0,
+            min_id INTEGER,
+            max_id INTEGER,
+            min_date TEXT,
+            max_date TEXT,
+            compacted_rows INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT,
+            compacted_at TEXT
+        )
+    """)
+
+def refresh_view(conn):
+    """Recreate the price_spikes view over the live partitions (in the caller's transaction)."""
+    tables = [row[0] for row in conn.execute(f"SELECT table_name FROM {CATALOG} WHERE live ORDER BY month")]
+    columns = ", ".join(COLUMNS)
+    if tables:
+        body = " UNION ALL ".join(f"SELECT {columns} FROM {table}" for table in tables)
+    else:
+        # Keep the view (and its columns) even when no partition exists
+        body = "SELECT " + ", ".join(f"CAST(NULL AS {sql_type.split()[0]}) AS {name}"
+                                     for name, sql_type in COLUMNS.items()) + " WHERE 0"
+    conn.execute(f"DROP VIEW IF EXISTS {VIEW}")
+    conn.execute(f"CREATE VIEW {VIEW} AS {body}")
+
+def ensure_partition(conn, month):
+    """Create the month's table and catalog entry if missing (in the caller's transaction).
+
+    Returns True if it was (re)created.
+    """
+    table = table_name(month)
+    row = conn.execute(f"SELECT live FROM {CATALOG} WHERE month = ?", (month,)).fetchone()
+    if row and row[0]:
+        return False
+
+    columns = ", ".join(f"{name} {sql_type}" for name, sql_type in COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+    for suffix, index_columns in PARTITION_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{suffix} ON {table} ({index_columns})")
+    # A compacted month that gets new spikes (late data) comes back with only those rows
+    conn.execute(f"""
+        INSERT INTO {CATALOG} (month, table_name, live, rows, created_at) VALUES (?, ?, 1, 0, ?)
+        ON CONFLICT (month) DO UPDATE SET live = 1, rows = 0, min_id = NULL, max_id = NULL,
+            min_date = NULL, max_date = NULL
+    """, (month, table, _now()))
+    return True
+
+def create_spike_store(conn):
+    """Catalog plus an empty price_spikes view (fresh databases, db_spikes_setup.py)."""
+    create_catalog(conn.cursor())
+    refresh_view(conn)
+    conn.commit()
+
+def drop_spike_store(conn):
+    """Drop the view, every partition and the catalog (or a pre-partitioning price_spikes table)."""
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (VIEW,)).fetchone()
+    if kind:
+        conn.execute(f"DROP {'VIEW' if kind[0] == 'view' else 'TABLE'} {VIEW}")
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+                          (f"{VIEW}_[0-9]*",)).fetchall()
+    for (table,) in tables:
+        conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"DROP TABLE IF EXISTS {CATALOG}")
+    conn.commit()
+
+def partition_existing_table(conn):
+    """Migration: move a single price_spikes table into monthly partitions, keeping its ids."""
+    cursor = conn.cursor()
+    create_catalog(cursor)
+    kind = cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (VIEW,)).fetchone()
+    if kind and kind[0] == "table":
+        legacy = f"{VIEW}_legacy"
+        cursor.execute(f"ALTER TABLE {VIEW} RENAME TO {legacy}")
+        legacy_columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({legacy})")}
+        select = ", ".join(name if name in legacy_columns else f"NULL AS {name}" for name in COLUMNS)
+        month_sql = f"CASE WHEN date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr(date, 1, 7) ELSE '{UNDATED}' END"
+        months = [row[0] for row in cursor.execute(f"SELECT DISTINCT {month_sql} FROM {legacy}")]
+        for month in sorted(months):
+            ensure_partition(conn, month)
+            if month == UNDATED:
+                condition, params = f"{month_sql} = ?", (UNDATED,)
+            else:
+                # Date range, so the old date index is used instead of a scan per month
+                condition, params = "date >= ? AND date < ?", (f"{month}-01", f"{_shift_month(month, 1)}-01")
+            cursor.execute(f"INSERT INTO {table_name(month)} ({', '.join(COLUMNS)}) "
+                           f"SELECT {select} FROM {legacy} WHERE {condition}", params)
+            _refresh_catalog_stats(conn, month)
+        next_id = cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {legacy}").fetchone()[0]
+        cursor.execute(f"DROP TABLE {legacy}")
+        _set_next_id(conn, next_id)
+    refresh_view(conn)
+    conn.commit()
+
+# -----------------------------
+# Writing
+# -----------------------------
+def _set_next_id(conn, next_id):
+    conn.execute("""
+        INSERT INTO pipeline_meta (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)
+    """, (NEXT_ID_KEY, int(next_id)))
+
+def _reserve_ids(conn, count):
+    """First of count consecutive new spike ids (reserved in the caller's transaction)."""
+    row = conn.execute("SELECT value FROM pipeline_meta WHERE key = ?", (NEXT_ID_KEY,)).fetchone()
+    first = row[0] if row else 1
+    _set_next_id(conn, first + count)
+    return first
+
+def _refresh_catalog_stats(conn, month):
+    conn.execute(f"""
+        UPDATE {CATALOG} SET (rows, min_id, max_id, min_date, max_date) =
+            (SELECT COUNT(*), MIN(id), MAX(id), MIN(date), MAX(date) FROM {table_name(month)})
+        WHERE month = ?
+    """, (month,))
+
+def insert_spikes(conn, spikes_df):
+    """Store spikes in their monthly partitions under new ids; returns the number stored.
+
+    Rows are grouped by month before ids are handed out, so each partition gets one
+    increasing id range. Nothing is committed here: the caller commits the ids,
+    rows and catalog bounds in one transaction (see anomaly_detection.detect_spikes),
+    so a reader following "id > high-water mark" sees a batch whole or not at all.
+    """
+    if spikes_df.empty:
+        return 0
+    months = month_of(spikes_df["date"]).to_numpy()
+    order = np.argsort(months, kind="stable")
+    spikes_df = spikes_df.iloc[order]
+    months = months[order]
+    first_id = _reserve_ids(conn, len(spikes_df))
+    spikes_df = spikes_df.assign(id=np.arange(first_id, first_id + len(spikes_df)))[["id", *spikes_df.columns]]
+
+    unique_months = list(dict.fromkeys(months))
+    created = [month for month in unique_months if ensure_partition(conn, month)]
+    if created:
+        refresh_view(conn)
+
+    bounds = np.flatnonzero(np.r_[True, months[1:] != months[:-1], True])
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        month = months[start]
+        part = spikes_df.iloc[start:end]
+        conn.executemany(f"INSERT INTO {table_name(month)} ({', '.join(part.columns)}) "
+                         f"VALUES ({', '.join('?' * len(part.columns))})", _sql_rows(part))
+        dates = part["date"].dropna().astype(str)
+        first_date, last_date = (dates.min(), dates.max()) if len(dates) else (None, None)
+        # Same transaction as the rows, so catalog bounds never run ahead of them (see alerts_stream.py)
+        conn.execute(f"""
+            UPDATE {CATALOG} SET rows = rows + ?,
+                min_id = COALESCE(MIN(min_id, ?), ?), max_id = COALESCE(MAX(max_id, ?), ?),
+                min_date = COALESCE(MIN(min_date, ?), ?), max_date = COALESCE(MAX(max_date, ?), ?)
+            WHERE month = ?
+        """, (int(end - start), int(part["id"].iat[0]), int(part["id"].iat[0]), int(part["id"].iat[-1]), int(part["id"].iat[-1]),
+              first_date, first_date, last_date, last_date, month))
+    return len(spikes_df)
+
+def drop_partitions(conn):
+    """Remove every partition and catalog entry (full detection rebuild); the id counter is kept."""
+    for (table,) in conn.execute(f"SELECT table_name FROM {CATALOG}").fetchall():
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(f"DELETE FROM {CATALOG}")
+    refresh_view(conn)
+    conn.commit()
+
+# -----------------------------
+# Reading
+# -----------------------------
+def partitions(conn, start=None, end=None, after_id=None):
+    """Live partition tables overlapping [start, end] (ISO dates) that hold ids above after_id."""
+    conditions, params = ["live"], []
+    if start:
+        conditions.append("month >= ?")
+        params.append(start[:7])
+    if end:
+        conditions.append("month <= ?")
+        params.append(end[:7])
+    if start or end:
+        conditions.append("month <> ?")
+        params.append(UNDATED)
+    if after_id is not None:
+        conditions.append("max_id > ?")
+        params.append(after_id)
+    return [row[0] for row in conn.execute(
+        f"SELECT table_name FROM {CATALOG} WHERE {' AND '.join(conditions)} ORDER BY month", params)]
+
+def union_sql(tables, select):
+    """select (with a {table} placeholder) over each table, combined with UNION ALL.
+
+    Each branch is wrapped as its own subquery, so a branch may carry ORDER BY/LIMIT.
+    """
+    if not tables:
+        return select.format(table=VIEW) + " LIMIT 0"
+    return " UNION ALL ".join(f"SELECT * FROM ({select.format(table=table)})" for table in tables)
+
+def read_spikes(conn, start=None, end=None, after_id=0):
+    """Spike rows from the partitions that can hold them, ordered by id."""
+    tables = partitions(conn, start, end, after_id)
+    conditions, params = ["id > ?"], [after_id]
+    if start:
+        conditions.append("date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("date <= ?")
+        params.append(end)
+    sql = union_sql(tables, f"SELECT * FROM {{table}} WHERE {' AND '.join(conditions)}")
+    return pd.read_sql_query(f"SELECT * FROM ({sql}) ORDER BY id", conn, params=params * max(len(tables), 1))
+
+def latest_date(conn):
+    """Newest spike date in the live partitions, or None."""
+    row = conn.execute(f"SELECT MAX(max_date) FROM {CATALOG} WHERE live AND month <> ?", (UNDATED,)).fetchone()
+    return row[0] if row else None
+
+# -----------------------------
+# Retention
+# -----------------------------
+def apply_retention(conn, keep_months=RETENTION_MONTHS):
+    """Drop the row-level partitions of months older than the newest keep_months.
+
+    Their spikes remain in the rollup tables. A month is only dropped if the
+    monthly rollup accounts for at least as many spikes as were ever stored for
+    it (a rollup cleared without a rebuild would otherwise lose them). Returns
+    the number of rows dropped.
+    """
+    newest = conn.execute(f"SELECT MAX(month) FROM {CATALOG} WHERE month <> ?", (UNDATED,)).fetchone()[0]
+    if newest is None or keep_months is None:
+        return 0
+    cutoff = _shift_month(newest, -(keep_months - 1))
+    old = conn.execute(f"""
+        SELECT month, table_name, rows, compacted_rows FROM {CATALOG}
+        WHERE live AND month < ? AND month <> ? ORDER BY month
+    """, (cutoff, UNDATED)).fetchall()
+
+    dropped = 0
+    compacted = []
+    for month, table, rows, compacted_rows in old:
+        rolled_up = conn.execute("SELECT COALESCE(SUM(spike_count), 0) FROM spike_rollup_monthly WHERE month = ?",
+                                 (month,)).fetchone()[0]
+        if rolled_up < rows + compacted_rows:
+            print(f"❌ Keeping {table}: the monthly rollup holds {rolled_up} of its {rows + compacted_rows} spikes "
+                  f"(run a full detection rebuild)")
+            continue
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"""
+            UPDATE {CATALOG} SET live = 0, compacted_rows = compacted_rows + rows, rows = 0,
+                min_id = NULL, max_id = NULL, compacted_at = ?
+            WHERE month = ?
+        """, (_now(), month))
+        conn.commit()
+        dropped += rows
+        compacted.append(month)
+
+    if compacted:
+        refresh_view(conn)
+        # Cached row-level frames must reload without the dropped months
+        bump_data_version(conn, f"{VIEW}:rebuild")
+        print(f"✅ Compacted {len(compacted)} months before {cutoff} ({dropped} spike rows) into the rollups")
+    return dropped
+
+def catalog(conn):
+    return pd.read_sql_query(f"SELECT * FROM {CATALOG} ORDER BY month", conn)
+
+if __name__ == "__main__":
+    import sys
+    from db_config import get_db_connection
+    conn = get_db_connection()
+    if "--retention" in sys.argv:
+        # python spike_partitions.py --retention [months]
+        position = sys.argv.index("--retention")
+        months = int(sys.argv[position + 1]) if len(sys.argv) > position + 1 else RETENTION_MONTHS
+        apply_retention(conn, months)
+    print(catalog(conn).to_string(index=False))
+    conn.close()
@@ -0,0 +1,290 @@
+# spike_propagation.py
+"""Which markets lead price moves in other markets, per commodity.
+
+All markets of a commodity are aligned on one daily grid (a 2-D array of log
+prices, markets x days) and turned into standardized daily returns. The
+correlation of leader returns on day t with follower returns on day t + lag
+is then computed for every market pair and every lag at once, as masked
+matrix products over blocks of leaders, so missing days only drop out of the
+pairs they affect. A leader -> follower edge is kept when its best lag
+correlates at least MIN_CORR and more strongly than the reverse direction.
+
+Edges are stored in spike_propagation (commodity, leader, follower, lag_days,
+strength, reverse_strength, overlap).
+"""
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from db_config import get_db_connection, bump_data_version
+import series_store
+from instrumentation import instrument
+
+TABLE = "spike_propagation"
+MAX_LAG = 7            # days a follower may trail its leader
+MIN_CORR = 0.3         # weakest lagged correlation kept as an edge
+MIN_OVERLAP = 30       # days both markets must have returns for at the best lag
+MIN_POINTS = 30        # prices a series needs to take part
+MAX_GAP = 3            # missing days bridged by carrying the last price forward
+MAX_EDGES = 20         # strongest followers kept per leader
+BLOCK_SIZE = 256       # leaders per batch of matrix products
+CLIP = 5.0             # standardized returns are clipped to +-CLIP (one bad print is not a lead)
+
+# -----------------------------
+# Loading
+# -----------------------------
+def _ranges(offsets, lengths):
+    """Row indexes of the concatenated ranges [offset, offset + length)."""
+    starts = np.repeat(offsets - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    return starts + np.arange(lengths.sum())
+
+def iter_commodities(min_points=MIN_POINTS):
+    """Yield (commodity, markets, market_codes, days, prices) for each commodity with 2+ usable markets.
+
+    days are int days since 1970-01-01; market_codes index into markets.
+    """
+    conn = get_db_connection()
+    if series_store.is_current(conn):
+        conn.close()
+        yield from _iter_store_commodities(series_store.open_store(), min_points)
+        return
+
+    df = pd.read_sql_query("""
+        SELECT commodity, market, date, price FROM commodity_prices
+        WHERE commodity IS NOT NULL AND market IS NOT NULL AND date IS NOT NULL
+        ORDER BY commodity, market
+    """, conn)
+    conn.close()
+    dates = pd.to_datetime(df["date"], errors="coerce")
+    df = df[dates.notna()].assign(day=dates[dates.notna()].to_numpy().astype("datetime64[D]").astype(np.int64))
+    for commodity, group in df.groupby("commodity", sort=True):
+        counts = group["market"].value_counts()
+        group = group[group["market"].isin(counts.index[counts >= min_points])]
+        codes, markets = pd.factorize(group["market"], sort=True)
+        if len(markets) >= 2:
+            yield (commodity, np.asarray(markets, dtype=object), codes, group["day"].to_numpy(),
+                   group["price"].to_numpy(dtype=float))
+
+def _iter_store_commodities(store, min_points):
+    commodity = store["commodity"]
+    starts = np.flatnonzero(np.r_[True, commodity[1:] != commodity[:-1]]) if len(commodity) else []
+    ends = np.r_[starts[1:], len(commodity)] if len(commodity) else []
+    for first, end in zip(starts, ends):
+        lengths = store["length"][first:end]
+        keep = np.flatnonzero(lengths >= min_points)
+        if len(keep) < 2:
+            continue
+        rows = _ranges(store["offset"][first:end][keep], lengths[keep])
+        codes = np.repeat(np.arange(len(keep)), lengths[keep])
+        yield (commodity[first], store["market"][first:end][keep].astype(object), codes,
+               np.asarray(store["days"][rows], dtype=np.int64), np.asarray(store["prices"][rows], dtype=float))
+
+# -----------------------------
+# Grid and returns
+# -----------------------------
+def price_grid(market_codes, days, prices, n_markets, window_days=None):
+    """Mean log price per market and day as (first_day, grid[n_markets, n_days]), NaN where unreported.
+
+    Several prices on one day (varieties) are averaged; window_days keeps only
+    the last window_days days.
+    """
+    valid = prices > 0
+    if window_days:
+        valid &= days > days.max() - window_days
+    market_codes, days, prices = market_codes[valid], days[valid], prices[valid]
+    if not len(days):
+        return 0, np.empty((n_markets, 0))
+    first_day = int(days.min())
+    n_days = int(days.max()) - first_day + 1
+    cells = market_codes.astype(np.int64) * n_days + (days - first_day)
+    total = np.bincount(cells, weights=np.log(prices), minlength=n_markets * n_days)
+    count = np.bincount(cells, minlength=n_markets * n_days)
+    with np.errstate(invalid="ignore"):
+        grid = total / count
+    return first_day, grid.reshape(n_markets, n_days)
+
+def _fill_gaps(grid, limit=MAX_GAP):
+    """Carry each price forward over at most limit missing days."""
+    columns = np.arange(grid.shape[1])
+    last_seen = np.maximum.accumulate(np.where(np.isnan(grid), -1, columns), axis=1)
+    filled = np.take_along_axis(grid, np.maximum(last_seen, 0), axis=1)
+    filled[(last_seen < 0) | (columns - last_seen > limit)] = np.nan
+    return filled
+
+def standardized_returns(grid, max_gap=MAX_GAP):
+    """Daily log returns scaled to zero mean and unit variance per market, as (returns, mask).
+
+    Missing returns are 0 in returns and 0 in the mask, so they drop out of
+    every masked sum.
+    """
+    returns = np.diff(_fill_gaps(grid, max_gap), axis=1)
+    mask = ~np.isnan(returns)
+    count = mask.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(returns, axis=1, keepdims=True) / count
+        std = np.sqrt(np.nansum((returns - mean) ** 2, axis=1, keepdims=True) / count)
+        returns = np.clip((returns - mean) / std, -CLIP, CLIP)
+    # Flat series (std 0) carry no signal
+    mask &= np.isfinite(returns)
+    # float32 halves the cost of the matrix products; standardized returns lose nothing that matters
+    return np.where(mask, returns, 0.0).astype(np.float32), mask.astype(np.float32)
+
+# -----------------------------
+# Lagged correlation
+# -----------------------------
+def _masked_corr(lead, lead_mask, follow, follow_mask, min_overlap):
+    """Pairwise-complete Pearson correlation of every lead row with every follow row, and the overlap counts.
+
+    The six sums per pair come out of two matrix products.
+    """
+    b = len(lead)
+    left = np.vstack([lead_mask, lead, lead * lead]) @ follow_mask.T
+    right = np.vstack([lead_mask, lead]) @ np.vstack([follow, follow * follow]).T
+    n, sx, sxx = left[:b], left[b:2 * b], left[2 * b:]
+    m = len(follow)
+    sy, syy, sxy = right[:b, :m], right[:b, m:], right[b:, :m]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    corr[(n < min_overlap) | ~np.isfinite(corr)] = np.nan
+    return corr, n
+
+def lagged_correlations(returns, mask, leaders, max_lag=MAX_LAG, min_overlap=MIN_OVERLAP):
+    """Correlations for the given leader rows against every market at lags 1..max_lag.
+
+    Returns (forward, reverse, overlap), each shaped (max_lag, len(leaders), n_markets):
+    forward[l, i, j] correlates leader i on day t with market j on day t + l + 1,
+    reverse[l, i, j] market j on day t with leader i on day t + l + 1.
+    """
+    n_markets, n_days = returns.shape
+    shape = (max_lag, len(leaders), n_markets)
+    forward, reverse, overlap = np.full(shape, np.nan), np.full(shape, np.nan), np.zeros(shape)
+    for lag in range(1, min(max_lag, n_days - 1) + 1):
+        early, late = slice(0, n_days - lag), slice(lag, n_days)
+        forward[lag - 1], overlap[lag - 1] = _masked_corr(
+            returns[leaders, early], mask[leaders, early], returns[:, late], mask[:, late], min_overlap)
+        backward, _ = _masked_corr(
+            returns[leaders, late], mask[leaders, late], returns[:, early], mask[:, early], min_overlap)
+        reverse[lag - 1] = backward
+    return forward, reverse, overlap
+
+def commodity_edges(returns, mask, max_lag=MAX_LAG, min_corr=MIN_CORR, min_overlap=MIN_OVERLAP,
+                    max_edges=MAX_EDGES, block_size=BLOCK_SIZE):
+    """Leader -> follower edges as arrays (leader, follower, lag_days, strength, reverse_strength, overlap).
+
+    Leaders are processed block_size at a time, so memory stays at
+    O(max_lag * block_size * n_markets) however many markets there are.
+    """
+    n_markets = len(returns)
+    parts = []
+    for start in range(0, n_markets, block_size):
+        leaders = np.arange(start, min(start + block_size, n_markets))
+        forward, reverse, overlap = lagged_correlations(returns, mask, leaders, max_lag, min_overlap)
+        scores = np.where(np.isnan(forward), -np.inf, forward)
+        best = scores.argmax(axis=0)[None]
+        strength = np.take_along_axis(scores, best, axis=0)[0]
+        reverse_strength = np.take_along_axis(reverse, best, axis=0)[0]
+        keep = (strength >= min_corr) & ~(reverse_strength >= strength)
+        keep[np.arange(len(leaders)), leaders] = False  # a market does not lead itself
+
+        # Strongest max_edges followers per leader
+        ranked = np.where(keep, strength, -np.inf)
+        k = min(max_edges, n_markets)
+        top = np.argpartition(-ranked, k - 1, axis=1)[:, :k]
+        rows = np.repeat(np.arange(len(leaders)), k)
+        followers = top.ravel()
+        selected = np.isfinite(ranked[rows, followers])
+        rows, followers = rows[selected], followers[selected]
+        parts.append((leaders[rows], followers, best[0][rows, followers] + 1, strength[rows, followers],
+                      reverse_strength[rows, followers], np.take_along_axis(overlap, best, axis=0)[0][rows, followers]))
+    if not parts:
+        return tuple(np.empty(0) for _ in range(6))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+# -----------------------------
+# Pipeline entry point
+# -----------------------------
+@instrument(rows=lambda edges: edges)
+def compute_propagation(max_lag=MAX_LAG, min_corr=MIN_CORR, window_days=None, commodities=None):
+    """Recompute the propagation edges of every commodity (or the given ones) and store them.
+
+    Returns the number of edges stored.
+    """
+    frames = []
+    analyzed = []
+    for commodity, markets, codes, days, prices in iter_commodities():
+        if commodities and commodity not in commodities:
+            continue
+        _, grid = price_grid(codes, days, prices, len(markets), window_days)
+        returns, mask = standardized_returns(grid)
+        leader, follower, lag, strength, reverse_strength, overlap = commodity_edges(
+            returns, mask, max_lag=max_lag, min_corr=min_corr)
+        analyzed.append(commodity)
+        frames.append(pd.DataFrame({
+            "commodity": commodity,
+            "leader": markets[leader.astype(int)],
+            "follower": markets[follower.astype(int)],
+            "lag_days": lag.astype(int),
+            "strength": strength.round(4),
+            "reverse_strength": np.where(np.isnan(reverse_strength), None, reverse_strength.round(4)),
+            "overlap": overlap.astype(int),
+        }))
+
+    edges = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    store_edges(edges, analyzed, replace_all=not commodities)
+    print(f"✅ Stored {len(edges)} propagation edges for {len(analyzed)} commodities")
+    return len(edges)
+
+def store_edges(edges, commodities, replace_all=True):
+    """Replace the stored edges (of all commodities, or just the given ones) in one transaction."""
+    conn = get_db_connection(bulk=True)
+    computed_at = datetime.now().isoformat(timespec="seconds")
+    conn.execute("BEGIN")
+    try:
+        if replace_all:
+            conn.execute(f"DELETE FROM {TABLE}")
+        else:
+            conn.executemany(f"DELETE FROM {TABLE} WHERE commodity = ?", [(c,) for c in commodities])
+        if not edges.empty:
+            conn.executemany(f"""
+                INSERT INTO {TABLE} (commodity, leader, follower, lag_days, strength, reverse_strength, overlap,
+                                     computed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(*row, computed_at) for row in edges.itertuples(index=False, name=None)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    bump_data_version(conn, TABLE)
+    conn.close()
+
+def load_edges(commodity=None, market=None, limit=None):
+    """Stored edges, strongest first; market matches either end of an edge."""
+    conditions, params = [], []
+    if commodity:
+        conditions.append("commodity = ?")
+        params.append(commodity)
+    if market:
+        conditions.append("(leader = ? OR follower = ?)")
+        params += [market, market]
+    sql = f"SELECT * FROM {TABLE} {'WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY strength DESC"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    conn = get_db_connection()
+    edges = pd.read_sql_query(sql, conn, params=params)
+    conn.close()
+    return edges
+
+def _arg(flag, default=None):
+    """Value following flag on the command line, e.g. --max-lag 5."""
+    if flag in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(flag) + 1]
+    return default
+
+if __name__ == "__main__":
+    # python spike_propagation.py [commodity ...] [--max-lag N] [--window DAYS]
+    values = {_arg("--max-lag"), _arg("--window")}
+    names = [arg for arg in sys.argv[1:] if not arg.startswith("--") and arg not in values]
+    compute_propagation(max_lag=int(_arg("--max-lag", MAX_LAG)),
+                        window_days=int(_arg("--window")) if _arg("--window") else None,
+                        commodities=names or None)
+    print(load_edges(commodity=names[0] if names else None, limit=20).to_string(index=False))
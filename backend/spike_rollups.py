@@ -0,0 +1,105 @@
+# spike_rollups.py
+import pandas as pd
+
+# Materialized aggregates of price_spikes, keyed by the listed columns.
+# Each table stores spike_count (rows), value_count (rows with a spike %)
+# and spike_sum, so means can be merged incrementally: mean = sum / value_count.
+# Missing key values are stored as '' so they take part in the primary key.
+ROLLUPS = {
+    "spike_rollup_commodity": ["commodity"],
+    "spike_rollup_market": ["market"],
+    "spike_rollup_state": ["state"],
+    "spike_rollup_monthly": ["month", "commodity"],
+    "spike_rollup_commodity_alert": ["commodity", "alert_level"],
+    "spike_rollup_market_commodity": ["market", "commodity"],
+}
+
+# SQL expression for each key column over price_spikes
+_KEY_SQL = {
+    "commodity": "COALESCE(commodity, '')",
+    "market": "COALESCE(market, '')",
+    "state": "COALESCE(state, '')",
+    "alert_level": "COALESCE(alert_level, '')",
+    "month": "COALESCE(substr(date, 1, 7), '')",
+}
+
+
+def create_rollup_tables(cursor):
+    """Create the rollup tables if they don't exist."""
+    for table, keys in ROLLUPS.items():
+        key_columns = ", ".join(f"{key} TEXT NOT NULL" for key in keys)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key_columns},
+                spike_count INTEGER NOT NULL,
+                value_count INTEGER NOT NULL,
+                spike_sum REAL NOT NULL,
+                PRIMARY KEY ({", ".join(keys)})
+            )
+        """)
+
+
+def clear_rollups(conn):
+    """Empty every rollup table (used before a full detection rebuild)."""
+    for table in ROLLUPS:
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup table from price_spikes."""
+    cursor = conn.cursor()
+    for table, keys in ROLLUPS.items():
+        key_sql = ", ".join(_KEY_SQL[key] for key in keys)
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"""
+            INSERT INTO {table} ({", ".join(keys)}, spike_count, value_count, spike_sum)
+            SELECT {key_sql}, COUNT(*), COUNT(spike_percent), COALESCE(SUM(spike_percent), 0)
+            FROM price_spikes
+            GROUP BY {key_sql}
+        """)
+    conn.commit()
+
+
+def update_rollups(conn, spikes_df):
+    """Add a batch of newly stored spikes to every rollup table.
+
+    Does not commit: the counts are cumulative, so they must be committed in the
+    same transaction as the spikes they count (see anomaly_detection.detect_spikes).
+    """
+    if spikes_df.empty:
+        return
+
+    keyed = pd.DataFrame({
+        "commodity": spikes_df["commodity"],
+        "market": spikes_df["market"],
+        "state": spikes_df["state"],
+        "alert_level": spikes_df["alert_level"],
+        # Missing dates become '' before slicing, as in _KEY_SQL (astype(str) would give "None"/"NaT")
+        "month": spikes_df["date"].astype(object).where(spikes_df["date"].notna(), "").astype(str).str[:7],
+    }).astype(object).fillna("")
+    keyed["spike_percent"] = spikes_df["spike_percent"].to_numpy()
+
+    for table, keys in ROLLUPS.items():
+        grouped = keyed.groupby(keys, sort=False)["spike_percent"].agg(["size", "count", "sum"]).reset_index()
+        conn.executemany(f"""
+            INSERT INTO {table} ({", ".join(keys)}, spike_count, value_count, spike_sum)
+            VALUES ({", ".join("?" * (len(keys) + 3))})
+            ON CONFLICT ({", ".join(keys)}) DO UPDATE SET
+                spike_count = spike_count + excluded.spike_count,
+                value_count = value_count + excluded.value_count,
+                spike_sum = spike_sum + excluded.spike_sum
+        """, [
+            (*row[:-3], int(row[-3]), int(row[-2]), float(row[-1]))
+            for row in grouped.itertuples(index=False, name=None)
+        ])
+
+
+def load_rollups(conn):
+    """Load every rollup table as a DataFrame with a spike_percent (mean) column."""
+    rollups = {}
+    for table in ROLLUPS:
+        df = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+        df["spike_percent"] = df["spike_sum"] / df["value_count"].where(df["value_count"] > 0)
+        rollups[table.replace("spike_rollup_", "")] = df
+    return rollups
@@ -1,26 +1,92 @@
 # visualizations.py
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
-from db_config import get_db_connection
+import threading
+from db_config import get_db_connection, get_data_version
+from spike_rollups import load_rollups
+from spike_partitions import read_spikes, latest_date
+from instrumentation import instrument
+from downsampling import (POINT_BUDGET, reduction_report, downsample_series, stratified_sample,
+                          box_stats, box_outliers)
 
 # Load Data
 
+SPIKES_VERSION_TABLE = "price_spikes"
+SPIKES_REBUILD_TABLE = "price_spikes:rebuild"  # bumped when stored spikes are deleted (see anomaly_detection.py)
+
+# Periods offered for the row-level charts; a window reads only the monthly partitions it covers
+ROW_PERIODS = {"All stored spikes": None, "Last 90 days": 90, "Last 365 days": 365}
+
+@st.cache_resource
+def _spike_store(days=None):
+    """Process-wide spike frame per period, shared by all sessions and extended in place as new rows arrive."""
+    return {"lock": threading.Lock(), "df": None, "max_id": 0, "version": None, "rebuild": None, "since": None}
+
+@instrument("dashboard:read_spikes", rows=len)
+def _read_spikes(conn, after_id, since=None):
+    spikes_df = read_spikes(conn, start=since, after_id=after_id)
+    # Convert date to datetime
+    spikes_df['date'] = pd.to_datetime(spikes_df['date'])
+    return spikes_df
+
+def _window_start(conn, days):
+    """ISO date days before the newest stored spike, or None for no window."""
+    latest = latest_date(conn) if days else None
+    return (pd.Timestamp(latest) - pd.Timedelta(days=days)).date().isoformat() if latest else None
+
+def get_spikes(days=None):
+    """Fetch spike rows from the price_spikes partitions, optionally only the last days days.
+
+    Returns (spikes_df, version). Only rows added since the last call are read;
+    the frame is reloaded only after a full rebuild, a retention run or when the
+    window moves. Treat the frame as read-only.
+    """
+    store = _spike_store(days)
+    conn = get_db_connection()
+    try:
+        with store["lock"]:
+            version = get_data_version(conn, SPIKES_VERSION_TABLE)
+            rebuild = get_data_version(conn, SPIKES_REBUILD_TABLE)
+            if store["df"] is not None and (store["version"], store["rebuild"]) == (version, rebuild):
+                return store["df"], version
+
+            since = _window_start(conn, days)
+            if store["df"] is None or store["rebuild"] != rebuild or store["since"] != since:
+                spikes_df = _read_spikes(conn, 0, since)
+            else:
+                new_rows = _read_spikes(conn, store["max_id"], since)
+                spikes_df = store["df"] if new_rows.empty else pd.concat([store["df"], new_rows], ignore_index=True)
+
+            store.update(df=spikes_df, version=version, rebuild=rebuild, since=since,
+                         max_id=int(spikes_df["id"].max()) if not spikes_df.empty else 0)
+            return spikes_df, version
+    finally:
+        conn.close()
+
+def get_spikes_version():
+    """Data version of price_spikes; changes whenever spike detection stores new rows."""
+    conn = get_db_connection()
+    version = get_data_version(conn, SPIKES_VERSION_TABLE)
+    conn.close()
+    return version
+
 @st.cache_data
-def get_spikes():
-    """Fetch spike data from the price_spikes table."""
+@instrument("dashboard:get_rollups", rows=lambda rollups: sum(len(df) for df in rollups.values()))
+def get_rollups(version):
+    """Fetch the pre-aggregated spike rollup tables maintained by anomaly detection (cached per data version)."""
     conn = get_db_connection()
-    spikes_df = pd.read_sql_query("SELECT * FROM price_spikes", conn)
+    rollups = load_rollups(conn)
     conn.close()
-    # Convert date to datetime
-    if not spikes_df.empty:
-        spikes_df['date'] = pd.to_datetime(spikes_df['date'])
-    return spikes_df
+    return rollups
 
 # Visualization Functions
+# Most charts read the small rollup tables (see spike_rollups.py); the
+# row-level charts further down still take the spikes DataFrame.
 
-def commodity_spike_bar(spikes_df):
-    df = spikes_df.groupby("commodity")["spike_percent"].mean().reset_index()
+def commodity_spike_bar(commodity_rollup):
+    df = commodity_rollup[["commodity", "spike_percent"]]
     fig = px.bar(
         df,
         x="commodity",
@@ -31,8 +97,8 @@ def commodity_spike_bar(spikes_df):
     )
     return fig
 
-def market_spike_pie(spikes_df):
-    df = spikes_df.groupby("market").size().reset_index(name="count")
+def market_spike_pie(market_rollup):
+    df = market_rollup.rename(columns={"spike_count": "count"})
     fig = px.pie(
         df,
         names="market",
@@ -41,13 +107,11 @@ def market_spike_pie(spikes_df):
     )
     return fig
 
-def top10_commodities_spikes(spikes_df):
+def top10_commodities_spikes(commodity_rollup):
     df = (
-        spikes_df.groupby("commodity")["spike_percent"]
-        .mean()
-        .sort_values(ascending=False)
+        commodity_rollup[["commodity", "spike_percent"]]
+        .sort_values("spike_percent", ascending=False)
         .head(10)
-        .reset_index()
     )
     fig = px.bar(
         df,
@@ -59,9 +123,9 @@ def top10_commodities_spikes(spikes_df):
     )
     return fig
 
-def top_markets_for_top_commodity(spikes_df, top_commodity):
-    df = spikes_df[spikes_df["commodity"] == top_commodity]
-    df = df.groupby("market")["spike_percent"].mean().sort_values(ascending=False).reset_index()
+def top_markets_for_top_commodity(market_commodity_rollup, top_commodity):
+    df = market_commodity_rollup[market_commodity_rollup["commodity"] == top_commodity]
+    df = df[["market", "spike_percent"]].sort_values("spike_percent", ascending=False)
     fig = px.bar(
         df,
         x="market",
@@ -72,15 +136,15 @@ def top_markets_for_top_commodity(spikes_df, top_commodity):
     )
     return fig
 
-def state_wise_spike_map(spikes_df):
+def state_wise_spike_map(state_rollup):
     """Map showing spike counts per country/state"""
-    if "country" not in spikes_df.columns:
-        spikes_df["country"] = "India"
+    df = state_rollup.assign(country="India")
 
-    df_grouped = spikes_df.groupby("country").agg(
-        spike_count=("spike_percent", "count"),
-        spike_avg=("spike_percent", "mean")
+    df_grouped = df.groupby("country").agg(
+        spike_count=("value_count", "sum"),
+        spike_sum=("spike_sum", "sum")
     ).reset_index()
+    df_grouped["spike_avg"] = df_grouped["spike_sum"] / df_grouped["spike_count"]
 
     fig = px.choropleth(
         df_grouped,
@@ -95,8 +159,8 @@ def state_wise_spike_map(spikes_df):
     fig.update_layout(geo=dict(showframe=False, showcoastlines=True))
     return fig
 
-def market_commodity_heatmap(spikes_df):
-    heatmap_data = spikes_df.pivot_table(
+def market_commodity_heatmap(market_commodity_rollup):
+    heatmap_data = market_commodity_rollup.pivot_table(
         index="market",
         columns="commodity",
         values="spike_percent",
@@ -114,8 +178,8 @@ def market_commodity_heatmap(spikes_df):
 # -----------------------------
 # Advanced Visualizations
 # -----------------------------
-def spike_severity_pie(spikes_df):
-    df = spikes_df.groupby("alert_level").size().reset_index(name="count")
+def spike_severity_pie(commodity_alert_rollup):
+    df = commodity_alert_rollup.groupby("alert_level")["spike_count"].sum().reset_index(name="count")
     fig = px.pie(
         df,
         names="alert_level",
@@ -126,11 +190,9 @@ def spike_severity_pie(spikes_df):
     )
     return fig
 
-def spike_trend_over_time(spikes_df):
-    df = spikes_df.copy()
-    df['month'] = df['date'].dt.to_period('M')
-    df_grouped = df.groupby('month')['spike_percent'].mean().reset_index()
-    df_grouped['month'] = df_grouped['month'].astype(str)
+def spike_trend_over_time(monthly_rollup):
+    df_grouped = monthly_rollup.groupby('month')[['spike_sum', 'value_count']].sum().reset_index()
+    df_grouped['spike_percent'] = df_grouped['spike_sum'] / df_grouped['value_count']
     fig = px.line(
         df_grouped,
         x='month',
@@ -140,8 +202,8 @@ def spike_trend_over_time(spikes_df):
     )
     return fig
 
-def commodity_severity_heatmap(spikes_df):
-    df = spikes_df.pivot_table(
+def commodity_severity_heatmap(commodity_alert_rollup):
+    df = commodity_alert_rollup.pivot_table(
         index="commodity",
         columns="alert_level",
         values="spike_percent",
@@ -157,8 +219,9 @@ def commodity_severity_heatmap(spikes_df):
     )
     return fig
 
-def top_states_by_spike(spikes_df):
-    df = spikes_df.groupby("state")["spike_percent"].mean().sort_values(ascending=False).reset_index()
+def top_states_by_spike(state_rollup):
+    df = state_rollup[state_rollup["state"] != ""]
+    df = df[["state", "spike_percent"]].sort_values("spike_percent", ascending=False)
     fig = px.bar(
         df,
         x="state",
@@ -169,8 +232,8 @@ def top_states_by_spike(spikes_df):
     )
     return fig
 
-def spike_count_per_market(spikes_df):
-    df = spikes_df.groupby("market").size().sort_values(ascending=False).reset_index(name="count")
+def spike_count_per_market(market_rollup):
+    df = market_rollup.rename(columns={"spike_count": "count"}).sort_values("count", ascending=False)
     fig = px.bar(
         df,
         x="count",
@@ -185,46 +248,60 @@ def spike_count_per_market(spikes_df):
 # -----------------------------
 # New Additional Advanced Visualizations
 # -----------------------------
-def commodity_box_plot(spikes_df):
-    fig = px.box(
-        spikes_df,
-        x="commodity",
-        y="spike_percent",
-        color="commodity",
+# These charts plot row-level spikes, so their data is downsampled to a point budget
+# (see downsampling.py); the reduction is kept in fig.layout.meta for the dashboard caption.
+
+def commodity_box_plot(spikes_df, budget=POINT_BUDGET):
+    # Boxes come from precomputed quartiles; only the outliers are drawn as points
+    stats = box_stats(spikes_df, "commodity", "spike_percent")
+    outliers = box_outliers(spikes_df, "commodity", "spike_percent", stats, budget)
+    colors = px.colors.qualitative.Plotly
+
+    fig = go.Figure()
+    for i, row in enumerate(stats.itertuples(index=False)):
+        color = colors[i % len(colors)]
+        fig.add_trace(go.Box(
+            x=[row.commodity], q1=[row.q1], median=[row.median], q3=[row.q3],
+            lowerfence=[row.lowerfence], upperfence=[row.upperfence],
+            name=row.commodity, legendgroup=row.commodity, marker_color=color,
+        ))
+        points = outliers[outliers["commodity"] == row.commodity]
+        fig.add_trace(go.Scatter(
+            x=points["commodity"], y=points["spike_percent"], mode="markers",
+            legendgroup=row.commodity, showlegend=False, marker=dict(color=color, size=4),
+        ))
+    fig.update_layout(
         title="📦 Commodity Spike % Distribution (Box Plot)",
-        points="all"
+        xaxis_title="commodity", yaxis_title="spike_percent",
+        meta={"downsampling": reduction_report("Box plot", len(spikes_df), len(stats) * 5 + len(outliers))},
     )
     return fig
 
-def market_spike_scatter(spikes_df):
+def market_spike_scatter(spikes_df, budget=POINT_BUDGET):
     severity_color = {"High": "red", "Medium": "orange", "Low": "green"}
-    
-    df = spikes_df.copy()
-    df['size_spike'] = df['spike_percent'].abs()  # fix negative size error
-    
+    sample = stratified_sample(spikes_df, "alert_level", budget)
+
     fig = px.scatter(
-        df,
+        sample,
         x="market",
         y="spike_percent",
-        size="size_spike",
+        size=sample['spike_percent'].abs(),  # fix negative size error
         color="alert_level",
         color_discrete_map=severity_color,
         hover_data=["commodity", "date"],
         title="🔍 Market vs Spike % Scatter (Size=Spike%, Color=Severity)"
     )
+    fig.update_layout(meta={"downsampling": reduction_report("Scatter", len(spikes_df), len(sample))})
     return fig
 
-def monthly_spike_heatmap(spikes_df):
-    df = spikes_df.copy()
-    df['month'] = df['date'].dt.to_period('M')
-    df_grouped = df.pivot_table(
+def monthly_spike_heatmap(monthly_rollup):
+    df_grouped = monthly_rollup.pivot_table(
         index="month",
         columns="commodity",
         values="spike_percent",
         aggfunc="mean",
         fill_value=0
     )
-    df_grouped.index = df_grouped.index.astype(str)
     fig = px.imshow(
         df_grouped,
         text_auto=True,
@@ -234,88 +311,121 @@ def monthly_spike_heatmap(spikes_df):
     )
     return fig
 
-def cumulative_spikes_timeline(spikes_df):
-    df = spikes_df.copy().sort_values("date")
+def cumulative_spikes_timeline(spikes_df, budget=POINT_BUDGET):
+    # sort_values returns a new frame, so the shared spikes frame is left untouched
+    df = spikes_df.sort_values("date")
     df['cumulative_spikes'] = df['spike_percent'].cumsum()
+    # The running total is computed on every row; only the drawn points are reduced
+    line = downsample_series(df, "date", "cumulative_spikes", budget)
     fig = px.line(
-        df,
+        line,
         x="date",
         y="cumulative_spikes",
         title="📈 Cumulative Spikes Over Time",
         markers=True
     )
+    fig.update_layout(meta={"downsampling": reduction_report("Timeline", len(df), len(line))})
     return fig
 
+# -----------------------------------
+# Figure cache
+# -----------------------------------
+@st.cache_data(max_entries=64)
+def cached_figure(name, version, _data, option=None):
+    """Build a figure once per (name, data version, option).
+
+    _data is not hashed: the data version already identifies it, so a widget rerun
+    returns the cached figure without touching the frame.
+    """
+    figure_func = globals()[name]
+    return figure_func(_data) if option is None else figure_func(_data, option)
+
+def show(name, version, data, option=None):
+    fig = cached_figure(name, version, data, option)
+    st.plotly_chart(fig, use_container_width=True)
+    meta = fig.layout.meta
+    report = meta.get("downsampling") if isinstance(meta, dict) else None
+    if report:
+        st.caption(f"Showing {report['after']:,} of {report['before']:,} points ({report['percent']}%)")
+
 # -----------------------------------
 # Streamlit Dashboard
 # -----------------------------------
 def main():
     st.set_page_config(page_title="Black Market Price Spike Dashboard", layout="wide")
     st.title("💹 Black Market Price Spike Analysis Dashboard")
+    budget = st.sidebar.slider("Max points per chart", 1000, 50000, POINT_BUDGET, step=1000)
+    period = st.sidebar.selectbox("Row-level charts cover", list(ROW_PERIODS))
 
-    spikes_df = get_spikes()
-    if spikes_df.empty:
+    version = get_spikes_version()
+    rollups = get_rollups(version)
+    commodity_rollup = rollups["commodity"]
+    if commodity_rollup.empty:
         st.warning("⚠ No spike data found. Please run anomaly detection first.")
         return
 
     # Top commodity
-    top_commodity = spikes_df.groupby("commodity")["spike_percent"].mean().idxmax()
+    top_commodity = commodity_rollup.set_index("commodity")["spike_percent"].idxmax()
 
     # KPI Section
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Spikes", len(spikes_df))
-    col2.metric("Unique Commodities", spikes_df["commodity"].nunique())
+    col1.metric("Total Spikes", int(commodity_rollup["spike_count"].sum()))
+    col2.metric("Unique Commodities", len(commodity_rollup))
     col3.metric("Top Commodity", top_commodity)
 
     # Existing charts
     st.subheader("📊 Commodity and Market Analysis")
     col1, col2 = st.columns(2)
     with col1:
-        st.plotly_chart(commodity_spike_bar(spikes_df), use_container_width=True)
+        show("commodity_spike_bar", version, commodity_rollup)
     with col2:
-        st.plotly_chart(market_spike_pie(spikes_df), use_container_width=True)
+        show("market_spike_pie", version, rollups["market"])
 
     st.subheader(f"📊 Top Markets for {top_commodity}")
-    st.plotly_chart(top_markets_for_top_commodity(spikes_df, top_commodity), use_container_width=True)
+    show("top_markets_for_top_commodity", version, rollups["market_commodity"], top_commodity)
 
     st.subheader("🏆 Top 10 Commodities by Spike %")
-    st.plotly_chart(top10_commodities_spikes(spikes_df), use_container_width=True)
+    show("top10_commodities_spikes", version, commodity_rollup)
 
     st.subheader("🗺 State and Market Insights")
     col1, col2 = st.columns(2)
     with col1:
-        st.plotly_chart(state_wise_spike_map(spikes_df), use_container_width=True)
+        show("state_wise_spike_map", version, rollups["state"])
     with col2:
-        st.plotly_chart(market_commodity_heatmap(spikes_df), use_container_width=True)
+        show("market_commodity_heatmap", version, rollups["market_commodity"])
 
     # Advanced Visualizations
     st.subheader("⚡ Spike Severity Distribution")
-    st.plotly_chart(spike_severity_pie(spikes_df), use_container_width=True)
+    show("spike_severity_pie", version, rollups["commodity_alert"])
 
     st.subheader("📈 Spike Trend Over Time")
-    st.plotly_chart(spike_trend_over_time(spikes_df), use_container_width=True)
+    show("spike_trend_over_time", version, rollups["monthly"])
 
     st.subheader("🔥 Commodity vs Spike Severity Heatmap")
-    st.plotly_chart(commodity_severity_heatmap(spikes_df), use_container_width=True)
+    show("commodity_severity_heatmap", version, rollups["commodity_alert"])
 
     st.subheader("🏆 Top States by Average Spike %")
-    st.plotly_chart(top_states_by_spike(spikes_df), use_container_width=True)
+    show("top_states_by_spike", version, rollups["state"])
 
     st.subheader("📊 Spike Count per Market")
-    st.plotly_chart(spike_count_per_market(spikes_df), use_container_width=True)
+    show("spike_count_per_market", version, rollups["market"])
+
+    st.subheader("📅 Monthly Average Spike Heatmap")
+    show("monthly_spike_heatmap", version, rollups["monthly"])
+
+    # New Interactive Plots (row-level data)
+    days = ROW_PERIODS[period]
+    spikes_df, version = get_spikes(days)
+    rows_key = (version, days)  # figures are cached per data version and period
 
-    # New Interactive Plots
     st.subheader("📦 Commodity Spike Distribution (Box Plot)")
-    st.plotly_chart(commodity_box_plot(spikes_df), use_container_width=True)
+    show("commodity_box_plot", rows_key, spikes_df, budget)
 
     st.subheader("🔍 Market vs Spike % Scatter")
-    st.plotly_chart(market_spike_scatter(spikes_df), use_container_width=True)
-
-    st.subheader("📅 Monthly Average Spike Heatmap")
-    st.plotly_chart(monthly_spike_heatmap(spikes_df), use_container_width=True)
+    show("market_spike_scatter", rows_key, spikes_df, budget)
 
     st.subheader("📈 Cumulative Spikes Timeline")
-    st.plotly_chart(cumulative_spikes_timeline(spikes_df), use_container_width=True)
+    show("cumulative_spikes_timeline", rows_key, spikes_df, budget)
 
 
 if __name__ == "__main__":
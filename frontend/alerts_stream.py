@@ -0,0 +1,229 @@
+"""Live spike alerts over Server-Sent Events.
+
+Run next to app.py:  python alerts_stream.py [port]
+Subscribe with:      new EventSource("http://host:8001/alerts?alert_level=High&commodity=Onion")
+
+One poller watches the spike id high-water mark and fans new rows out
+to every subscriber, so the table is queried once per poll no matter how many
+clients are connected. Idle subscribers cost one coroutine and a small queue each.
+"""
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import sys
+from urllib.parse import urlsplit, parse_qs, quote
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "..", "database", "spikealert.db")  # same DB as app.py
+
+PORT = 8001
+POLL_INTERVAL = 2.0        # seconds between high-water mark checks
+KEEPALIVE_INTERVAL = 15.0  # seconds between comment pings on an idle stream
+FETCH_LIMIT = 5000         # rows read per poll; a bigger backlog is read over several polls
+QUEUE_SIZE = 100           # pending batches per subscriber before it is dropped as too slow
+
+SPIKE_COLUMNS = ["id", "commodity", "market", "state", "date", "old_price", "new_price", "spike_percent", "alert_level"]
+
+# -----------------------------
+# Change detection
+# -----------------------------
+def _connect():
+    uri = f"file:{quote(os.path.abspath(DB_PATH))}?mode=ro"
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+def _id_bounds(conn):
+    """(MIN(id), MAX(id)) of the stored spikes, from the partition catalog (see backend/spike_partitions.py).
+
+    The catalog's bounds move only after a partition's rows are committed.
+    """
+    try:
+        return conn.execute("SELECT MIN(min_id), MAX(max_id) FROM spike_partitions WHERE live").fetchone()
+    except sqlite3.OperationalError:
+        pass
+    try:
+        # Database from before the spikes were partitioned
+        return conn.execute("SELECT MIN(id), MAX(id) FROM price_spikes").fetchone()
+    except sqlite3.OperationalError:
+        # Table not created yet (or dropped by db_reset.py)
+        return None, None
+
+def _rebuild_version(conn):
+    """The price_spikes:rebuild data version, bumped by full rebuilds and db_reset.py (see backend/db_config.py)."""
+    try:
+        row = conn.execute("SELECT value FROM pipeline_meta WHERE key = 'data_version:price_spikes:rebuild'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+def _rows_after(conn, high_water):
+    """Spike rows inserted after the high-water mark, oldest first."""
+    page_sql = f"""
+        SELECT {", ".join(SPIKE_COLUMNS)} FROM {{table}}
+        WHERE id > ? ORDER BY id LIMIT ?
+    """
+    try:
+        tables = [row[0] for row in conn.execute(
+            "SELECT table_name FROM spike_partitions WHERE live AND max_id > ?", (high_water,))]
+    except sqlite3.OperationalError:
+        tables = ["price_spikes"]
+    if not tables:
+        return []
+    # Only partitions holding new ids are read, each from its id index
+    branches = " UNION ALL ".join(f"SELECT * FROM ({page_sql.format(table=table)})" for table in tables)
+    rows = conn.execute(f"SELECT * FROM ({branches}) ORDER BY id LIMIT ?",
+                        [high_water, FETCH_LIMIT] * len(tables) + [FETCH_LIMIT]).fetchall()
+    return [dict(zip(SPIKE_COLUMNS, row)) for row in rows]
+
+def poll_new_spikes(conn, high_water, rebuild_version):
+    """Return (new rows, new high-water mark, rebuild version seen).
+
+    A full rebuild (or db_reset.py) re-inserts the history under new ids and bumps
+    the price_spikes:rebuild data version. A changed version only moves the mark to
+    the end of the table, so subscribers never get the history replayed as alerts.
+    While the table is empty (a rebuild has dropped the partitions but not refilled
+    them yet) the mark and version are kept, so the change is still seen once rows return.
+    """
+    _, high = _id_bounds(conn)
+    if high is None:
+        return [], high_water, rebuild_version
+    version = _rebuild_version(conn)
+    if version != rebuild_version or high < high_water:
+        print(f"🔹 price_spikes was rebuilt; high-water mark moved to {high}")
+        return [], high, version
+    if high == high_water:
+        return [], high_water, rebuild_version
+    rows = _rows_after(conn, high_water)
+    return rows, rows[-1]["id"] if rows else high_water, rebuild_version
+
+# -----------------------------
+# Subscribers
+# -----------------------------
+class Subscriber:
+    """One connected client: its filters and a bounded queue of encoded events."""
+
+    def __init__(self, alert_levels, commodities):
+        self.alert_levels = alert_levels
+        self.commodities = commodities
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    @property
+    def filter_key(self):
+        return self.alert_levels, self.commodities
+
+def _matches(row, alert_levels, commodities):
+    return ((not alert_levels or row["alert_level"] in alert_levels)
+            and (not commodities or row["commodity"] in commodities))
+
+def _json_value(value):
+    """inf/NaN (e.g. a spike from a zero price) become null; JSON.parse rejects Infinity."""
+    return None if isinstance(value, float) and not math.isfinite(value) else value
+
+def _encode_event(rows):
+    """One SSE message carrying a batch of spikes; the id lets clients see where they are."""
+    rows = [{key: _json_value(value) for key, value in row.items()} for row in rows]
+    data = json.dumps(rows, separators=(",", ":"), allow_nan=False)
+    return f"id: {rows[-1]['id']}\nevent: spikes\ndata: {data}\n\n".encode()
+
+subscribers = set()
+
+def broadcast(rows):
+    """Filter and encode once per distinct filter, then enqueue for every matching subscriber."""
+    encoded = {}
+    for subscriber in list(subscribers):
+        key = subscriber.filter_key
+        if key not in encoded:
+            matching = [row for row in rows if _matches(row, *key)]
+            encoded[key] = _encode_event(matching) if matching else None
+        if encoded[key] is None:
+            continue
+        try:
+            subscriber.queue.put_nowait(encoded[key])
+        except asyncio.QueueFull:
+            # Slow reader: drop it rather than buffer without bound; EventSource reconnects
+            subscribers.discard(subscriber)
+            subscriber.queue = None
+
+async def poll_forever():
+    """Single poller shared by all subscribers."""
+    conn = _connect()
+    try:
+        # Start at the current end of the table (0 if it is empty): only spikes inserted from now on are pushed
+        _, high_water = await asyncio.to_thread(_id_bounds, conn)
+        high_water = high_water or 0
+        rebuild_version = await asyncio.to_thread(_rebuild_version, conn)
+        print(f"✅ Watching price_spikes from id {high_water}")
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                rows, high_water, rebuild_version = await asyncio.to_thread(
+                    poll_new_spikes, conn, high_water, rebuild_version)
+            except sqlite3.Error as e:
+                print(f"❌ Poll failed: {e}")
+                continue
+            if rows and subscribers:
+                broadcast(rows)
+    finally:
+        conn.close()
+
+# -----------------------------
+# HTTP / SSE
+# -----------------------------
+def _parse_filter(query, name):
+    values = [v for item in query.get(name, []) for v in item.split(",") if v and v != "all"]
+    return frozenset(values)
+
+async def _send_response(writer, status, body=b""):
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+
+async def handle_client(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain the headers; nothing in them changes the response
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2 or parts[0] != "GET":
+            await _send_response(writer, "405 Method Not Allowed")
+            return
+        url = urlsplit(parts[1])
+        if url.path != "/alerts":
+            await _send_response(writer, "404 Not Found")
+            return
+
+        query = parse_qs(url.query)
+        subscriber = Subscriber(_parse_filter(query, "alert_level"), _parse_filter(query, "commodity"))
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\n"
+                     b"Access-Control-Allow-Origin: *\r\n\r\n"
+                     b"retry: 5000\n\n")
+        await writer.drain()
+
+        subscribers.add(subscriber)
+        try:
+            while subscriber.queue is not None:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = b": ping\n\n"  # keeps proxies from closing an idle stream
+                writer.write(event)
+                await writer.drain()
+        finally:
+            subscribers.discard(subscriber)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def main(port=PORT):
+    server = await asyncio.start_server(handle_client, "0.0.0.0", port, backlog=1024)
+    print(f"✅ Streaming spike alerts on http://0.0.0.0:{port}/alerts")
+    async with server:
+        await asyncio.gather(server.serve_forever(), poll_forever())
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else PORT))
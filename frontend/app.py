@@ -1,48 +1,391 @@
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, send_from_directory, request, redirect, url_for
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote, urlencode
+import hashlib
+import json
+import math
+import queue
+import re
 import sqlite3
+import threading
 import os
 
 app = Flask(__name__)
 
-DB_PATH = "../backend/spikealert.db"  # path to your SQLite DB from frontend
-VIS_DIR = "visualizations"            # folder with chart HTML files
+DB_PATH = os.path.join(os.path.dirname(__file__), "..", "database", "spikealert.db")  # same DB as backend/db_config.py
+VIS_DIR = os.path.join(os.path.dirname(__file__), "..", "backend", "visualizations")  # written by backend/export_charts.py
 
-# Serve visualization HTML files
+# /api/filter settings
+PAGE_SIZE = 100        # spike rows per page
+MAX_PAGE_SIZE = 1000
+TOP_MARKETS = 30       # markets shown in the market pie and heatmap
+
+# Per-worker connection pool and response cache
+POOL_SIZE = 8          # idle read-only connections kept per worker process
+CACHE_ENTRIES = 512    # cached JSON responses per worker process
+
+# -----------------------------
+# Read-only connection pool
+# -----------------------------
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def _connect():
+    """Open a read-only connection; the dashboard never writes."""
+    uri = f"file:{quote(os.path.abspath(DB_PATH))}?mode=ro"
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+def _get_pool():
+    """This worker's pool; recreated after a fork so children never share the parent's handles."""
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+                _pool_pid = os.getpid()
+    return _pool
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled read-only connection, opening one if the pool is empty."""
+    pool = _get_pool()
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+# -----------------------------
+# Response cache
+# -----------------------------
+_cache = OrderedDict()   # request key -> (data version, etag, body)
+_cache_lock = threading.Lock()
+
+def _data_version(conn):
+    """Data version bumped by the pipeline after every load (see backend/db_config.py)."""
+    try:
+        row = conn.execute("SELECT value FROM pipeline_meta WHERE key = 'data_version'").fetchone()
+    except sqlite3.OperationalError:
+        # Database not migrated yet: no version table, nothing to invalidate against
+        return 0
+    return row[0] if row else 0
+
+def _finite(value):
+    """value with inf/NaN floats (spikes from a zero old price) as None; JSON.parse rejects Infinity."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+def cached_json(build):
+    """Serve build(conn) as JSON, cached per URL until the data version changes.
+
+    Responses carry an ETag, so a client revalidating with If-None-Match gets a 304
+    for the price of one primary-key lookup.
+    """
+    key = request.path + "?" + urlencode(sorted(request.args.items(multi=True)))
+    with db_connection() as conn:
+        version = _data_version(conn)
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] == version:
+                _cache.move_to_end(key)
+            else:
+                entry = None
+
+        if entry is None:
+            body = json.dumps(_finite(build(conn)), separators=(",", ":"), allow_nan=False).encode()
+            entry = (version, f"{version}-{hashlib.sha1(body).hexdigest()[:16]}", body)
+            with _cache_lock:
+                _cache[key] = entry
+                while len(_cache) > CACHE_ENTRIES:
+                    _cache.popitem(last=False)
+
+    response = app.response_class(entry[2], mimetype="application/json")
+    response.set_etag(entry[1])
+    response.headers["Cache-Control"] = "no-cache"  # always revalidate against the data version
+    return response.make_conditional(request)
+
+# -----------------------------
+# Chart artifacts
+# -----------------------------
+ARTIFACT_MAX_AGE = 365 * 24 * 3600
+# <chart>.<hash>.html|json and plotly-<hash>.min.js: the content never changes under a name
+HASHED_ARTIFACT = re.compile(r"^[\w-]+\.[0-9a-f]{12}\.(html|json)$|^plotly-[0-9a-f]{12}\.min\.js$")
+
+_manifest = (None, None)   # (mtime, manifest)
+_manifest_lock = threading.Lock()
+
+def _chart_manifest():
+    """manifest.json of the last chart export, re-read only when the file changes."""
+    global _manifest
+    path = os.path.join(VIS_DIR, "manifest.json")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _manifest_lock:
+        if _manifest[0] != mtime:
+            with open(path, encoding="utf-8") as f:
+                _manifest = (mtime, json.load(f))
+        return _manifest[1]
+
+# Serve chart artifacts; chart names (commodity_bar.html, commodity_bar.json) redirect to the current hashed file
 @app.route('/visualizations/<filename>')
 def get_visualization(filename):
-    return send_from_directory(VIS_DIR, filename)
+    if HASHED_ARTIFACT.match(filename):
+        response = send_from_directory(VIS_DIR, filename, max_age=ARTIFACT_MAX_AGE)
+        response.headers["Cache-Control"] = f"public, max-age={ARTIFACT_MAX_AGE}, immutable"
+        return response
+
+    name, ext = os.path.splitext(filename)
+    manifest = _chart_manifest()
+    chart = manifest["charts"].get(name) if manifest else None
+    if chart and ext in (".html", ".json"):
+        return redirect(url_for("get_visualization", filename=chart[ext[1:]]))
+    response = send_from_directory(VIS_DIR, filename)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 # API endpoint for dropdown options
-@app.route('/api/options')
-def get_options():
-    conn = sqlite3.connect(DB_PATH)
+def _options(conn):
     cursor = conn.cursor()
 
-    cursor.execute("SELECT DISTINCT commodity FROM commodity_prices")
+    # Small dimension tables maintained by the ingestion pipeline
+    cursor.execute("SELECT name FROM commodities ORDER BY name")
     commodities = [row[0] for row in cursor.fetchall()]
 
-    cursor.execute("SELECT DISTINCT market FROM commodity_prices")
+    cursor.execute("SELECT DISTINCT name FROM markets ORDER BY name")
     markets = [row[0] for row in cursor.fetchall()]
 
-    cursor.execute("SELECT DISTINCT state FROM commodity_prices")
+    cursor.execute("SELECT name FROM states ORDER BY name")
     states = [row[0] for row in cursor.fetchall()]
 
-    conn.close()
-    return jsonify({"commodities": commodities, "markets": markets, "states": states})
+    return {"commodities": commodities, "markets": markets, "states": states}
 
-# Optional filtered visualization API (future)
+@app.route('/api/options')
+def get_options():
+    return cached_json(_options)
+
+# -----------------------------
+# Filtered chart data
+# -----------------------------
+def _filter_clause(args, table_alias=""):
+    """Build a WHERE clause and its parameters from commodity/market/state/start/end filters."""
+    conditions = []
+    params = []
+    for name in ("commodity", "market", "state"):
+        value = args.get(name, "all")
+        if value and value != "all":
+            conditions.append(f"{table_alias}{name} = ?")
+            params.append(value)
+    if args.get("start"):
+        conditions.append(f"{table_alias}date >= ?")
+        params.append(args["start"])
+    if args.get("end"):
+        conditions.append(f"{table_alias}date <= ?")
+        params.append(args["end"])
+    return conditions, params
+
+def _where(conditions):
+    return "WHERE " + " AND ".join(conditions) if conditions else ""
+
+class InvalidParameter(ValueError):
+    """A query parameter that could not be parsed; answered with a 400 JSON error."""
+
+@app.errorhandler(InvalidParameter)
+def invalid_parameter(error):
+    return {"error": str(error)}, 400
+
+def _int_arg(args, name, default):
+    """Integer query parameter, or default when it is missing or empty."""
+    value = args.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidParameter(f"{name} must be an integer, got {value!r}") from None
+
+# -----------------------------
+# Spike partitions (see backend/spike_partitions.py)
+# -----------------------------
+def _spike_tables(cursor, args, after_id=None):
+    """Monthly price_spikes partitions a query over args' start/end can touch, or None if unpartitioned."""
+    conditions, params = ["live"], []
+    if args.get("start"):
+        conditions.append("month >= ?")
+        params.append(args["start"][:7])
+    if args.get("end"):
+        conditions.append("month <= ?")
+        params.append(args["end"][:7])
+    if args.get("start") or args.get("end"):
+        conditions.append("month <> '0000-00'")  # undated spikes never match a date range
+    if after_id is not None:
+        conditions.append("max_id > ?")
+        params.append(after_id)
+    try:
+        return [row[0] for row in cursor.execute(
+            f"SELECT table_name FROM spike_partitions {_where(conditions)} ORDER BY month", params)]
+    except sqlite3.OperationalError:
+        return None
+
+def _spike_source(cursor, args):
+    """FROM target for spike queries: the union of the partitions in range, not the whole view."""
+    tables = _spike_tables(cursor, args)
+    if tables is None:
+        return "price_spikes"
+    if not tables:
+        return "(SELECT * FROM price_spikes LIMIT 0)"
+    # SQLite pushes the outer WHERE into every branch, so each partition uses its own indexes
+    return "(" + " UNION ALL ".join(f"SELECT * FROM {table}" for table in tables) + ")"
+
+def _resolve_days(cursor, args):
+    """days=N means the N days up to the newest stored spike; it sets start unless one was given."""
+    days = _int_arg(args, "days", None)
+    if days is not None and days < 1:
+        raise InvalidParameter(f"days must be a positive integer, got {days}")
+    if days is None or args.get("start"):
+        return args
+    try:
+        latest = cursor.execute("SELECT MAX(max_date) FROM spike_partitions WHERE live AND month <> '0000-00'").fetchone()[0]
+    except sqlite3.OperationalError:
+        latest = cursor.execute("SELECT MAX(date) FROM price_spikes").fetchone()[0]
+    if latest is None:
+        return args
+    start = cursor.execute("SELECT date(?, ?)", (latest, f"-{days} days")).fetchone()[0]
+    return {**args, "start": start}
+
+def _spike_aggregate(cursor, key_sql, conditions, params, limit=None, source="price_spikes"):
+    """Spike count and average spike % per key, as parallel lists."""
+    sql = f"""
+        SELECT {key_sql} AS key, COUNT(*) AS spike_count, ROUND(AVG(spike_percent), 2) AS avg_spike
+        FROM {source} {_where(conditions)}
+        GROUP BY key
+        ORDER BY spike_count DESC
+    """
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    rows = cursor.execute(sql, params).fetchall()
+    return {
+        "keys": [row[0] for row in rows],
+        "counts": [row[1] for row in rows],
+        "avg_spike": [row[2] for row in rows],
+    }
+
+def _market_commodity_matrix(cursor, conditions, params, markets, source="price_spikes"):
+    """Average spike % for the given markets x every commodity, as a dense matrix."""
+    if not markets:
+        return {"markets": [], "commodities": [], "z": []}
+    placeholders = ", ".join("?" * len(markets))
+    rows = cursor.execute(f"""
+        SELECT market, commodity, ROUND(AVG(spike_percent), 2)
+        FROM {source} {_where(conditions + [f"market IN ({placeholders})"])}
+        GROUP BY market, commodity
+    """, params + list(markets)).fetchall()
+    commodities = sorted({row[1] for row in rows})
+    cells = {(row[0], row[1]): row[2] for row in rows}
+    return {
+        "markets": list(markets),
+        "commodities": commodities,
+        "z": [[cells.get((market, commodity), 0) for commodity in commodities] for market in markets],
+    }
+
+def _price_trend(cursor, args, commodity):
+    """Daily average modal price of one commodity under the remaining filters."""
+    if commodity is None:
+        return {"commodity": None, "dates": [], "prices": []}
+    conditions, params = _filter_clause({**args, "commodity": commodity})
+    rows = cursor.execute(f"""
+        SELECT date, ROUND(AVG(price), 2) FROM commodity_prices {_where(conditions)}
+        GROUP BY date ORDER BY date
+    """, params).fetchall()
+    return {"commodity": commodity, "dates": [row[0] for row in rows], "prices": [row[1] for row in rows]}
+
+def _spike_rows(cursor, args, conditions, params, cursor_id, limit):
+    """One page of spike rows after cursor_id (keyset pagination on id)."""
+    columns = ["id", "commodity", "market", "state", "date", "old_price", "new_price", "spike_percent", "alert_level"]
+    page_sql = f"""
+        SELECT {", ".join(columns)} FROM {{table}} {_where(conditions + ["id > ?"])}
+        ORDER BY id LIMIT ?
+    """
+    tables = _spike_tables(cursor, args, after_id=cursor_id)
+    if tables is None:
+        rows = cursor.execute(page_sql.format(table="price_spikes"), params + [cursor_id, limit]).fetchall()
+    elif not tables:
+        rows = []
+    else:
+        # Each partition returns at most one page from its id index; the merge keeps the first page overall
+        branches = " UNION ALL ".join(f"SELECT * FROM ({page_sql.format(table=table)})" for table in tables)
+        rows = cursor.execute(f"SELECT * FROM ({branches}) ORDER BY id LIMIT ?",
+                              (params + [cursor_id, limit]) * len(tables) + [limit]).fetchall()
+    next_cursor = rows[-1][0] if len(rows) == limit else None
+    return {"columns": columns, "rows": [list(row) for row in rows], "next_cursor": next_cursor}
+
+# Filtered chart data and spike rows (?commodity=&market=&state=&start=&end=&days=&cursor=&limit=&view=charts|rows)
 @app.route('/api/filter')
 def filter_data():
-    commodity = request.args.get("commodity", "all")
-    market = request.args.get("market", "all")
-    state = request.args.get("state", "all")
-    # Implement logic to filter charts based on selections if needed
-    return jsonify({"status": "ok"})
+    return cached_json(_filter_payload)
+
+def _filter_payload(conn):
+    args = request.args.to_dict()
+    view = args.get("view", "all")
+    limit = min(max(_int_arg(args, "limit", PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    cursor_id = _int_arg(args, "cursor", 0)
+    cursor = conn.cursor()
+    args = _resolve_days(cursor, args)
+    conditions, params = _filter_clause(args)
+    source = _spike_source(cursor, args)
+    payload = {"filters": {k: args.get(k, "all") for k in ("commodity", "market", "state", "start", "end", "days")}}
+
+    if view in ("all", "charts"):
+        by_commodity = _spike_aggregate(cursor, "commodity", conditions, params, source=source)
+        by_market = _spike_aggregate(cursor, "market", conditions, params, limit=TOP_MARKETS, source=source)
+        commodity = args.get("commodity", "all")
+        if commodity == "all":
+            # Default the price trend to the commodity with the highest average spike
+            ranked = sorted(zip(by_commodity["avg_spike"], by_commodity["keys"]),
+                            key=lambda pair: pair[0] if pair[0] is not None else float("-inf"), reverse=True)
+            commodity = ranked[0][1] if ranked else None
+
+        payload.update({
+            "by_commodity": by_commodity,
+            "by_market": by_market,
+            "by_state": _spike_aggregate(cursor, "state", conditions, params, source=source),
+            "by_alert_level": _spike_aggregate(cursor, "alert_level", conditions, params, source=source),
+            "monthly": _spike_aggregate(cursor, "substr(date, 1, 7)", conditions, params, source=source),
+            "market_commodity": _market_commodity_matrix(cursor, conditions, params, by_market["keys"], source),
+            "price_trend": _price_trend(cursor, args, commodity),
+        })
+        # Months read best in calendar order
+        order = sorted(range(len(payload["monthly"]["keys"])), key=lambda i: payload["monthly"]["keys"][i] or "")
+        payload["monthly"] = {k: [v[i] for i in order] for k, v in payload["monthly"].items()}
+
+    if view in ("all", "rows"):
+        payload["spikes"] = _spike_rows(cursor, args, conditions, params, cursor_id, limit)
+
+    return payload
 
 # Serve index.html
 @app.route('/')
 def index():
     return send_from_directory('.', 'index.html')
 
+# Serve the page's script and stylesheet
+@app.route('/<any("main.js", "style.css"):filename>')
+def get_asset(filename):
+    return send_from_directory('.', filename)
+
 if __name__ == "__main__":
     app.run()
@@ -1,4 +1,6 @@
 import streamlit as st
+import plotly.io as pio
+import json
 import os
 
 # --- PAGE SETUP ---
@@ -12,34 +14,56 @@ st.title("📊 BlackMarket Price Spike Intelligence Dashboard")
 st.markdown("### Live Visualization of Detected Commodity Price Spikes")
 
 # --- VISUALIZATION PATH ---
-VIS_DIR = os.path.join(os.getcwd(), "visualizations")
+# Chart artifacts written by backend/export_charts.py (also served by app.py)
+VIS_DIR = os.path.join(os.path.dirname(__file__), "..", "backend", "visualizations")
 
-# --- Function to display a visualization file ---
-def display_viz(file_name, title):
-    file_path = os.path.join(VIS_DIR, file_name)
-    if os.path.exists(file_path):
+# --- Chart artifacts, read once per export ---
+@st.cache_data(max_entries=2)
+def load_manifest(mtime):
+    with open(os.path.join(VIS_DIR, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+@st.cache_resource(max_entries=32)
+def load_figure(file_name):
+    """Figure from its content-hashed JSON file; the name changes whenever the chart does."""
+    with open(os.path.join(VIS_DIR, file_name), encoding="utf-8") as f:
+        return pio.from_json(f.read())
+
+def current_manifest():
+    try:
+        mtime = os.stat(os.path.join(VIS_DIR, "manifest.json")).st_mtime_ns
+    except OSError:
+        return None
+    return load_manifest(mtime)
+
+manifest = current_manifest()
+if manifest is None:
+    st.warning("No exported charts found. Run the pipeline (or backend/export_charts.py) first.")
+
+# --- Function to display a visualization ---
+def display_viz(chart_name, title):
+    chart = manifest["charts"].get(chart_name) if manifest else None
+    if chart and os.path.exists(os.path.join(VIS_DIR, chart["json"])):
         st.markdown(f"#### {title}")
-        with open(file_path, "r", encoding="utf-8") as f:
-            html_data = f.read()
-            st.components.v1.html(html_data, height=500, scrolling=True)
+        st.plotly_chart(load_figure(chart["json"]), use_container_width=True, key=chart_name)
     else:
-        st.warning(f"Visualization '{file_name}' not found.")
+        st.warning(f"Visualization '{chart_name}' not found.")
 
 # --- DASHBOARD SECTIONS ---
 col1, col2 = st.columns(2)
 
 with col1:
-    display_viz("commodity_bar.html", "Commodity-wise Average Prices")
-    display_viz("market_pie.html", "Market-wise Distribution")
+    display_viz("commodity_bar", "Commodity-wise Average Prices")
+    display_viz("market_pie", "Market-wise Distribution")
 
 with col2:
-    display_viz("top_commodity_line.html", "Price Trend of Top Commodities")
-    display_viz("top10_commodities.html", "Top 10 Commodities by Spike Frequency")
+    display_viz("top_commodity_line", "Price Trend of Top Commodities")
+    display_viz("top10_commodities", "Top 10 Commodities by Spike Frequency")
 
 st.divider()
 
-display_viz("state_map.html", "State-wise Spike Map")
-display_viz("market_commodity_heatmap.html", "Market-Commodity Heatmap")
+display_viz("state_map", "State-wise Spike Map")
+display_viz("market_commodity_heatmap", "Market-Commodity Heatmap")
 
 st.markdown("---")
 st.markdown("✅ **Dashboard powered by AI Spike Detection Pipeline**")
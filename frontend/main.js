@@ -10,7 +10,7 @@ function populateSelect(selectElement, options) {
     selectElement.innerHTML = '<option value="all">All</option>'; // reset
     options.forEach(opt => {
         const el = document.createElement('option');
-        el.value = opt.toLowerCase();
+        el.value = opt; // exact value: the API filters with equality on the stored name
         el.textContent = opt;
         selectElement.appendChild(el);
     });
@@ -24,20 +24,128 @@ async function initFilters() {
     populateSelect(document.getElementById('stateSelect'), states);
 }
 
+// -----------------------------
+// Filtered chart data
+// -----------------------------
+const darkLayout = {
+    paper_bgcolor: '#1f1f1f',
+    plot_bgcolor: '#1f1f1f',
+    font: { color: '#e0e0e0' },
+    margin: { t: 20, r: 20, b: 60, l: 60 },
+};
+const plotConfig = { responsive: true, displaylogo: false };
+
+let nextCursor = null;
+
+function currentFilters() {
+    const params = new URLSearchParams({
+        commodity: document.getElementById('commoditySelect').value,
+        market: document.getElementById('marketSelect').value,
+        state: document.getElementById('stateSelect').value,
+    });
+    const start = document.getElementById('startDate').value;
+    const end = document.getElementById('endDate').value;
+    const days = document.getElementById('periodSelect').value;
+    if (start) params.set('start', start);
+    if (end) params.set('end', end);
+    // A relative period only applies when no explicit start date is set
+    if (days !== 'all' && !start) params.set('days', days);
+    return params;
+}
+
+function renderCharts(data) {
+    const byCommodity = data.by_commodity;
+    Plotly.react('commodityBar', [{
+        type: 'bar', x: byCommodity.keys, y: byCommodity.avg_spike, marker: { color: '#ff4d6d' },
+    }], { ...darkLayout, yaxis: { title: 'Avg Spike %' } }, plotConfig);
+
+    Plotly.react('marketPie', [{
+        type: 'pie', labels: data.by_market.keys, values: data.by_market.counts, textinfo: 'none',
+    }], { ...darkLayout, showlegend: false }, plotConfig);
+
+    const trend = data.price_trend;
+    Plotly.react('topCommodityLine', [{
+        type: 'scatter', mode: 'lines', x: trend.dates, y: trend.prices, name: trend.commodity,
+    }], { ...darkLayout, yaxis: { title: trend.commodity ? `${trend.commodity} price` : 'Price' } }, plotConfig);
+
+    // Top 10 by average spike %
+    const ranked = byCommodity.keys
+        .map((key, i) => ({ key, value: byCommodity.avg_spike[i] }))
+        .sort((a, b) => b.value - a.value)
+        .slice(0, 10);
+    Plotly.react('top10Commodities', [{
+        type: 'bar', orientation: 'h', x: ranked.map(r => r.value).reverse(), y: ranked.map(r => r.key).reverse(),
+        marker: { color: '#ff8fa3' },
+    }], { ...darkLayout, margin: { ...darkLayout.margin, l: 120 } }, plotConfig);
+
+    Plotly.react('stateMap', [{
+        type: 'bar', x: data.by_state.keys, y: data.by_state.avg_spike, marker: { color: '#c9184a' },
+    }], { ...darkLayout, yaxis: { title: 'Avg Spike %' } }, plotConfig);
+
+    const matrix = data.market_commodity;
+    Plotly.react('heatmap', [{
+        type: 'heatmap', x: matrix.commodities, y: matrix.markets, z: matrix.z, colorscale: 'Reds',
+    }], { ...darkLayout, margin: { ...darkLayout.margin, l: 120 } }, plotConfig);
+}
+
+function appendRows(spikes, reset) {
+    const body = document.getElementById('spikeRows');
+    if (reset) body.innerHTML = '';
+    spikes.rows.forEach(row => {
+        const tr = document.createElement('tr');
+        // Skip the id column; it only drives pagination
+        row.slice(1).forEach(value => {
+            const td = document.createElement('td');
+            td.textContent = value === null ? '' : value;
+            tr.appendChild(td);
+        });
+        body.appendChild(tr);
+    });
+    nextCursor = spikes.next_cursor;
+    document.getElementById('loadMore').disabled = nextCursor === null;
+}
+
+async function loadDashboard() {
+    const response = await fetch('/api/filter?' + currentFilters().toString());
+    const data = await response.json();
+    renderCharts(data);
+    appendRows(data.spikes, true);
+}
+
+async function loadMoreRows() {
+    if (nextCursor === null) return;
+    const params = currentFilters();
+    params.set('view', 'rows');
+    params.set('cursor', nextCursor);
+    const response = await fetch('/api/filter?' + params.toString());
+    const data = await response.json();
+    appendRows(data.spikes, false);
+}
+
+// -----------------------------
+// Live alerts (alerts_stream.py)
+// -----------------------------
+const ALERTS_URL = `${location.protocol}//${location.hostname}:8001/alerts?alert_level=High,Medium`;
+const MAX_LIVE_ALERTS = 50;
+
+function startLiveAlerts() {
+    const list = document.getElementById('liveAlerts');
+    const source = new EventSource(ALERTS_URL);
+    source.addEventListener('spikes', event => {
+        JSON.parse(event.data).forEach(spike => {
+            const li = document.createElement('li');
+            li.className = `alert-${spike.alert_level.toLowerCase()}`;
+            li.textContent = `${spike.date} · ${spike.commodity} @ ${spike.market}: ` +
+                `${spike.spike_percent === null ? 'n/a' : spike.spike_percent.toFixed(1) + '%'} (${spike.alert_level})`;
+            list.prepend(li);
+        });
+        while (list.children.length > MAX_LIVE_ALERTS) list.lastChild.remove();
+    });
+}
+
 initFilters();
+loadDashboard();
+startLiveAlerts();
 
-// Update iframe src on filter
-document.getElementById('applyFilters').addEventListener('click', () => {
-    const commodity = document.getElementById('commoditySelect').value;
-    const market = document.getElementById('marketSelect').value;
-    const state = document.getElementById('stateSelect').value;
-
-    const params = `?commodity=${commodity}&market=${market}&state=${state}`;
-
-    document.getElementById('commodityBar').src = "visualizations/commodity_bar.html" + params;
-    document.getElementById('marketPie').src = "visualizations/market_pie.html" + params;
-    document.getElementById('topCommodityLine').src = "visualizations/top_commodity_line.html" + params;
-    document.getElementById('top10Commodities').src = "visualizations/top10_commodities.html" + params;
-    document.getElementById('stateMap').src = "visualizations/state_map.html" + params;
-    document.getElementById('heatmap').src = "visualizations/market_commodity_heatmap.html" + params;
-});
+document.getElementById('applyFilters').addEventListener('click', loadDashboard);
+document.getElementById('loadMore').addEventListener('click', loadMoreRows);
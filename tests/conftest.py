@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.join(ROOT, "frontend"))
+
+import db_config
+import instrumentation
+import parquet_store
+import series_store
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """An empty database and stores under tmp_path."""
+    monkeypatch.setattr(db_config, "DB_PATH", str(tmp_path / "spikealert.db"))
+    monkeypatch.setattr(series_store, "STORE_DIR", str(tmp_path / "series_store"))
+    monkeypatch.setattr(parquet_store, "STORE_DIR", str(tmp_path / "prices_parquet"))
+    monkeypatch.setattr(instrumentation, "METRICS_LOG", str(tmp_path / "pipeline_metrics.jsonl"))
+    db_config.initialize_database()
+    return tmp_path
+
+
+def make_prices(series=12, days=25, seed=0):
+    """Random-walk prices for several series of different lengths, in shuffled row order."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(series):
+        dates = pd.date_range("2024-01-01", periods=days - i % 5).strftime("%Y-%m-%d")
+        frames.append(pd.DataFrame({
+            "state": f"State {i % 3}", "district": "District", "market": f"Market {i}",
+            "commodity": f"Commodity {i % 4}", "variety": "Other", "date": dates,
+            "min": 0.0, "max": 0.0,
+            "price": np.round(100 * np.cumprod(1 + rng.normal(0, 0.1, len(dates))), 2),
+        }))
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def reject_constant(token):
+    """json.loads parse_constant hook that, like the browser's JSON.parse, rejects Infinity and NaN."""
+    raise ValueError(f"{token} is not valid JSON")
+
+
+def insert_prices(df):
+    conn = db_config.get_db_connection()
+    df.to_sql("commodity_prices", conn, if_exists="append", index=False)
+    conn.commit()
+    conn.close()
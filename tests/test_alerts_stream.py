@@ -0,0 +1,69 @@
+import json
+import sqlite3
+
+import alerts_stream
+import anomaly_detection
+import db_config
+from conftest import make_prices, insert_prices, reject_constant
+from spike_partitions import drop_partitions
+
+
+def watch():
+    """A read connection and the poller's starting (mark, rebuild version), as in poll_forever."""
+    conn = sqlite3.connect(db_config.DB_PATH)
+    _, high_water = alerts_stream._id_bounds(conn)
+    return conn, high_water or 0, alerts_stream._rebuild_version(conn)
+
+
+def spike_count():
+    conn = db_config.get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM price_spikes").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_first_spikes_after_watching_an_empty_table_are_delivered(database):
+    conn, high_water, version = watch()
+    insert_prices(make_prices(series=3, days=5))
+    anomaly_detection.detect_spikes()
+
+    rows, high_water, version = alerts_stream.poll_new_spikes(conn, high_water, version)
+
+    assert len(rows) == spike_count()
+    assert high_water == rows[-1]["id"]
+
+
+def test_full_rebuild_is_not_replayed_as_alerts(database):
+    prices = make_prices(series=3, days=10)
+    insert_prices(prices[prices["date"] < "2024-01-08"])
+    anomaly_detection.detect_spikes()
+    conn, high_water, version = watch()
+
+    # Mid-rebuild: the partitions are dropped and the rebuild version bumped, nothing re-inserted yet
+    writer = db_config.get_db_connection()
+    drop_partitions(writer)
+    db_config.bump_data_version(writer, "price_spikes:rebuild")
+    writer.close()
+    rows, mark, seen = alerts_stream.poll_new_spikes(conn, high_water, version)
+    assert (rows, mark, seen) == ([], high_water, version)
+
+    anomaly_detection.detect_spikes(full_rebuild=True)
+    rows, high_water, version = alerts_stream.poll_new_spikes(conn, high_water, version)
+    assert rows == []
+
+    # Only spikes detected after the rebuild are new
+    later = prices[prices["date"] >= "2024-01-08"]
+    insert_prices(later)
+    anomaly_detection.detect_spikes()
+    rows, high_water, version = alerts_stream.poll_new_spikes(conn, high_water, version)
+    assert sorted((row["market"], row["date"]) for row in rows) == sorted(zip(later["market"], later["date"]))
+
+
+def test_non_finite_spike_percent_is_sent_as_null():
+    event = alerts_stream._encode_event([{"id": 1, "spike_percent": float("inf")},
+                                         {"id": 2, "spike_percent": float("nan")}])
+    data = event.decode().split("data: ", 1)[1]
+
+    # Like the browser's JSON.parse, reject Infinity and NaN
+    assert json.loads(data, parse_constant=reject_constant) == [
+        {"id": 1, "spike_percent": None}, {"id": 2, "spike_percent": None}]
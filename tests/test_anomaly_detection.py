@@ -0,0 +1,73 @@
+import pandas as pd
+
+import anomaly_detection
+import db_config
+import db_reset
+import series_store
+from conftest import make_prices, insert_prices
+
+SPIKE_KEY = ["commodity", "market", "date"]
+SPIKE_FIELDS = SPIKE_KEY + ["old_price", "new_price"]
+
+
+def expected_spikes(df):
+    """Every day-over-day change, computed independently with a groupby shift."""
+    df = df.sort_values(SPIKE_KEY).reset_index(drop=True)
+    df["old_price"] = df.groupby(["commodity", "market"])["price"].shift()
+    df = df.dropna(subset=["old_price"]).rename(columns={"price": "new_price"})
+    return df[SPIKE_FIELDS].reset_index(drop=True)
+
+
+def stored_spikes():
+    conn = db_config.get_db_connection()
+    df = pd.read_sql_query(f"SELECT {', '.join(SPIKE_FIELDS)} FROM price_spikes", conn)
+    conn.close()
+    return df.sort_values(SPIKE_KEY).reset_index(drop=True)
+
+
+def test_full_rebuild_pairs_rows_across_chunk_boundaries(database):
+    prices = make_prices()
+    insert_prices(prices)
+
+    # 7-row chunks cut nearly every series, most of them several times
+    anomaly_detection.detect_spikes(chunk_size=7, full_rebuild=True)
+
+    pd.testing.assert_frame_equal(stored_spikes(), expected_spikes(prices))
+
+
+def test_full_rebuild_from_series_store_matches_sql(database):
+    prices = make_prices()
+    insert_prices(prices)
+    series_store.build()
+
+    anomaly_detection.detect_spikes(chunk_size=7, full_rebuild=True)
+
+    pd.testing.assert_frame_equal(stored_spikes(), expected_spikes(prices))
+
+
+def test_incremental_runs_continue_each_series(database):
+    prices = make_prices()
+    first = prices["date"] < "2024-01-12"
+    insert_prices(prices[first])
+    anomaly_detection.detect_spikes(chunk_size=7)
+    insert_prices(prices[~first])
+    anomaly_detection.detect_spikes(chunk_size=7)
+
+    pd.testing.assert_frame_equal(stored_spikes(), expected_spikes(prices))
+
+
+def test_incremental_run_after_reset_reads_reloaded_rows(database):
+    prices = make_prices()
+    insert_prices(prices)
+    anomaly_detection.detect_spikes(chunk_size=7)
+
+    conn = db_config.get_db_connection()
+    db_reset.reset_database(conn)
+    conn.close()
+    db_config.initialize_database()
+    # The reloaded rows reuse ids at or below the old run's watermark
+    reloaded = prices[prices["date"] < "2024-01-12"]
+    insert_prices(reloaded)
+    anomaly_detection.detect_spikes(chunk_size=7)
+
+    pd.testing.assert_frame_equal(stored_spikes(), expected_spikes(reloaded))
@@ -0,0 +1,59 @@
+import json
+
+import pandas as pd
+import pytest
+
+import anomaly_detection
+import app
+import db_config
+from conftest import make_prices, insert_prices, reject_constant
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    """A test client reading the temporary database, with an empty pool and response cache."""
+    monkeypatch.setattr(app, "DB_PATH", db_config.DB_PATH)
+    monkeypatch.setattr(app, "_pool_pid", None)
+    app._cache.clear()
+    return app.app.test_client()
+
+
+def test_spike_from_zero_price_is_served_as_null(client):
+    insert_prices(pd.DataFrame({
+        "state": "State", "district": "District", "market": "Market", "commodity": "Onion", "variety": "Other",
+        "date": ["2024-01-01", "2024-01-02"], "min": 0.0, "max": 0.0, "price": [0.0, 50.0],
+    }))
+    anomaly_detection.detect_spikes()
+
+    response = client.get("/api/filter")
+
+    assert response.status_code == 200
+    # Like the browser's response.json(), reject Infinity and NaN
+    payload = json.loads(response.get_data(as_text=True), parse_constant=reject_constant)
+    assert payload["spikes"]["rows"][0][7] is None
+    assert payload["by_commodity"]["avg_spike"] == [None]
+
+
+@pytest.mark.parametrize("query", ["limit=abc", "cursor=x", "days=abc", "days=0"])
+def test_invalid_integer_parameters_are_rejected(client, query):
+    response = client.get(f"/api/filter?{query}")
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_rows_are_paged_by_cursor(client):
+    insert_prices(make_prices(series=4, days=10))
+    anomaly_detection.detect_spikes()
+
+    ids, cursor = [], 0
+    while cursor is not None:
+        page = client.get(f"/api/filter?view=rows&limit=7&cursor={cursor}").get_json()["spikes"]
+        assert len(page["rows"]) <= 7
+        ids += [row[0] for row in page["rows"]]
+        cursor = page["next_cursor"]
+
+    conn = db_config.get_db_connection()
+    stored = [row[0] for row in conn.execute("SELECT id FROM price_spikes ORDER BY id")]
+    conn.close()
+    assert ids == stored